@@ -1,5 +1,13 @@
 # auth/ad_auth.py
 import ldap
+import ldap.filter
+import time
+import queue
+import asyncio
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from metrics import timed, counter
 from dotenv import load_dotenv
 import os
 
@@ -8,11 +16,197 @@ load_dotenv()
 # Настройки AD
 AD_SERVER = os.getenv("AD_SERVER")  # например, "ldap://ad.company.com"
 AD_DOMAIN = os.getenv("AD_DOMAIN")  # например, "company.com"
+# Сервисная учётная запись для поиска displayName через пул постоянных соединений.
+# Без неё каждый вход открывает новое соединение и ищет от имени пользователя
+AD_BIND_DN = os.getenv("AD_BIND_DN", "")
+AD_BIND_PASSWORD = os.getenv("AD_BIND_PASSWORD", "")
+# База поиска и формат логина (для тестового LDAP-сервера вместо AD)
+AD_BASE_DN = os.getenv("AD_BASE_DN", "")
+AD_USER_DN_TEMPLATE = os.getenv("AD_USER_DN_TEMPLATE", "{username}@{domain}")
+AD_USER_FILTER = os.getenv("AD_USER_FILTER", "(sAMAccountName={username})")
+AD_TIMEOUT = float(os.getenv("AD_TIMEOUT", 5))  # секунды на подключение и на операцию
+AD_POOL_SIZE = int(os.getenv("AD_POOL_SIZE", 4))
+AD_AUTH_WORKERS = int(os.getenv("AD_AUTH_WORKERS", 8))
+# Сколько секунд помнить ФИО пользователя (0 — не кэшировать)
+AD_NAME_CACHE_TTL = float(os.getenv("AD_NAME_CACHE_TTL", 3600))
+
+LOGINS = counter("auth_logins_total", "Попытки входа через AD по результату")
+NAME_CACHE = counter("auth_name_cache_total", "Обращения к кэшу ФИО пользователей по результату")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_names = {}
+_names_lock = threading.Lock()
+
+
+class ADUnavailableError(RuntimeError):
+    """
+    Пароль пользователя не удалось проверить: AD недоступен или не принимает
+    сервисную учётную запись. Неудачной попыткой входа это не считается
+    """
+
+
+def _base_dn() -> str:
+    return AD_BASE_DN or ".".join(["DC=" + part for part in AD_DOMAIN.split(".")])
+
+
+def _connect():
+    """Новое соединение с таймаутами, чтобы недоступный сервер не вешал вход"""
+    conn = ldap.initialize(AD_SERVER)
+    conn.protocol_version = ldap.VERSION3
+    conn.set_option(ldap.OPT_REFERRALS, 0)  # Важно для Active Directory
+    conn.set_option(ldap.OPT_NETWORK_TIMEOUT, AD_TIMEOUT)
+    conn.set_option(ldap.OPT_TIMEOUT, AD_TIMEOUT)
+    return conn
+
+
+def _unbind(conn):
+    try:
+        conn.unbind_s()
+    except ldap.LDAPError:
+        pass
+
+
+def _bind_service(conn):
+    """Привязка к сервисной учётной записи; её отказ — ошибка настройки, а не неверный пароль пользователя"""
+    try:
+        conn.simple_bind_s(AD_BIND_DN, AD_BIND_PASSWORD)
+    except (ldap.INVALID_CREDENTIALS, ldap.INSUFFICIENT_ACCESS, ldap.UNWILLING_TO_PERFORM) as e:
+        print(f"❌ AD не принял сервисную учётную запись {AD_BIND_DN}: {e}")
+        raise ADUnavailableError("Сервисная учётная запись AD не принята (проверьте AD_BIND_DN и AD_BIND_PASSWORD)") from e
+
+
+class _ConnectionPool:
+    """Пул соединений, привязанных к сервисной учётной записи"""
+
+    def __init__(self, size: int = AD_POOL_SIZE):
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _flush(self):
+        """Закрывает простаивающие соединения (после простоя сервер их уже разорвал)"""
+        while True:
+            try:
+                _unbind(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    @contextmanager
+    def connection(self, fresh: bool = False):
+        """
+        Выдаёт соединение из пула (или открывает новое).
+        Соединение, на котором произошла ошибка, закрывается и в пул не возвращается.
+        :param fresh: закрыть простаивающие соединения и открыть новое
+        """
+        if not self._slots.acquire(timeout=AD_TIMEOUT):
+            raise ldap.TIMEOUT({"desc": "Пул соединений AD занят"})
+        conn = None
+        try:
+            if fresh:
+                self._flush()
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = _connect()
+                _bind_service(conn)
+            yield conn
+        except Exception:
+            if conn is not None:
+                _unbind(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._idle.put(conn)
+            self._slots.release()
+
+
+_pool = _ConnectionPool()
+
+
+def _cached_name(username: str) -> str | None:
+    with _names_lock:
+        item = _names.get(username.lower())
+    if item is None or item[0] < time.monotonic():
+        return None
+    return item[1]
+
+
+def _remember_name(username: str, full_name: str):
+    if AD_NAME_CACHE_TTL <= 0:
+        return
+    with _names_lock:
+        _names[username.lower()] = (time.monotonic() + AD_NAME_CACHE_TTL, full_name)
+
+
+def _display_name(conn, username: str) -> str:
+    """ФИО пользователя из AD (или логин, если найти не удалось)"""
+    full_name = _cached_name(username)
+    NAME_CACHE.inc(result="miss" if full_name is None else "hit")
+    if full_name is not None:
+        return full_name
+    try:
+        search_filter = AD_USER_FILTER.format(username=ldap.filter.escape_filter_chars(username))
+        result = conn.search_st(_base_dn(), ldap.SCOPE_SUBTREE, search_filter, ['displayName'], timeout=AD_TIMEOUT)
+        # В выдаче AD бывают ссылки (referrals) без атрибутов — берём первую запись с DN
+        entries = [attrs for dn, attrs in result if dn]
+        if entries and entries[0].get('displayName'):
+            full_name = entries[0]['displayName'][0].decode('utf-8')
+        else:
+            full_name = username
+    except ldap.SERVER_DOWN:
+        raise
+    except Exception as e:
+        print(f"⚠️ Не удалось получить ФИО: {e}")
+        return username
+    _remember_name(username, full_name)
+    return full_name
+
+
+def _authenticate_direct(user_dn: str, username: str, password: str) -> str:
+    """Вход без сервисной учётной записи: отдельное соединение, поиск от имени пользователя"""
+    conn = _connect()
+    try:
+        conn.simple_bind_s(user_dn, password)
+        return _display_name(conn, username)
+    finally:
+        _unbind(conn)
+
+
+def _authenticate_pooled(user_dn: str, username: str, password: str) -> str:
+    """
+    Вход через пул: пароль проверяется bind'ом на готовом соединении,
+    после чего оно снова привязывается к сервисной учётной записи
+    """
+    for attempt in range(2):
+        try:
+            with _pool.connection(fresh=attempt > 0) as conn:
+                try:
+                    conn.simple_bind_s(user_dn, password)
+                    valid = True
+                except ldap.INVALID_CREDENTIALS:
+                    valid = False
+                # В пул соединение возвращается привязанным к сервисной учётной записи
+                _bind_service(conn)
+                full_name = _display_name(conn, username) if valid else None
+            break
+        except ldap.SERVER_DOWN:
+            # Простаивающие соединения пула могли быть закрыты сервером — повторяем на новом
+            if attempt:
+                raise
+
+    if full_name is None:
+        raise ldap.INVALID_CREDENTIALS({"desc": "Invalid credentials"})
+    return full_name
+
 
 def authenticate_user(username: str, password: str) -> tuple[bool, str]:
     """
     Аутентификация через Active Directory с помощью python-ldap.
-    Использует формат user@domain.com
+    Использует формат user@domain.com. Блокирующая — из event loop
+    вызывайте aauthenticate_user.
+    :raises ADUnavailableError: если пароль не удалось проверить (AD недоступен или не настроен)
     """
     if not AD_SERVER or not AD_DOMAIN:
         return False, "Ошибка конфигурации: проверьте AD_SERVER и AD_DOMAIN в .env"
@@ -23,40 +217,43 @@ def authenticate_user(username: str, password: str) -> tuple[bool, str]:
     if not username or not password:
         return False, "Логин и пароль обязательны"
 
-    try:
-        # Инициализация подключения
-        conn = ldap.initialize(AD_SERVER)
-        conn.protocol_version = ldap.VERSION3
-        conn.set_option(ldap.OPT_REFERRALS, 0)  # Важно для Active Directory
-
-        # Формат: user@domain.com
-        user_dn = f"{username}@{AD_DOMAIN}"
-
-        # Пробуем подключиться
-        conn.simple_bind_s(user_dn, password)
-
-        # Успешно → получим ФИО (опционально)
-        try:
-            base_dn = ".".join(["DC=" + part for part in AD_DOMAIN.split(".")])
-            search_filter = f"(sAMAccountName={username})"
-            result = conn.search_s(base_dn, ldap.SCOPE_SUBTREE, search_filter, ['displayName'])
+    # Формат: user@domain.com
+    user_dn = AD_USER_DN_TEMPLATE.format(username=username, domain=AD_DOMAIN)
 
-            if result:
-                entry = result[0][1]
-                full_name = entry.get('displayName', [username])[0].decode('utf-8')
+    try:
+        with timed("ldap_auth"):
+            if AD_BIND_DN:
+                full_name = _authenticate_pooled(user_dn, username, password)
             else:
-                full_name = username
-        except Exception as e:
-            print(f"⚠️ Не удалось получить ФИО: {e}")
-            full_name = username
-
-        conn.unbind()
+                full_name = _authenticate_direct(user_dn, username, password)
+        LOGINS.inc(result="success")
         return True, full_name
 
     except ldap.INVALID_CREDENTIALS:
+        LOGINS.inc(result="invalid_credentials")
         return False, "Неверный логин или пароль"
-    except ldap.SERVER_DOWN:
-        return False, "Не удалось подключиться к серверу AD"
+    except ADUnavailableError:
+        LOGINS.inc(result="service_bind_failed")
+        raise
+    except (ldap.SERVER_DOWN, ldap.TIMEOUT) as e:
+        LOGINS.inc(result="unavailable")
+        raise ADUnavailableError("Не удалось подключиться к серверу AD") from e
     except Exception as e:
+        LOGINS.inc(result="error")
         print(f"❌ Ошибка AD: {e}")
-        return False, f"Ошибка аутентификации: {str(e)}"
\ No newline at end of file
+        return False, f"Ошибка аутентификации: {str(e)}"
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=AD_AUTH_WORKERS, thread_name_prefix="ad-auth")
+    return _executor
+
+
+async def aauthenticate_user(username: str, password: str) -> tuple[bool, str]:
+    """Асинхронная обёртка над authenticate_user: LDAP выполняется в отдельном пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), authenticate_user, username, password)
@@ -1,42 +1,184 @@
 # auth/session.py
 import redis
+import redis.asyncio
 import uuid
 import json
+import time
+import weakref
+import asyncio
 from datetime import timedelta
+from metrics import timed, counter
 from dotenv import load_dotenv
 import os
+import threading
 
 load_dotenv()
 
-r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+# redis://host:port/db; fakeredis:// — хранилище в памяти процесса для тестов (нужен пакет fakeredis[lua])
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 20))
+# Сколько секунд сессия и статус блокировки живут в памяти процесса без обращения к Redis
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", 30))
 
 SESSION_EXPIRY_DAYS = int(os.getenv("SESSION_EXPIRY_DAYS", 1))
 MAX_LOGIN_ATTEMPTS = int(os.getenv("MAX_LOGIN_ATTEMPTS", 3))
 LOCKOUT_MINUTES = int(os.getenv("LOCKOUT_MINUTES", 20))
 
+# INCR и EXPIRE одной атомарной операцией: счётчик не может остаться без срока жизни
+_INCREMENT_ATTEMPTS_LUA = """
+local attempts = redis.call('INCR', KEYS[1])
+if attempts == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return attempts
+"""
 
-def create_session(user_id, username, full_name):
+SESSION_CHECKS = counter("auth_session_checks_total", "Проверки сессии по источнику ответа (память или Redis)")
+
+_redis = None
+_redis_lock = threading.Lock()
+_fake_server = None
+# Асинхронный клиент привязан к event loop, в котором создан (бот и API работают в разных)
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _attempts_key(user_id) -> str:
+    return f"login_attempts:{user_id}"
+
+
+def _get_fake_server():
+    global _fake_server
+    if _fake_server is None:
+        import fakeredis
+
+        _fake_server = fakeredis.FakeServer()
+    return _fake_server
+
+
+def get_redis():
+    """Синхронный клиент Redis для кэша ответов (потоки пула RAG); создаётся при первом обращении"""
+    global _redis
+    if _redis is None:
+        with _redis_lock:
+            if _redis is None:
+                if REDIS_URL.startswith("fakeredis://"):
+                    import fakeredis
+
+                    _redis = fakeredis.FakeRedis(server=_get_fake_server(), decode_responses=True)
+                else:
+                    _redis = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _redis
+
+
+def get_async_redis():
+    """Асинхронный клиент Redis с пулом соединений для текущего event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        with _redis_lock:
+            if REDIS_URL.startswith("fakeredis://"):
+                import fakeredis
+
+                client = fakeredis.FakeAsyncRedis(server=_get_fake_server(), decode_responses=True)
+            else:
+                client = redis.asyncio.Redis.from_url(
+                    REDIS_URL, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS
+                )
+        _async_clients[loop] = client
+    return client
+
+
+class _LocalCache:
+    """Небольшой потокобезопасный кэш в памяти с ограниченным временем жизни записей"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """:return: (найдено, значение)"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return False, None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return False, None
+            return True, value
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            # Не даём кэшу расти бесконечно: чистим истёкшие записи
+            if len(self._data) > 10000:
+                now = time.monotonic()
+                self._data = {k: v for k, v in self._data.items() if v[0] >= now}
+
+    def forget(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+_sessions = _LocalCache(SESSION_CACHE_TTL)
+_locks = _LocalCache(SESSION_CACHE_TTL)
+
+
+def _is_locked(attempts) -> bool:
+    return bool(attempts) and int(attempts) >= MAX_LOGIN_ATTEMPTS
+
+
+async def acreate_session(user_id, username, full_name):
+    """Создаёт сессию после успешного входа и сбрасывает счётчик неудачных попыток"""
     session_id = str(uuid.uuid4())
     session_data = {"user_id": user_id, "username": username, "full_name": full_name}
-    expiry = timedelta(days=SESSION_EXPIRY_DAYS)
-    r.setex(session_id, expiry, json.dumps(session_data))
-    r.delete(f"login_attempts:{user_id}")  # сброс
+    with timed("redis_session_create"):
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            pipe.set(session_id, json.dumps(session_data), ex=timedelta(days=SESSION_EXPIRY_DAYS))
+            pipe.delete(_attempts_key(user_id))  # сброс
+            await pipe.execute()
+    _sessions.put(session_id, session_data)
+    _locks.put(user_id, False)
     return session_id
 
 
-def get_session(session_id):
-    data = r.get(session_id)
-    return json.loads(data) if data else None
+async def aincrement_login_attempts(user_id):
+    """Атомарно увеличивает счётчик неудачных входов и ставит ему срок жизни"""
+    attempts = int(await get_async_redis().eval(
+        _INCREMENT_ATTEMPTS_LUA, 1, _attempts_key(user_id), LOCKOUT_MINUTES * 60
+    ))
+    _locks.put(user_id, _is_locked(attempts))
+    return attempts
 
 
-def increment_login_attempts(user_id):
-    key = f"login_attempts:{user_id}"
-    attempts = r.incr(key)
-    if attempts == 1:
-        r.expire(key, timedelta(minutes=LOCKOUT_MINUTES))
-    return attempts
+async def acheck_user(user_id, session_id=None):
+    """
+    Проверка перед обработкой сообщения: заблокирован ли пользователь и его сессия.
+    Для активных пользователей ответ берётся из памяти процесса (SESSION_CACHE_TTL),
+    иначе оба значения читаются из Redis за один round-trip.
+    :return: (заблокирован, данные сессии или None)
+    """
+    lock_known, locked = _locks.get(user_id)
+    session_known, session = _sessions.get(session_id) if session_id else (True, None)
+    if lock_known and session_known:
+        SESSION_CHECKS.inc(source="memory")
+        return locked, session
 
+    SESSION_CHECKS.inc(source="redis")
+    with timed("redis_session_check"):
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            pipe.get(_attempts_key(user_id))
+            if session_id:
+                pipe.get(session_id)
+            results = await pipe.execute()
 
-def is_user_locked(user_id):
-    attempts = r.get(f"login_attempts:{user_id}")
-    return attempts and int(attempts) >= MAX_LOGIN_ATTEMPTS
\ No newline at end of file
+    locked = _is_locked(results[0])
+    _locks.put(user_id, locked)
+    session = None
+    if session_id and results[1]:
+        session = json.loads(results[1])
+        _sessions.put(session_id, session)
+    return locked, session
@@ -0,0 +1,200 @@
+# benchmarks/corpus.py
+"""Синтетические PDF/DOCX со «скриншотами» для бенчмарков индексации и поиска"""
+import io
+import os
+import random
+from PIL import Image, ImageDraw
+from docx import Document
+from docx.shared import Inches
+
+# Размеры корпусов: документов, страниц в документе, скриншотов на странице
+SIZES = {
+    "small": {"documents": 4, "pages": 3, "images_per_page": 1},
+    "medium": {"documents": 12, "pages": 8, "images_per_page": 1},
+    "large": {"documents": 30, "pages": 16, "images_per_page": 2},
+}
+
+_SYSTEMS = ["Bitrix24", "VPN", "Outlook", "1C", "Zoom", "FotonGuest", "VATS", "Jira", "Confluence", "Teams"]
+_ACTIONS = [
+    "подключение", "настройка", "установка", "удаление", "обновление",
+    "восстановление пароля", "вход в систему", "смена профиля", "выгрузка отчёта",
+]
+_WORDS = (
+    "откройте меню нажмите кнопку выберите раздел параметры сохраните изменения "
+    "введите логин пароль сервер адрес порт учётная запись подтвердите действие "
+    "если появится ошибка обратитесь в техническую поддержку проверьте подключение "
+    "к сети перезапустите приложение дождитесь окончания загрузки скопируйте ссылку "
+    "в поле укажите значение по умолчанию отметьте флажок далее готово"
+).split()
+
+_TRANSLIT = dict(zip(
+    "абвгдеёжзийклмнопрстуфхцчшщъыьэюя",
+    ["a", "b", "v", "g", "d", "e", "e", "zh", "z", "i", "y", "k", "l", "m", "n", "o", "p",
+     "r", "s", "t", "u", "f", "kh", "ts", "ch", "sh", "sch", "", "y", "", "e", "yu", "ya"],
+))
+
+
+def translit(text: str) -> str:
+    """Латиница для PDF: стандартный шрифт Helvetica не содержит кириллицы"""
+    result = []
+    for ch in text:
+        latin = _TRANSLIT.get(ch.lower())
+        if latin is None:
+            result.append(ch)
+        else:
+            result.append(latin.capitalize() if ch.isupper() else latin)
+    return "".join(result)
+
+
+def _sentence(rng: random.Random, system: str) -> str:
+    words = rng.choices(_WORDS, k=rng.randint(8, 16))
+    words.insert(rng.randrange(len(words)), system)
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraphs(rng: random.Random, system: str, count: int) -> list[str]:
+    return [" ".join(_sentence(rng, system) for _ in range(rng.randint(3, 6))) for _ in range(count)]
+
+
+def screenshot(title: str, lines: list[str], size=(800, 500)) -> bytes:
+    """JPEG, похожий на скриншот окна: заголовок, поля и кнопка с текстом для OCR"""
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, size[0], 40], fill=(40, 90, 160))
+    draw.text((15, 12), title, fill="white")
+    y = 70
+    for line in lines:
+        draw.rectangle([20, y - 5, size[0] - 20, y + 25], outline=(180, 180, 180))
+        draw.text((30, y), line, fill="black")
+        y += 45
+    draw.rectangle([size[0] - 160, size[1] - 60, size[0] - 30, size[1] - 25], fill=(60, 160, 80))
+    draw.text((size[0] - 135, size[1] - 50), "OK", fill="white")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _pdf_escape(text: str) -> bytes:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").encode("latin-1", "replace")
+
+
+def write_pdf(path: str, pages: list[tuple[list[str], list[tuple[bytes, tuple[int, int]]]]]):
+    """
+    Минимальный PDF: на каждой странице текстовый слой (Helvetica) и JPEG-изображения (DCTDecode)
+    :param pages: [(строки текста, [(jpeg, (ширина, высота)), ...]), ...]
+    """
+    objects = [None, None]  # 1 — каталог, 2 — дерево страниц
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    page_ids = []
+    for lines, images in pages:
+        ops = [b"BT /F1 10 Tf 13 TL 40 800 Td"]
+        ops += [b"(" + _pdf_escape(line) + b") '" for line in lines]
+        ops.append(b"ET")
+        xobjects = []
+        y = 40
+        for i, (jpeg, (width, height)) in enumerate(images):
+            image_id = add(
+                b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB "
+                b"/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n" % (width, height, len(jpeg))
+                + jpeg + b"\nendstream"
+            )
+            xobjects.append(b"/Im%d %d 0 R" % (i, image_id))
+            draw_w, draw_h = 400, 400 * height // width
+            ops.append(b"q %d 0 0 %d 95 %d cm /Im%d Do Q" % (draw_w, draw_h, y, i))
+            y += draw_h + 10
+        content = b"\n".join(ops)
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> /XObject << %s >> >> /Contents %d 0 R >>"
+            % (font, b" ".join(xobjects), content_id)
+        ))
+
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % pid for pid in page_ids), len(page_ids)
+    )
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    out.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    with open(path, "wb") as f:
+        f.write(out.getvalue())
+
+
+def _wrap(text: str, width: int = 95) -> list[str]:
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    return lines + ([line] if line else [])
+
+
+def generate_corpus(folder: str, size: str = "small", seed: int = 0) -> dict:
+    """
+    Создаёт в folder набор инструкций: чётные — PDF, нечётные — DOCX
+    :return: Описание корпуса (число документов, страниц, изображений, байт, вопросы по нему)
+    """
+    spec = SIZES[size]
+    rng = random.Random(f"{size}:{seed}")
+    os.makedirs(folder, exist_ok=True)
+    stats = {"size": size, "documents": 0, "pages": 0, "images": 0, "bytes": 0, "questions": []}
+
+    for doc_num in range(spec["documents"]):
+        system = _SYSTEMS[doc_num % len(_SYSTEMS)]
+        action = rng.choice(_ACTIONS)
+        title = f"{doc_num + 1}) {action.capitalize()} {system}"
+        stats["questions"].append(f"Как выполнить {action} {system}?")
+
+        pages = []
+        for page_num in range(spec["pages"]):
+            paragraphs = _paragraphs(rng, system, rng.randint(2, 4))
+            images = [
+                screenshot(
+                    f"{system} - step {page_num + 1}.{i + 1}",
+                    [translit(" ".join(rng.choices(_WORDS, k=4))) for _ in range(rng.randint(3, 6))],
+                )
+                for i in range(spec["images_per_page"])
+            ]
+            pages.append((paragraphs, images))
+            stats["pages"] += 1
+            stats["images"] += len(images)
+
+        if doc_num % 2 == 0:
+            path = os.path.join(folder, f"{title}.pdf")
+            write_pdf(path, [
+                ([translit(title)] + [line for p in paragraphs for line in _wrap(translit(p))],
+                 [(jpeg, Image.open(io.BytesIO(jpeg)).size) for jpeg in images])
+                for paragraphs, images in pages
+            ])
+        else:
+            path = os.path.join(folder, f"{title}.docx")
+            document = Document()
+            document.add_heading(title, level=1)
+            for page_num, (paragraphs, images) in enumerate(pages):
+                document.add_heading(f"Шаг {page_num + 1}", level=2)
+                for paragraph in paragraphs:
+                    document.add_paragraph(paragraph)
+                for jpeg in images:
+                    document.add_picture(io.BytesIO(jpeg), width=Inches(5))
+            document.save(path)
+
+        stats["documents"] += 1
+        stats["bytes"] += os.path.getsize(path)
+
+    return stats
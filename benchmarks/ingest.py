@@ -0,0 +1,70 @@
+# benchmarks/ingest.py
+"""Пропускная способность индексации (load_documents_from_folder) по этапам"""
+import time
+from metrics import STAGE_SECONDS
+from rag import document_loader
+from rag.ocr import OCR_IMAGES
+from rag.embedding_cache import EMBEDDING_CACHE
+from rag.index_versions import new_index_dir
+
+
+def _stage_seconds() -> dict:
+    return {stage: total for stage, (total, _) in STAGE_SECONDS.totals("stage").items()}
+
+
+def _counters() -> dict:
+    return {
+        "documents": document_loader.DOCUMENTS_INDEXED.total(),
+        "chunks": document_loader.CHUNKS_INDEXED.total(),
+        "ocr_miss": OCR_IMAGES.value(cache="miss"),
+        "ocr_hit": OCR_IMAGES.value(cache="hit"),
+        "embed_miss": EMBEDDING_CACHE.value(kind="chunk", result="miss"),
+        "embed_hit": EMBEDDING_CACHE.value(kind="chunk", result="hit"),
+    }
+
+
+def _rate(amount, seconds):
+    return round(amount / seconds, 2) if seconds > 0 else None
+
+
+def run_ingest(corpus_dir: str, corpus: dict) -> dict:
+    """
+    Индексирует корпус в новый каталог версии индекса и раскладывает время по этапам:
+    parse — разбор PDF/DOCX без OCR, ocr, split, embed, write — запись в Chroma, BM25 и таблицу изображений
+    :return: Время этапов, скорости и попадания в кэши
+    """
+    index_dir = new_index_dir()
+    stages_before, counters_before = _stage_seconds(), _counters()
+
+    started = time.perf_counter()
+    document_loader.load_documents_from_folder(corpus_dir, index_dir=index_dir)
+    wall = time.perf_counter() - started
+
+    stages_after, counters_after = _stage_seconds(), _counters()
+    delta = {name: stages_after.get(name, 0.0) - stages_before.get(name, 0.0) for name in stages_after}
+    counts = {name: counters_after[name] - counters_before[name] for name in counters_after}
+
+    ocr = delta.get("ocr", 0.0)
+    embed = delta.get("embed_chunks", 0.0)
+    stages = {
+        "parse": delta.get("index_extract", 0.0) - ocr,
+        "ocr": ocr,
+        "split": delta.get("index_split", 0.0),
+        "embed": embed,
+        "write": delta.get("index_embed_store", 0.0) - embed + delta.get("index_bm25", 0.0)
+        + delta.get("index_images", 0.0),
+    }
+
+    return {
+        "index_dir": index_dir,
+        "wall_seconds": round(wall, 3),
+        "stages_seconds": {name: round(max(value, 0.0), 3) for name, value in stages.items()},
+        "throughput": {
+            "documents_per_second": _rate(counts["documents"], wall),
+            "pages_per_second": _rate(corpus["pages"], wall),
+            "megabytes_per_second": _rate(corpus["bytes"] / (1024 * 1024), wall),
+            "ocr_images_per_second": _rate(counts["ocr_miss"], ocr),
+            "chunks_embedded_per_second": _rate(counts["embed_miss"], embed),
+        },
+        "counts": counts,
+    }
@@ -0,0 +1,127 @@
+# benchmarks/query.py
+"""Задержка и пропускная способность query_rag и /query под параллельной нагрузкой"""
+import json
+import math
+import time
+import socket
+import threading
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentiles(values: list[float]) -> dict:
+    """p50/p95/p99 (nearest rank), среднее и максимум, секунды"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+    return {
+        "p50": round(rank(50), 4),
+        "p95": round(rank(95), 4),
+        "p99": round(rank(99), 4),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def make_questions(base: list[str], count: int, offset: int = 0) -> list[str]:
+    """Уникальные вопросы: повтор попал бы в кэш ответов или эмбеддингов и исказил замер"""
+    return [f"{base[i % len(base)]} Вариант {i}" for i in range(offset, offset + count)]
+
+
+def _load(func, questions: list[str], concurrency: int) -> dict:
+    outcomes = Counter()
+    latencies = []
+    lock = threading.Lock()
+
+    def call(question):
+        started = time.perf_counter()
+        try:
+            outcome = func(question)
+        except Exception as e:
+            outcome = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            outcomes[outcome] += 1
+            if outcome == "ok":
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, questions))
+    wall = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(questions),
+        "outcomes": dict(outcomes),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(outcomes["ok"] / wall, 2) if wall > 0 else None,
+        "latency_seconds": percentiles(latencies),
+    }
+
+
+def run_query_load(questions: list[str], concurrency: int) -> dict:
+    """query_rag напрямую из concurrency потоков"""
+    from rag.rag_engine import query_rag, FALLBACK_ANSWER
+
+    def call(question):
+        return "fallback" if query_rag(question)["answer"] == FALLBACK_ANSWER else "ok"
+
+    return _load(call, questions, concurrency)
+
+
+def run_http_load(base_url: str, questions: list[str], concurrency: int, timeout: float = 300) -> dict:
+    """POST /query из concurrency потоков; исходы — HTTP-коды (429/503 — отказ по перегрузке)"""
+
+    def call(question):
+        request = urllib.request.Request(
+            f"{base_url}/query",
+            data=json.dumps({"question": question}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                return "ok"
+        except urllib.error.HTTPError as e:
+            return f"http_{e.code}"
+
+    return _load(call, questions, concurrency)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ApiServer:
+    """FastAPI-приложение из main.py под uvicorn в фоновом потоке"""
+
+    def __init__(self, port: int = 0):
+        self.port = port or _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._server = None
+
+    def start(self, timeout: float = 30):
+        import uvicorn
+        from main import fastapi_app
+
+        self._server = uvicorn.Server(uvicorn.Config(fastapi_app, host="127.0.0.1", port=self.port, log_level="warning"))
+        threading.Thread(target=self._server.run, name="bench-api", daemon=True).start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("API не запустился")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
@@ -0,0 +1,192 @@
+# benchmarks/run.py
+"""
+Бенчмарк индексации и ответов на вопросы.
+
+    python -m benchmarks.run --sizes small,medium --concurrency 1,4,16 --output results.json
+
+Генерирует синтетические корпуса, индексирует каждый дважды (с пустыми
+и с прогретыми кэшами OCR/эмбеддингов), затем нагружает query_rag и /query
+при разной параллельности. LLM подменяется локальной заглушкой Ollama.
+Все файлы (индекс, медиа, кэши) создаются во временном каталоге.
+Результат — JSON, который удобно сравнивать между коммитами.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+from benchmarks.corpus import SIZES, generate_corpus
+from benchmarks.stub_llm import StubLLMServer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Настройки, влияющие на результат, — попадают в отчёт
+REPORTED_ENV = (
+    "EMBED_BATCH_SIZE", "EMBED_BATCH_WINDOW_MS", "EMBED_BATCH_MAX", "OCR_WORKERS", "RETRIEVAL_MODE",
+    "HYBRID_CANDIDATES", "PROMPT_TOKEN_BUDGET", "RAG_MAX_CONCURRENCY", "RAG_MAX_QUEUE", "RAG_USER_BURST",
+    "RAG_USER_RATE_PER_MINUTE", "API_RATE_LIMIT", "FAST_PATH_MAX_DISTANCE",
+)
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, timeout=10
+        )
+        return result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _parse_list(value: str, cast=str) -> list:
+    return [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+
+def _configure_environment(workdir: str, llm_url: str):
+    """Изолирует бенчмарк от рабочих данных; вызывается до импорта модулей rag"""
+    os.environ.update({
+        "CHROMA_DIR": os.path.join(workdir, "index"),
+        "MEDIA_DIR": os.path.join(workdir, "media"),
+        "OCR_CACHE_PATH": os.path.join(workdir, "ocr_cache.sqlite3"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "OLLAMA_HOSTS": llm_url,
+        "ANSWER_CACHE_ENABLED": "0",  # каждый вопрос должен пройти весь конвейер
+        "METRICS_ENABLED": "true",  # разбивка по этапам берётся из метрик
+        "RAG_WARMUP": "false",
+        "INDEX_GC_DELAY": "86400",
+    })
+    os.makedirs(os.environ["CHROMA_DIR"], exist_ok=True)
+    os.makedirs(os.environ["MEDIA_DIR"], exist_ok=True)
+
+
+def run(args) -> dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    llm = StubLLMServer(
+        tokens=args.llm_tokens,
+        first_token_delay=args.llm_first_token_ms / 1000,
+        token_delay=args.llm_token_ms / 1000,
+    ).start()
+    _configure_environment(workdir, llm.url)
+
+    from benchmarks.ingest import run_ingest
+    from benchmarks.query import make_questions, run_query_load, run_http_load, ApiServer
+    from rag.index_versions import activate_index_dir
+    from rag.rag_engine import query_rag
+    from rag.startup import get_startup_timings
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "sizes": args.sizes,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "llm": {"tokens": args.llm_tokens, "first_token_ms": args.llm_first_token_ms, "token_ms": args.llm_token_ms},
+            "env": {name: os.environ[name] for name in REPORTED_ENV if name in os.environ},
+        },
+        "ingest": {},
+    }
+
+    try:
+        questions = []
+        query_index = None
+        for size in args.sizes:
+            corpus_dir = os.path.join(workdir, f"corpus-{size}")
+            started = time.perf_counter()
+            corpus = generate_corpus(corpus_dir, size, seed=args.seed)
+            generate_seconds = time.perf_counter() - started
+            print(f"📚 Корпус {size}: {corpus['documents']} документов, {corpus['pages']} страниц, "
+                  f"{corpus['images']} изображений", file=sys.stderr)
+
+            cold = run_ingest(corpus_dir, corpus)
+            # Повторная индексация того же корпуса: OCR и эмбеддинги берутся из кэшей
+            warm = run_ingest(corpus_dir, corpus)
+            report["ingest"][size] = {
+                "corpus": {key: value for key, value in corpus.items() if key != "questions"},
+                "generate_seconds": round(generate_seconds, 3),
+                "cold": cold,
+                "warm": warm,
+            }
+            questions = corpus["questions"]
+            query_index = cold["index_dir"]
+
+        if query_index is None or args.requests <= 0:
+            return report
+
+        # Вопросы задаются по последнему корпусу из --sizes
+        activate_index_dir(query_index)
+        started = time.perf_counter()
+        query_rag(questions[0])  # загрузка модели и открытие индекса в замер не входят
+        report["query_warmup_seconds"] = round(time.perf_counter() - started, 3)
+
+        report["query_rag"] = []
+        for level, concurrency in enumerate(args.concurrency):
+            batch = make_questions(questions, args.requests, offset=level * args.requests)
+            print(f"⏱️ query_rag: {len(batch)} запросов, параллельно {concurrency}", file=sys.stderr)
+            report["query_rag"].append(run_query_load(batch, concurrency))
+
+        if not args.skip_http:
+            api = ApiServer().start()
+            try:
+                report["http_query"] = []
+                for level, concurrency in enumerate(args.concurrency):
+                    batch = make_questions([f"HTTP {q}" for q in questions], args.requests, offset=level * args.requests)
+                    print(f"⏱️ POST /query: {len(batch)} запросов, параллельно {concurrency}", file=sys.stderr)
+                    report["http_query"].append(run_http_load(api.url, batch, concurrency))
+            finally:
+                api.stop()
+
+        report["llm_requests"] = llm.requests
+        report["startup_seconds"] = get_startup_timings()
+        return report
+    finally:
+        llm.stop()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк индексации и ответов RAG")
+    parser.add_argument("--sizes", type=_parse_list, default=["small", "medium"],
+                        help=f"размеры корпусов через запятую: {', '.join(SIZES)}")
+    parser.add_argument("--concurrency", type=lambda v: _parse_list(v, int), default=[1, 4, 16],
+                        help="уровни параллельности запросов через запятую")
+    parser.add_argument("--requests", type=int, default=64, help="запросов на каждый уровень параллельности")
+    parser.add_argument("--seed", type=int, default=0, help="зерно генератора корпуса")
+    parser.add_argument("--llm-tokens", type=int, default=50, help="фрагментов в ответе заглушки LLM")
+    parser.add_argument("--llm-first-token-ms", type=float, default=200, help="задержка до первого фрагмента")
+    parser.add_argument("--llm-token-ms", type=float, default=10, help="задержка между фрагментами")
+    parser.add_argument("--skip-http", action="store_true", help="не нагружать /query")
+    parser.add_argument("--workdir", help="каталог для корпусов, индекса и кэшей (по умолчанию временный)")
+    parser.add_argument("--keep", action="store_true", help="не удалять временный каталог")
+    parser.add_argument("--output", default="-", help="файл для JSON-отчёта (- — stdout)")
+    args = parser.parse_args(argv)
+
+    unknown = [size for size in args.sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"неизвестные размеры корпуса: {', '.join(unknown)}")
+
+    # Модули rag пишут прогресс в stdout — уводим его в stderr, чтобы stdout остался чистым JSON
+    with redirect_stdout(sys.stderr):
+        report = run(args)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"📝 Результаты: {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# benchmarks/stub_llm.py
+"""Заглушка Ollama HTTP API (/api/tags, /api/generate) с настраиваемой задержкой генерации"""
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": "stub"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        with server.lock:
+            server.requests += 1
+
+        # Время на разбор промпта пропорционально его длине, затем токены с постоянной скоростью
+        time.sleep(server.first_token_delay + len(request.get("prompt", "")) * server.prompt_delay_per_char)
+        tokens = [f"слово{i} " for i in range(server.tokens)]
+        if not request.get("stream", True):
+            time.sleep(server.token_delay * len(tokens))
+            self._send_json(200, {"response": "".join(tokens), "done": True})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            if i == server.fail_after_tokens:
+                # «Падение» сервера посреди ответа: соединение рвётся без завершающего чанка
+                self.close_connection = True
+                return
+            time.sleep(server.token_delay)
+            self._write_chunk(json.dumps({"response": token, "done": False}, ensure_ascii=False) + "\n")
+        self._write_chunk(json.dumps({"response": "", "done": True}) + "\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """
+    Локальный «сервер Ollama» для бенчмарков: ответ из tokens фрагментов,
+    первый через first_token_delay секунд, остальные через token_delay;
+    fail_after_tokens — оборвать потоковый ответ после стольких фрагментов
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, tokens=50, first_token_delay=0.2,
+                 token_delay=0.01, prompt_delay_per_char=0.0, fail_after_tokens=None):
+        super().__init__((host, port), _Handler)
+        self.tokens = tokens
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.prompt_delay_per_char = prompt_delay_per_char
+        self.fail_after_tokens = fail_after_tokens
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="stub-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,185 @@
+# bot/media.py
+import os
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Соответствие «файл скриншота → file_id в Telegram», чтобы не загружать одно и то же повторно
+FILE_ID_CACHE_PATH = os.getenv("FILE_ID_CACHE_PATH", "telegram_file_ids.sqlite3")
+
+
+class FileIdCache:
+    """
+    Постоянный кэш file_id по пути к медиафайлу и хэшу его содержимого.
+    Методы блокирующие (SQLite, чтение файлов) — из корутин их вызывают через asyncio.to_thread
+    """
+
+    def __init__(self, path: str = FILE_ID_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # (путь, mtime, размер) → хэш, чтобы не перечитывать файл при каждой отправке
+        self._hashes = {}
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                "img_path TEXT NOT NULL, content_hash TEXT NOT NULL, file_id TEXT NOT NULL, "
+                "PRIMARY KEY (img_path, content_hash))"
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path)
+
+    def content_hash(self, img_path: str) -> str:
+        stat = os.stat(img_path)
+        key = (img_path, stat.st_mtime, stat.st_size)
+        with self._lock:
+            cached = self._hashes.get(key)
+        if cached:
+            return cached
+        with open(img_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with self._lock:
+            self._hashes[key] = digest
+        return digest
+
+    def get(self, img_path: str, content_hash: str) -> str | None:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT file_id FROM file_ids WHERE img_path = ? AND content_hash = ?",
+                (img_path, content_hash),
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def put(self, img_path: str, content_hash: str, file_id: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO file_ids (img_path, content_hash, file_id) VALUES (?, ?, ?)",
+                    (img_path, content_hash, file_id),
+                )
+        finally:
+            conn.close()
+
+    def forget(self, img_path: str, content_hash: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM file_ids WHERE img_path = ? AND content_hash = ?",
+                    (img_path, content_hash),
+                )
+        finally:
+            conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_file_id_cache() -> FileIdCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = FileIdCache()
+    return _cache
+
+
+def _lookup(images: list[dict]) -> list[dict]:
+    """Хэши файлов и известные file_id скриншотов"""
+    cache = get_file_id_cache()
+    items = []
+    for img in images:
+        img_path = img["img_path"]
+        content_hash = cache.content_hash(img_path)
+        items.append({
+            "img_path": img_path,
+            "caption": img.get("caption", "Скриншот"),
+            "hash": content_hash,
+            "file_id": cache.get(img_path, content_hash),
+        })
+    return items
+
+
+def _read_photos(items, use_cache: bool) -> list:
+    photos = []
+    for item in items:
+        if use_cache and item["file_id"]:
+            photos.append(item["file_id"])
+        else:
+            with open(item["img_path"], "rb") as f:
+                photos.append(f.read())
+    return photos
+
+
+def _forget(items):
+    cache = get_file_id_cache()
+    for item in items:
+        cache.forget(item["img_path"], item["hash"])
+
+
+def _remember(uploaded):
+    cache = get_file_id_cache()
+    for item, file_id in uploaded:
+        cache.put(item["img_path"], item["hash"], file_id)
+
+
+async def _send(bot, chat_id, items, use_cache: bool):
+    photos = await asyncio.to_thread(_read_photos, items, use_cache)
+
+    if len(photos) == 1:
+        message = await bot.send_photo(chat_id=chat_id, photo=photos[0], caption=items[0]["caption"])
+        return [message]
+    # Один запрос на все скриншоты ответа (Telegram допускает до 10 в группе)
+    media = [InputMediaPhoto(media=photo, caption=item["caption"]) for photo, item in zip(photos, items)]
+    messages = []
+    for start in range(0, len(media), 10):
+        messages.extend(await bot.send_media_group(chat_id=chat_id, media=media[start:start + 10]))
+    return messages
+
+
+async def send_screenshots(bot, chat_id, images: list[dict]):
+    """
+    Отправляет скриншоты одним альбомом; уже загруженные ранее файлы
+    отправляются по file_id, новые — загружаются, и их file_id запоминается
+    :param images: Список словарей с img_path и caption (файлы должны существовать)
+    """
+    if not images:
+        return
+    # Хэширование файлов и SQLite — в потоке, чтобы не задерживать другие апдейты бота
+    items = await asyncio.to_thread(_lookup, images)
+
+    try:
+        messages = await _send(bot, chat_id, items, use_cache=True)
+    except BadRequest as e:
+        if not any(item["file_id"] for item in items):
+            raise
+        # file_id мог устареть (например, после смены токена бота) — загружаем заново
+        print(f"⚠️ Не удалось отправить по file_id, загружаем файлы: {e}")
+        await asyncio.to_thread(_forget, [item for item in items if item["file_id"]])
+        for item in items:
+            item["file_id"] = None
+        messages = await _send(bot, chat_id, items, use_cache=False)
+
+    # Самый крупный вариант фото идёт последним
+    uploaded = [
+        (item, message.photo[-1].file_id)
+        for message, item in zip(messages, items)
+        if not item["file_id"] and message.photo
+    ]
+    if uploaded:
+        await asyncio.to_thread(_remember, uploaded)
@@ -0,0 +1,2 @@
+# conftest.py
+# Корень репозитория в sys.path для тестов: пакеты rag, auth и модуль metrics импортируются как при запуске main.py
@@ -1,10 +1,17 @@
 # main.py
+# Первым: от импорта rag.startup отсчитывается время холодного старта
+from rag.startup import startup_phase, mark_ready, get_startup_timings
 import asyncio
+import math
 import threading
+import time
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.constants import ChatAction
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -14,11 +21,15 @@ from telegram.ext import (
     ContextTypes,
 )
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from rag.document_loader import load_documents_from_folder
-from rag.rag_engine import query_rag
-from auth.ad_auth import authenticate_user
-from auth.session import create_session, get_session, increment_login_attempts, is_user_locked
+from rag.indexer import IndexWorker, DocumentEventHandler
+from rag.rag_engine import aquery_rag, astream_rag, asearch_rag, get_llm, start_warm_up
+from rag.pool import RagOverloadedError, RagRateLimitedError, RagSupersededError
+from rag import answer_cache
+from auth.ad_auth import aauthenticate_user, ADUnavailableError
+from auth.session import acreate_session, acheck_user, aincrement_login_attempts
+from bot.media import send_screenshots
+import metrics
+from metrics import timed
 from dotenv import load_dotenv
 import os
 import json
@@ -30,6 +41,24 @@ load_dotenv()
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 API_HOST = os.getenv("API_HOST", "127.0.0.1")
 API_PORT = int(os.getenv("API_PORT", 8000))
+# Сколько апдейтов бот обрабатывает параллельно (иначе PTB выполняет их строго по очереди)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", 64))
+# Как часто обновлять сообщение при потоковом ответе (Telegram ограничивает частоту правок)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.5))
+TYPING_ACTION_INTERVAL = 4.0  # индикатор «печатает» гаснет через ~5 секунд
+TELEGRAM_MESSAGE_LIMIT = 4096
+SEARCH_SNIPPET_LENGTH = 700  # символов фрагмента на результат в /search
+# Сколько секунд API ждёт ответа RAG и что советовать клиенту при перегрузке
+API_QUERY_TIMEOUT = float(os.getenv("API_QUERY_TIMEOUT", 120))
+API_RETRY_AFTER = int(os.getenv("API_RETRY_AFTER", 5))
+# Применять лимит запросов к LLM на пользователя (RAG_USER_*) к клиентам API.
+# По умолчанию выключен: API вызывают внутренние сервисы, часто с одного адреса
+API_RATE_LIMIT = os.getenv("API_RATE_LIMIT", "false").lower() in ("1", "true", "yes")
+# Адреса доверенных прокси/шлюзов через запятую: только от них принимается заголовок X-Client-Id,
+# остальные клиенты API различаются по адресу подключения
+API_TRUSTED_PROXIES = {host.strip() for host in os.getenv("API_TRUSTED_PROXIES", "").split(",") if host.strip()}
+
+BOT_MESSAGES = metrics.counter("bot_messages_total", "Сообщения боту по типу")
 
 # === Состояния ===
 LOGIN, PASSWORD = range(2)
@@ -42,10 +71,120 @@ class QueryRequest(BaseModel):
     question: str
 
 
+def _overloaded(status_code: int, detail: str, retry_after: float = API_RETRY_AFTER) -> HTTPException:
+    return HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+def _rate_limited(error: RagRateLimitedError) -> HTTPException:
+    return _overloaded(429, "Слишком много вопросов подряд, повторите позже", error.retry_after)
+
+
+def _api_user(http_request: Request):
+    """
+    Ключ клиента API для справедливой очереди и лимита: адрес подключения.
+    X-Client-Id учитывается только от API_TRUSTED_PROXIES — иначе любой клиент
+    получал бы новую корзину лимита, меняя заголовок в каждом запросе
+    """
+    host = http_request.client.host if http_request.client else None
+    client_id = http_request.headers.get("X-Client-Id")
+    if client_id and host in API_TRUSTED_PROXIES:
+        return f"api:{client_id}"
+    return f"api:{host}" if host else None
+
+
 @fastapi_app.post("/query")
-def api_query(request: QueryRequest):
-    result = query_rag(request.question)
-    return result
+async def api_query(request: QueryRequest, http_request: Request):
+    try:
+        return await asyncio.wait_for(
+            aquery_rag(request.question, user=_api_user(http_request), limited=API_RATE_LIMIT),
+            timeout=API_QUERY_TIMEOUT,
+        )
+    except RagRateLimitedError as e:
+        raise _rate_limited(e)
+    except RagOverloadedError:
+        raise _overloaded(429, "Слишком много запросов, повторите позже")
+    except asyncio.TimeoutError:
+        raise _overloaded(503, "Превышено время ожидания ответа")
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _sse_payload(kind: str, payload):
+    if kind == "token":
+        return {"text": payload}
+    if kind == "queue":
+        return {"position": payload}
+    return payload
+
+
+@fastapi_app.post("/query/stream")
+async def api_query_stream(request: QueryRequest, http_request: Request):
+    """
+    Ответ в виде server-sent events: queue — место в очереди, пока запрос ждёт,
+    token — фрагменты текста, result — итог в формате /query
+    """
+    events = astream_rag(request.question, user=_api_user(http_request), limited=API_RATE_LIMIT)
+    # Первое событие ждём до начала ответа, чтобы перегрузку можно было вернуть кодом 429/503
+    try:
+        first = await asyncio.wait_for(events.__anext__(), timeout=API_QUERY_TIMEOUT)
+    except RagRateLimitedError as e:
+        raise _rate_limited(e)
+    except RagOverloadedError:
+        raise _overloaded(429, "Слишком много запросов, повторите позже")
+    except asyncio.TimeoutError:
+        await events.aclose()
+        raise _overloaded(503, "Превышено время ожидания ответа")
+    except StopAsyncIteration:
+        first = None
+
+    async def event_stream():
+        try:
+            if first is not None:
+                kind, payload = first
+                yield _sse(kind, _sse_payload(kind, payload))
+            async for kind, payload in events:
+                yield _sse(kind, _sse_payload(kind, payload))
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@fastapi_app.post("/search")
+async def api_search(request: QueryRequest, http_request: Request):
+    """Поиск фрагментов инструкций без обращения к LLM"""
+    try:
+        return await asyncio.wait_for(
+            asearch_rag(request.question, user=_api_user(http_request)), timeout=API_QUERY_TIMEOUT
+        )
+    except RagOverloadedError:
+        raise _overloaded(429, "Слишком много запросов, повторите позже")
+    except asyncio.TimeoutError:
+        raise _overloaded(503, "Превышено время ожидания ответа")
+
+
+@fastapi_app.get("/cache/stats")
+def api_cache_stats():
+    return answer_cache.stats()
+
+
+@fastapi_app.get("/llm/stats")
+def api_llm_stats():
+    return get_llm().stats()
+
+
+@fastapi_app.get("/metrics")
+def api_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@fastapi_app.get("/startup")
+def api_startup():
+    """Длительность этапов запуска — для измерения холодного старта"""
+    return get_startup_timings()
 
 
 def run_fastapi():
@@ -74,7 +213,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif query.data == "help":
         await query.edit_message_text(
             "Я помогу найти ответы по инструкциям.\n"
-            "Сначала войдите, затем задавайте вопросы."
+            "Сначала войдите, затем задавайте вопросы.\n"
+            "Быстрый поиск по инструкциям без генерации ответа: /search <запрос>"
         )
 
 
@@ -82,12 +222,17 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     text = update.message.text.strip()
 
-    if is_user_locked(user_id):
+    # Блокировка и сессия проверяются вместе: из памяти или одним запросом к Redis
+    with timed("bot_session_check"):
+        locked, session = await acheck_user(user_id, context.user_data.get("session_id"))
+    if locked:
+        BOT_MESSAGES.inc(kind="locked")
         await update.message.reply_text("❌ Заблокировано на 20 минут.")
         return
 
     # Обработка авторизации
     if context.user_data.get("awaiting") == "login":
+        BOT_MESSAGES.inc(kind="login")
         username = text
         if not username:
             await update.message.reply_text("Логин не может быть пустым. Введите логин:")
@@ -99,21 +244,27 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if context.user_data.get("awaiting") == "password":
+        BOT_MESSAGES.inc(kind="password")
         username = context.user_data["username"]
         password = text
         if not password:
             await update.message.reply_text("Пароль не может быть пустым. Введите пароль:")
             return
             
-        success, full_name = authenticate_user(username, password)
+        try:
+            success, full_name = await aauthenticate_user(username, password)
+        except ADUnavailableError:
+            # Пароль не проверен — попытка не засчитывается
+            await update.message.reply_text("⚠️ Сервер авторизации недоступен. Попробуйте ввести пароль позже.")
+            return
 
         if success:
-            session_id = create_session(user_id, username, full_name)
+            session_id = await acreate_session(user_id, username, full_name)
             context.user_data["session_id"] = session_id
             context.user_data["awaiting"] = None
             await update.message.reply_text(f"✅ Добро пожаловать, {full_name}!")
         else:
-            attempts = increment_login_attempts(user_id)
+            attempts = await aincrement_login_attempts(user_id)
             if attempts >= 3:
                 await update.message.reply_text(
                     "❌ Доступ заблокирован на 20 минут."
@@ -126,65 +277,227 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Обычный вопрос
-    session_id = context.user_data.get("session_id")
-    if not session_id or not get_session(session_id):
-        keyboard = [[InlineKeyboardButton("🔐 Войти", callback_data="login")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "Ваша сессия истекла. Пожалуйста, войдите снова.", reply_markup=reply_markup
-        )
+    if not await require_session(update, context, session):
         return
 
     # Обработка запроса
+    BOT_MESSAGES.inc(kind="question")
     try:
-        result = query_rag(text)
-        
-        answer = result.get("answer", "Извините, ответ не найден.")
-        source = result.get("source")
-        images = result.get("images", [])
-        link_to_document = result.get("link_to_document")
-
-        # Формируем текст ответа
-        response_text = f"🔍 {answer}"
-        
-        if source:
-            response_text += f"\n\n📌 Источник: {source}"
-            
-        if link_to_document:
-            response_text += f"\n\n📎 Подробнее: {link_to_document}"
-
-        await update.message.reply_text(response_text)
-
-        # Отправляем скриншоты
-        if images:
-            await update.message.reply_text("📷 Вот скриншоты из инструкции:")
-            for img in images:
-                img_path = img.get("img_path")
-                caption = img.get("caption", "Скриншот")
-
-                if img_path and os.path.exists(img_path):
-                    try:
-                        with open(img_path, "rb") as photo:
-                            await context.bot.send_photo(
-                                chat_id=update.effective_chat.id,
-                                photo=photo,
-                                caption=caption
-                            )
-                    except Exception as e:
-                        await update.message.reply_text(f"📷 Не удалось отправить: {caption}")
-                else:
-                    await update.message.reply_text(f"📷 {caption} (файл не найден)")
-                    
+        with timed("bot_answer"):
+            await answer_with_streaming(update, context, text)
+    except RagSupersededError:
+        pass  # Сообщение уже заменено пометкой о пропуске, отвечаем на новый вопрос
     except Exception as e:
         await update.message.reply_text(f"Ошибка при обработке запроса: {str(e)}")
 
 
+def _bot_user(update: Update) -> str:
+    """Ключ пользователя Telegram для лимита и справедливой очереди RAG"""
+    return f"tg:{update.effective_user.id}"
+
+
+async def require_session(update: Update, context: ContextTypes.DEFAULT_TYPE, session=None) -> bool:
+    """Проверяет сессию (если она ещё не получена); если её нет, предлагает войти"""
+    if session is None:
+        _, session = await acheck_user(update.effective_user.id, context.user_data.get("session_id"))
+    if session:
+        return True
+    keyboard = [[InlineKeyboardButton("🔐 Войти", callback_data="login")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await update.message.reply_text(
+        "Ваша сессия истекла. Пожалуйста, войдите снова.", reply_markup=reply_markup
+    )
+    return False
+
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/search <запрос> — поиск по инструкциям без генерации ответа"""
+    locked, session = await acheck_user(update.effective_user.id, context.user_data.get("session_id"))
+    if locked:
+        await update.message.reply_text("❌ Заблокировано на 20 минут.")
+        return
+    if not await require_session(update, context, session):
+        return
+
+    text = " ".join(context.args or []).strip()
+    if not text:
+        await update.message.reply_text("Использование: /search <что найти>")
+        return
+
+    try:
+        results = await asearch_rag(text, user=_bot_user(update))
+    except RagOverloadedError:
+        await update.message.reply_text("⏳ Сейчас слишком много запросов. Повторите поиск через минуту.")
+        return
+    except Exception as e:
+        await update.message.reply_text(f"Ошибка при поиске: {str(e)}")
+        return
+
+    if not results:
+        await update.message.reply_text("Ничего не найдено.")
+        return
+
+    parts = []
+    for i, result in enumerate(results, 1):
+        snippet = result["answer"][:SEARCH_SNIPPET_LENGTH]
+        part = f"{i}. 📌 {result['source']}\n{snippet}"
+        if result.get("link_to_document"):
+            part += f"\n📎 {result['link_to_document']}"
+        parts.append(part)
+    await update.message.reply_text(("🔎 " + "\n\n".join(parts))[:TELEGRAM_MESSAGE_LIMIT])
+    # Скриншоты — только для самого релевантного фрагмента
+    await send_images(update, context, results[0].get("images", []))
+
+
+def format_answer(result: dict) -> str:
+    """Текст итогового ответа: ответ модели, источник и ссылка"""
+    answer = result.get("answer") or "Извините, ответ не найден."
+    source = result.get("source")
+    link_to_document = result.get("link_to_document")
+
+    response_text = f"🔍 {answer}"
+    if source:
+        response_text += f"\n\n📌 Источник: {source}"
+    if link_to_document:
+        response_text += f"\n\n📎 Подробнее: {link_to_document}"
+    return response_text[:TELEGRAM_MESSAGE_LIMIT]
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    # В новых версиях PTB retry_after — timedelta, в старых — число секунд
+    delay = error.retry_after
+    return delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+
+
+async def edit_message_safe(message, text: str, final: bool = False):
+    """
+    Редактирует сообщение, игнорируя «not modified».
+    Промежуточное обновление при ограничении частоты пропускается;
+    итоговое (final) ждёт указанное Telegram время и повторяется,
+    а если снова не прошло — отправляется новым сообщением
+    """
+    try:
+        await message.edit_text(text)
+    except RetryAfter as e:
+        if not final:
+            return
+        await asyncio.sleep(_retry_after_seconds(e))
+        try:
+            await message.edit_text(text)
+        except (RetryAfter, BadRequest):
+            await message.reply_text(text)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+
+
+async def keep_typing(bot, chat_id: int):
+    """Повторяет индикатор «печатает», пока задачу не отменят: Telegram гасит его через ~5 секунд"""
+    while True:
+        try:
+            await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+        except (BadRequest, RetryAfter):
+            pass
+        await asyncio.sleep(TYPING_ACTION_INTERVAL)
+
+
+async def answer_with_streaming(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """
+    Показывает ответ по мере генерации: одно сообщение редактируется
+    не чаще STREAM_EDIT_INTERVAL секунд, пока модель пишет ответ.
+    Пока вопрос ждёт в очереди, в сообщении показывается место в ней;
+    новый вопрос того же пользователя снимает из очереди прежний.
+    Отказ по лимиту или перегрузке показывается в том же сообщении.
+    """
+    loop = asyncio.get_running_loop()
+    message = await update.message.reply_text("⏳ Ищу ответ в инструкциях...")
+    # Индикатор держится всё время запроса: в очереди и пока модель разбирает промпт
+    typing = asyncio.create_task(keep_typing(context.bot, update.effective_chat.id))
+
+    buffer = ""
+    shown = ""
+    last_edit = loop.time()
+    result = None
+
+    try:
+        async for kind, payload in astream_rag(text, user=_bot_user(update), limited=True, supersede=True):
+            if kind == "queue":
+                await edit_message_safe(message, f"⏳ Вы в очереди: {payload}. Ответ начнёт появляться здесь.")
+                continue
+            if kind == "result":
+                result = payload
+                continue
+
+            buffer += payload
+            now = loop.time()
+            if now - last_edit >= STREAM_EDIT_INTERVAL and buffer.strip() and buffer != shown:
+                await edit_message_safe(message, f"🔍 {buffer.strip()} ▌"[:TELEGRAM_MESSAGE_LIMIT])
+                shown = buffer
+                last_edit = now
+    except RagSupersededError:
+        await edit_message_safe(message, "⏭️ Пропущено: вы задали новый вопрос.")
+        raise
+    except RagRateLimitedError as e:
+        await edit_message_safe(
+            message,
+            f"⏳ Слишком много вопросов подряд. Следующий можно задать через {math.ceil(e.retry_after)} с.",
+            final=True,
+        )
+        return
+    except RagOverloadedError:
+        await edit_message_safe(
+            message, "⏳ Сейчас слишком много запросов. Повторите вопрос через минуту.", final=True
+        )
+        return
+    finally:
+        typing.cancel()
+
+    if result is None:
+        result = {"answer": buffer.strip()}
+    await edit_message_safe(message, format_answer(result), final=True)
+    await send_images(update, context, result.get("images", []))
+
+
+async def send_images(update: Update, context: ContextTypes.DEFAULT_TYPE, images: list):
+    """Отправляет скриншоты из инструкции"""
+    if not images:
+        return
+
+    await update.message.reply_text("📷 Вот скриншоты из инструкции:")
+    available = []
+    for img in images:
+        img_path = img.get("img_path")
+        if img_path and os.path.exists(img_path):
+            available.append(img)
+        else:
+            await update.message.reply_text(f"📷 {img.get('caption', 'Скриншот')} (файл не найден)")
+
+    try:
+        with timed("telegram_photos"):
+            await send_screenshots(context.bot, update.effective_chat.id, available)
+    except Exception as e:
+        print(f"Ошибка отправки скриншотов: {e}")
+        await update.message.reply_text("📷 Не удалось отправить скриншоты")
+
+
+async def on_bot_ready(application):
+    mark_ready("Telegram-бот")
+
+
 def run_telegram():
     if not BOT_TOKEN:
         print("❗ Установите TELEGRAM_BOT_TOKEN в .env")
         return
-    app = Application.builder().token(BOT_TOKEN).build()
+    with startup_phase("Инициализация Telegram-бота"):
+        app = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .concurrent_updates(BOT_CONCURRENT_UPDATES)
+            .post_init(on_bot_ready)
+            .build()
+        )
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("search", search_command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
     app.add_handler(CallbackQueryHandler(button_handler))
     print("✅ Telegram-бот запущен. Ожидание сообщений...")
@@ -192,36 +505,27 @@ def run_telegram():
 
 
 # === Watcher ===
-class WatcherHandler(FileSystemEventHandler):
-    def on_modified(self, event):
-        if event.is_directory or not event.src_path.lower().endswith((".pdf", ".docx")):
-            return
-        print(f"🔄 Изменён: {event.src_path}")
-        load_documents_from_folder()
-
-    def on_created(self, event):
-        if event.is_directory or not event.src_path.lower().endswith((".pdf", ".docx")):
-            return
-        print(f"🆕 Добавлен: {event.src_path}")
-        load_documents_from_folder()
-
-
 def run_watcher():
-    load_documents_from_folder()
-    event_handler = WatcherHandler()
+    # Все изменения индексирует один фоновый поток; события схлопываются с задержкой
+    worker = IndexWorker().start()
+    worker.request_full_sync()
     observer = Observer()
-    observer.schedule(event_handler, "documents", recursive=False)
+    observer.schedule(DocumentEventHandler(worker), worker.folder_path, recursive=False)
     observer.start()
     try:
         while True:
-            asyncio.run(asyncio.sleep(1))
+            time.sleep(1)
     except KeyboardInterrupt:
         observer.stop()
+        worker.stop()
     observer.join()
 
 
 # === Запуск всех сервисов ===
 if __name__ == "__main__":
+    mark_ready("Импорт модулей")
+    # Модель эмбеддингов и индекс грузятся в фоне, бот начинает опрос сразу
+    start_warm_up()
     threading.Thread(target=run_fastapi, daemon=True).start()
     threading.Thread(target=run_watcher, daemon=True).start()
     run_telegram()
\ No newline at end of file
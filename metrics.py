@@ -0,0 +1,218 @@
+# metrics.py
+import os
+import time
+import bisect
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Без метрик все вызовы сводятся к одной проверке флага
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Границы корзин гистограмм длительности, секунды
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = {}
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and value == float("inf"):
+        return "+Inf"
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонно растущий счётчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def total(self):
+        """Сумма по всем меткам"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Текущее значение, которое может и расти, и уменьшаться"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus (кумулятивные корзины, _sum и _count)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}  # метки -> [счётчики корзин..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def totals(self, label: str) -> dict:
+        """Сумма и число наблюдений по значениям одной метки: {значение: (сумма, количество)}"""
+        result = {}
+        with self._lock:
+            for key, state in self._values.items():
+                value = dict(key).get(label)
+                total, count = result.get(value, (0.0, 0))
+                result[value] = (total + state[-2], count + state[-1])
+        return result
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        result = []
+        for key, state in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                result.append((f"{self.name}_bucket", key + (("le", _format_value(float(bound))),), cumulative))
+            result.append((f"{self.name}_sum", key, state[-2]))
+            result.append((f"{self.name}_count", key, state[-1]))
+        return result
+
+
+def _register(cls, name, help_text, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help_text, **kwargs)
+        return metric
+
+
+def counter(name: str, help_text: str) -> Counter:
+    return _register(Counter, name, help_text)
+
+
+def gauge(name: str, help_text: str) -> Gauge:
+    return _register(Gauge, name, help_text)
+
+
+def histogram(name: str, help_text: str, buckets=DURATION_BUCKETS) -> Histogram:
+    return _register(Histogram, name, help_text, buckets=buckets)
+
+
+def register_collector(collect):
+    """
+    Добавляет функцию, которая при каждом экспорте обновляет метрики
+    из внешней статистики (кэш ответов в Redis, пул LLM и т. п.)
+    """
+    with _registry_lock:
+        _collectors.append(collect)
+
+
+STAGE_SECONDS = histogram("stage_duration_seconds", "Длительность этапов обработки запросов, входа и индексации")
+
+
+class _Timer:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, stage=self.stage)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def timed(stage: str):
+    """
+    Замер этапа: with timed("vector_search"): ...
+    Работает и вокруг await. При выключенных метриках — пустой контекст без замеров
+    """
+    return _Timer(stage) if METRICS_ENABLED else _NOOP_TIMER
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    with _registry_lock:
+        collectors = list(_collectors)
+    for collect in collectors:
+        try:
+            collect()
+        except Exception as e:
+            print(f"⚠️ Метрики: ошибка сборщика {getattr(collect, '__name__', collect)}: {e}")
+
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    lines = []
+    for metric in metrics:
+        samples = metric.samples()
+        if not samples:
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in samples:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
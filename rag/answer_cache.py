@@ -0,0 +1,163 @@
+# rag/answer_cache.py
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import redis
+from metrics import counter
+from dotenv import load_dotenv
+from auth.session import get_redis
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 6 * 60 * 60))  # секунды
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))
+# Порог косинусной близости вопросов для семантического попадания (0 — выключено)
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0))
+
+PREFIX = "rag:answer"
+INDEX_VERSION_KEY = "rag:index_version"
+HITS_KEY = f"{PREFIX}:stats:hits"
+MISSES_KEY = f"{PREFIX}:stats:misses"
+
+# Локальные счётчики процесса для /metrics (HITS_KEY/MISSES_KEY — общие для всех процессов)
+LOOKUPS = counter("rag_answer_cache_total", "Обращения к кэшу ответов по результату")
+
+
+def normalize_question(question: str) -> str:
+    """Приводит вопрос к каноническому виду: регистр, ё, пунктуация, пробелы"""
+    text = question.lower().replace("ё", "е")
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def _question_hash(question: str) -> str:
+    return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+
+def get_index_version() -> int:
+    return int(get_redis().get(INDEX_VERSION_KEY) or 0)
+
+
+def bump_index_version():
+    """
+    Вызывается при любом изменении индекса документов.
+    Ключи кэша содержат версию индекса, поэтому старые ответы становятся
+    недостижимы сразу, а из Redis их уберёт TTL.
+    """
+    try:
+        version = get_redis().incr(INDEX_VERSION_KEY)
+        get_redis().delete(f"{PREFIX}:lru:{version - 1}", f"{PREFIX}:vec:{version - 1}")
+    except redis.RedisError as e:
+        print(f"⚠️ Кэш ответов: не удалось обновить версию индекса: {e}")
+
+
+def _keys(version: int):
+    return f"{PREFIX}:lru:{version}", f"{PREFIX}:vec:{version}"
+
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _find_similar(version: int, question_vector) -> str | None:
+    _, vec_key = _keys(version)
+    best_hash, best_score = None, ANSWER_CACHE_SIMILARITY
+    for q_hash, raw in get_redis().hscan_iter(vec_key):
+        score = _cosine(question_vector, json.loads(raw))
+        if score >= best_score:
+            best_hash, best_score = q_hash, score
+    return best_hash
+
+
+def get(question: str, question_vector=None) -> tuple[dict | None, int | None]:
+    """
+    Ищет готовый ответ: сначала по нормализованному вопросу,
+    затем (если задан ANSWER_CACHE_SIMILARITY и question_vector) — по близости эмбеддингов
+    :return: (ответ или None, версия индекса на момент поиска — её передают в put;
+              None, если кэш выключен или недоступен)
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None, None
+    try:
+        version = get_index_version()
+        lru_key, _ = _keys(version)
+        q_hash = _question_hash(question)
+        data = get_redis().get(f"{PREFIX}:{version}:{q_hash}")
+
+        if data is None and ANSWER_CACHE_SIMILARITY > 0 and question_vector is not None:
+            similar = _find_similar(version, question_vector)
+            if similar:
+                q_hash = similar
+                data = get_redis().get(f"{PREFIX}:{version}:{q_hash}")
+
+        if data is None:
+            LOOKUPS.inc(result="miss")
+            get_redis().incr(MISSES_KEY)
+            return None, version
+
+        LOOKUPS.inc(result="hit")
+        get_redis().incr(HITS_KEY)
+        get_redis().zadd(lru_key, {q_hash: time.time()})
+        return json.loads(data), version
+    except redis.RedisError as e:
+        LOOKUPS.inc(result="error")
+        print(f"⚠️ Кэш ответов недоступен: {e}")
+        return None, None
+
+
+def put(question: str, result: dict, version: int | None, question_vector=None):
+    """
+    Сохраняет ответ и вытесняет самые давно использованные записи сверх лимита
+    :param version: версия индекса, которую вернул get: если индекс обновился,
+                    пока шла генерация, ответ по старому индексу уйдёт в старую версию
+    """
+    if not ANSWER_CACHE_ENABLED or version is None:
+        return
+    try:
+        lru_key, vec_key = _keys(version)
+        q_hash = _question_hash(question)
+
+        pipe = get_redis().pipeline()
+        pipe.set(f"{PREFIX}:{version}:{q_hash}", json.dumps(result, ensure_ascii=False), ex=ANSWER_CACHE_TTL)
+        pipe.zadd(lru_key, {q_hash: time.time()})
+        pipe.expire(lru_key, ANSWER_CACHE_TTL)
+        if ANSWER_CACHE_SIMILARITY > 0 and question_vector is not None:
+            pipe.hset(vec_key, q_hash, json.dumps(list(question_vector)))
+            pipe.expire(vec_key, ANSWER_CACHE_TTL)
+        pipe.execute()
+
+        overflow = get_redis().zcard(lru_key) - ANSWER_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            evicted = [q for q, _ in get_redis().zpopmin(lru_key, overflow)]
+            pipe = get_redis().pipeline()
+            pipe.delete(*[f"{PREFIX}:{version}:{q}" for q in evicted])
+            pipe.hdel(vec_key, *evicted)
+            pipe.execute()
+    except redis.RedisError as e:
+        print(f"⚠️ Кэш ответов недоступен: {e}")
+
+
+def stats() -> dict:
+    """Счётчики попаданий и промахов (общие для бота и API)"""
+    try:
+        hits = int(get_redis().get(HITS_KEY) or 0)
+        misses = int(get_redis().get(MISSES_KEY) or 0)
+        version = get_index_version()
+        entries = get_redis().zcard(_keys(version)[0])
+    except redis.RedisError as e:
+        return {"enabled": ANSWER_CACHE_ENABLED, "error": str(e)}
+    total = hits + misses
+    return {
+        "enabled": ANSWER_CACHE_ENABLED,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+        "entries": entries,
+        "index_version": version,
+    }
@@ -0,0 +1,65 @@
+# rag/batching.py
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Окно, в течение которого одновременные вопросы собираются в один вызов энкодера
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", 5))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", 32))
+
+
+class _Batch:
+    def __init__(self):
+        self.texts = []
+        self.vectors = None
+        self.error = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class QueryEmbeddingBatcher:
+    """
+    Микробатчинг эмбеддингов вопросов между потоками пула RAG.
+    Первый поток в окне становится «ведущим»: ждёт EMBED_BATCH_WINDOW_MS
+    (или заполнения батча), кодирует все собранные вопросы одним вызовом
+    и раздаёт результаты остальным.
+    """
+
+    def __init__(self, embed_fn, window_ms: float = EMBED_BATCH_WINDOW_MS, max_batch: int = EMBED_BATCH_MAX):
+        self.embed_fn = embed_fn
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def embed(self, text: str):
+        with self._lock:
+            leader = self._batch is None
+            if leader:
+                self._batch = _Batch()
+            batch = self._batch
+            index = len(batch.texts)
+            batch.texts.append(text)
+            if len(batch.texts) >= self.max_batch:
+                self._batch = None
+                batch.full.set()
+
+        if not leader:
+            batch.done.wait()
+        else:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            try:
+                batch.vectors = self.embed_fn(batch.texts)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.vectors[index]
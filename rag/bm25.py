@@ -0,0 +1,131 @@
+# rag/bm25.py
+import os
+import re
+import math
+import sqlite3
+from collections import Counter
+from dotenv import load_dotenv
+from rag.index_versions import get_active_index_dir, connect_readonly
+from rag.sqlite_utils import in_batches
+
+load_dotenv()
+
+# Инвертированный индекс по тем же чанкам, что и в Chroma, хранится в каталоге версии индекса
+BM25_FILENAME = "bm25.sqlite3"
+BM25_K1 = float(os.getenv("BM25_K1", 1.5))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+
+# Самые частые окончания русских слов (от длинных к коротким) — грубый стемминг,
+# чтобы «подключение» и «подключиться» попадали в один терм
+_RU_ENDINGS = sorted([
+    "ировать", "ование", "ования", "ением", "ениях", "ениям", "ениями",
+    "иться", "аться", "яться", "ение", "ения", "ений", "ению", "ться",
+    "ого", "его", "ому", "ему", "ыми", "ими", "ая", "яя", "ое", "ее", "ые", "ие",
+    "ый", "ий", "ой", "ам", "ям", "ах", "ях", "ов", "ев", "ей", "ом", "ем",
+    "ть", "ет", "ит", "ут", "ют", "ат", "ят",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь",
+], key=len, reverse=True)
+_CYRILLIC = re.compile(r"[а-я]")
+
+
+def _stem(token: str) -> str:
+    if not _CYRILLIC.search(token):
+        return token
+    for ending in _RU_ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= 4:
+            return token[: -len(ending)]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    """Термы для BM25: нижний регистр, ё→е, слова и числа, грубый стемминг русских слов"""
+    return [_stem(t) for t in re.findall(r"\w+", text.lower().replace("ё", "е")) if len(t) > 1]
+
+
+def _connect(index_dir: str = None) -> sqlite3.Connection:
+    path = os.path.join(index_dir or get_active_index_dir(), BM25_FILENAME)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE IF NOT EXISTS chunks (chunk_id TEXT PRIMARY KEY, length INTEGER NOT NULL);"
+        "CREATE TABLE IF NOT EXISTS postings ("
+        " term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL,"
+        " PRIMARY KEY (term, chunk_id)) WITHOUT ROWID;"
+        "CREATE INDEX IF NOT EXISTS postings_by_chunk ON postings (chunk_id);"
+    )
+    return conn
+
+
+def _delete(conn, chunk_ids):
+    for part, marks in in_batches(chunk_ids):
+        conn.execute(f"DELETE FROM postings WHERE chunk_id IN ({marks})", part)
+        conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({marks})", part)
+
+
+def add_chunks(chunk_ids: list[str], texts: list[str], index_dir: str = None):
+    """Добавляет (или заменяет) чанки в инвертированном индексе"""
+    if not chunk_ids:
+        return
+    conn = _connect(index_dir)
+    try:
+        with conn:
+            _delete(conn, list(chunk_ids))
+            for chunk_id, text in zip(chunk_ids, texts):
+                terms = Counter(tokenize(text))
+                conn.execute(
+                    "INSERT INTO chunks (chunk_id, length) VALUES (?, ?)",
+                    (chunk_id, sum(terms.values())),
+                )
+                conn.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                    [(term, chunk_id, tf) for term, tf in terms.items()],
+                )
+    finally:
+        conn.close()
+
+
+def remove_chunks(chunk_ids: list[str], index_dir: str = None):
+    if not chunk_ids:
+        return
+    conn = _connect(index_dir)
+    try:
+        with conn:
+            _delete(conn, list(chunk_ids))
+    finally:
+        conn.close()
+
+
+def search(query: str, k: int = 10, index_dir: str = None) -> list[tuple[str, float]]:
+    """
+    BM25-поиск
+    :return: Список (chunk_id, score) по убыванию релевантности
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+
+    conn = connect_readonly(index_dir, BM25_FILENAME)
+    if conn is None:
+        return []
+    try:
+        n_docs, total_len = conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+        if not n_docs:
+            return []
+        avgdl = total_len / n_docs
+
+        scores = Counter()
+        for term in terms:
+            rows = conn.execute(
+                "SELECT p.chunk_id, p.tf, c.length FROM postings p "
+                "JOIN chunks c ON c.chunk_id = p.chunk_id WHERE p.term = ?",
+                (term,),
+            ).fetchall()
+            if not rows:
+                continue
+            idf = math.log(1 + (n_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+            for chunk_id, tf, length in rows:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl)
+                scores[chunk_id] += idf * tf * (BM25_K1 + 1) / norm
+    finally:
+        conn.close()
+    return scores.most_common(k)
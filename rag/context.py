@@ -0,0 +1,175 @@
+# rag/context.py
+import os
+import re
+import math
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Сколько токенов контекста (фрагментов инструкций) можно отдать в промпт
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1500))
+# HF-токенизатор для точного подсчёта (например, путь к токенизатору llama3);
+# без него используется приближённая оценка
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "")
+MIN_OVERLAP_CHARS = 20  # меньшие совпадения на стыке чанков считаем случайными
+MIN_TRUNCATED_TOKENS = 50  # обрезанный фрагмент короче этого в промпт не добавляем
+# Закрывает блок OCR страницы: по нему видно, что чанк начался на строке-продолжении OCR
+OCR_BLOCK_END = "[Конец текста со скриншотов]"
+SEPARATOR = "\n\n---\n\n"
+TRUNCATION_MARK = " …"
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+_OCR_LABEL = re.compile(r"^\[OCR изображение [^\]]*\]:\s*")
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def _get_tokenizer():
+    """HF-токенизатор из PROMPT_TOKENIZER; загружается при первом подсчёте"""
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        with _tokenizer_lock:
+            if not _tokenizer_loaded:
+                if PROMPT_TOKENIZER:
+                    try:
+                        from transformers import AutoTokenizer
+
+                        _tokenizer = AutoTokenizer.from_pretrained(PROMPT_TOKENIZER)
+                    except Exception as e:
+                        print(f"⚠️ Токенизатор {PROMPT_TOKENIZER} недоступен, используется оценка: {e}")
+                _tokenizer_loaded = True
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    """
+    Число токенов текста. Приближённая оценка: слово ≈ 1 токен на каждые
+    4 символа (для кириллицы BPE дробит слова заметно сильнее, чем латиницу)
+    """
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _TOKEN_PIECES.findall(text))
+
+
+def _is_noise(line: str) -> bool:
+    """Строка OCR без осмысленного текста: мало букв или в основном мусорные символы"""
+    letters = sum(ch.isalpha() for ch in line)
+    return letters < 3 or letters / max(len(line.replace(" ", "")), 1) < 0.5
+
+
+def _starts_in_ocr(lines: list[str]) -> bool:
+    """
+    Чанк начинается внутри OCR-блока: метка изображения или конец блока встречаются
+    раньше метки страницы и заголовка OCR (блок OCR всегда в конце страницы)
+    """
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("[Страница") or stripped.startswith("[Текст со скриншотов"):
+            return False
+        if stripped.startswith("[OCR изображение") or stripped.startswith(OCR_BLOCK_END):
+            return True
+    return False
+
+
+def clean_chunk(text: str, keep_ocr: bool = True) -> str:
+    """
+    Убирает из чанка шум OCR: служебные метки изображений, строки-мусор
+    и лишние пробелы. Обычный текст инструкции не трогает.
+    :param keep_ocr: False — убрать текст со скриншотов и метки страниц целиком (для показа пользователю)
+    """
+    lines = []
+    source_lines = text.splitlines()
+    in_ocr = _starts_in_ocr(source_lines)
+    for line in source_lines:
+        stripped = line.strip()
+        if stripped.startswith("[Текст со скриншотов"):
+            in_ocr = True
+            if keep_ocr:
+                lines.append("[Текст со скриншотов]:")
+            continue
+        if stripped.startswith(OCR_BLOCK_END):
+            in_ocr = False
+            continue
+        if stripped.startswith("[Страница"):
+            in_ocr = False
+            if not keep_ocr:
+                continue
+        if in_ocr or stripped.startswith("[OCR изображение"):
+            if not keep_ocr:
+                continue
+            stripped = " ".join(_OCR_LABEL.sub("", stripped).split())
+            if not stripped or _is_noise(stripped):
+                continue
+        lines.append(stripped)
+    text = "\n".join(lines)
+    # Пустой заголовок OCR-блока в конце не нужен
+    text = re.sub(r"\[Текст со скриншотов\]:\s*$", "", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def _strip_overlap(other: str, text: str) -> str:
+    """
+    Убирает из text перекрытие с уже взятым фрагментом other того же документа:
+    начало text, которым заканчивается other, или конец text, с которого other начинается
+    """
+    limit = min(len(other), len(text))
+    for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+        if other.endswith(text[:size]):
+            return text[size:].lstrip()
+        if other.startswith(text[-size:]):
+            return text[:-size].rstrip()
+    return text
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Обрезает текст по границе слова так, чтобы вместе с многоточием он уложился в max_tokens"""
+    pieces = re.split(r"(\s+)", text)
+    result = []
+    used = count_tokens(TRUNCATION_MARK)
+    for piece in pieces:
+        cost = count_tokens(piece)
+        if used + cost > max_tokens:
+            break
+        result.append(piece)
+        used += cost
+    return "".join(result).rstrip() + TRUNCATION_MARK
+
+
+def build_context(texts: list[str], sources: list[str], budget: int = PROMPT_TOKEN_BUDGET):
+    """
+    Собирает контекст для промпта из найденных чанков (в порядке релевантности)
+    с учётом бюджета токенов (разделители между фрагментами тоже в нём)
+    :return: (текст контекста, число токенов, сколько фрагментов вошло)
+    """
+    parts = []
+    used = 0
+    seen_by_source = {}
+    separator_cost = count_tokens(SEPARATOR)
+
+    for text, source in zip(texts, sources):
+        text = clean_chunk(text)
+        # Соседние чанки одного документа перекрываются на chunk_overlap символов
+        for other in seen_by_source.get(source, []):
+            text = _strip_overlap(other, text)
+        if not text or any(text in other for other in seen_by_source.get(source, [])):
+            continue
+
+        joint = separator_cost if parts else 0
+        cost = count_tokens(text)
+        if used + joint + cost > budget:
+            remaining = budget - used - joint
+            if remaining >= MIN_TRUNCATED_TOKENS:
+                text = _truncate(text, remaining)
+                parts.append(text)
+                used += joint + count_tokens(text)
+            break
+
+        parts.append(text)
+        seen_by_source.setdefault(source, []).append(text)
+        used += joint + cost
+
+    return SEPARATOR.join(parts), used, len(parts)
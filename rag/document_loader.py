@@ -1,12 +1,24 @@
 # rag/document_loader.py
 import os
-import json
-from PyPDF2 import PdfReader
+import time
+import hashlib
+import shutil
+from bisect import bisect_right
 from docx import Document
-from io import BytesIO
-from rag.utils import extract_images_from_pdf
-from rag.rag_engine import add_document
+from docx.oxml.ns import nsmap, qn
+from docx.text.paragraph import Paragraph
+from lxml import etree
+from rag.utils import iter_pdf_pages
+from rag.ocr import ocr_images, OCR_WORKERS, OCR_IMAGES
+from rag.embedding_cache import EMBEDDING_CACHE
+from rag.rag_engine import add_documents, delete_documents, count_documents
+from rag import answer_cache, bm25
+from rag.image_index import replace_document_images, remove_document_images
+from rag.index_versions import get_active_index_dir, new_index_dir, activate_index_dir
+from rag.context import OCR_BLOCK_END
+from rag.manifest import load_manifest, save_manifest, needs_reindex, file_hash, INDEX_FORMAT_VERSION
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from metrics import timed, counter
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -14,78 +26,452 @@ load_dotenv()
 
 DOCUMENTS_DIR = os.getenv("DOCUMENTS_DIR", "documents")
 MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+SUPPORTED_EXTENSIONS = (".pdf", ".docx")
+# Сколько изображений из разных документов распознавать одной пачкой
+OCR_BATCH_IMAGES = int(os.getenv("OCR_BATCH_IMAGES", OCR_WORKERS * 4))
 
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=512,
     chunk_overlap=64,
-    separators=["\n\n", "\n", ". ", " ", ""]
+    separators=["\n\n", "\n", ". ", " ", ""],
+    add_start_index=True  # смещение чанка нужно, чтобы определить его страницы
 )
 
-def load_documents_from_folder(folder_path=DOCUMENTS_DIR):
-    for filename in os.listdir(folder_path):
-        filepath = os.path.join(folder_path, filename)
-        if not os.path.isfile(filepath):
-            continue
+DOCUMENTS_INDEXED = counter("rag_documents_indexed_total", "Проиндексированные документы")
+DOCUMENTS_REMOVED = counter("rag_documents_removed_total", "Документы, удалённые из индекса")
+CHUNKS_INDEXED = counter("rag_chunks_indexed_total", "Записанные в индекс чанки")
+
+# rId картинок, вставленных в текст: <a:blip r:embed="rId…"> и VML-запасной вариант
+# <v:imagedata r:id="rId…"> (mc:Fallback) — обычно копия той же картинки под другим rId
+_IMAGE_REFS = etree.XPath(
+    ".//a:blip/@r:embed | .//v:imagedata/@r:id",
+    namespaces={"a": nsmap["a"], "r": nsmap["r"], "v": "urn:schemas-microsoft-com:vml"},
+)
+
+
+def parse_document(filepath) -> dict:
+    """
+    Разбирает PDF/DOCX без OCR, изображения сохраняются в MEDIA_DIR
+    :return: {"images": метаданные изображений, "pages": [(номер страницы, текст)]} для PDF,
+             {"images", "text", "page_map"} для DOCX (текст скриншотов в него не входит)
+    """
+    filename = os.path.basename(filepath)
 
-        full_text = ""
+    if filename.lower().endswith(".pdf"):
+        # Один проход по файлу: текст и изображения постранично.
+        # Текст всех страниц держится в памяти: чанки режутся по документу целиком
+        pages = []
         images_metadata = []
+        for page_num, text, page_images in iter_pdf_pages(filepath):
+            pages.append((page_num, text))
+            images_metadata.extend(page_images)
+        return {"pages": pages, "images": images_metadata}
+
+    if filename.lower().endswith(".docx"):
+        doc = Document(filepath)
+        full_text, image_offsets = _docx_text_and_image_offsets(doc)
+        images_metadata = []
+        # Без разметки страниц весь текст относится к «странице» 0
+        page_map = [(0, 0)]
+
+        # Страниц в DOCX нет: «страница» k начинается с абзаца, к которому относится k-й скриншот
+        # (последнего непустого перед ним), и идёт до такого же абзаца следующего скриншота,
+        # так чанк получает скриншоты шага, который он описывает, и стоящие сразу после него.
+        # Изображения вне основного текста (колонтитулы, неиспользуемые) остаются на «странице» 0.
+        # Одинаковые по содержимому (копии для VML) сохраняются один раз — по первому упоминанию
+        image_ids = list(image_offsets) + [r_id for r_id in doc.part.rels if r_id not in image_offsets]
+        seen = set()
+        for i, r_id in enumerate(image_ids):
+            rel = doc.part.rels[r_id]
+            if "image" not in rel.target_ref:
+                continue
+            try:
+                img_data = rel._target.blob
+                digest = hashlib.sha256(img_data).digest()
+                if digest in seen:
+                    continue
+                seen.add(digest)
+
+                offset = image_offsets.get(r_id)
+                if offset is not None and offset > page_map[-1][0]:
+                    page_map.append((offset, len(page_map)))
+                safe_filename = Path(filename).stem
+                img_path = f"{MEDIA_DIR}/{safe_filename}_img_{i}.jpg"
+                with open(img_path, "wb") as f:
+                    f.write(img_data)
+
+                images_metadata.append({
+                    "page_num": page_map[-1][1] if offset is not None else 0,
+                    "order": i,
+                    "img_path": img_path,
+                    "caption": f"Изображение {i + 1} из {filename}",
+                })
+            except Exception as e:
+                print(f"DOCX image error for {filename} image {i}: {e}")
+        return {"text": full_text, "page_map": page_map, "images": images_metadata}
+
+    return {"text": "", "page_map": [(0, 0)], "images": []}
+
+
+def ocr_documents(documents):
+    """
+    Распознаёт изображения нескольких разобранных документов одной пачкой
+    (параллельно, до OCR_WORKERS процессов tesseract) и дописывает ocr_text в их метаданные
+    """
+    images = [img for document in documents for img in document["images"]]
+    ocr_texts = ocr_images([img["img_path"] for img in images])
+    for img, ocr_text in zip(images, ocr_texts):
+        img["ocr_text"] = ocr_text
+
+
+def assemble_document(document):
+    """
+    Собирает текст документа после OCR
+    :return: (полный текст, список метаданных изображений,
+              карта страниц — список (смещение в тексте, номер страницы) по возрастанию смещения)
+    """
+    if "pages" not in document:
+        return document["text"], document["images"], document["page_map"]
+
+    # Текст скриншотов из PDF кладём на их же страницу
+    ocr_by_page = {}
+    for img in document["images"]:
+        if img.get("ocr_text"):
+            ocr_by_page.setdefault(img["page_num"], []).append(
+                f"[OCR изображение {Path(img['img_path']).stem}]: {img['ocr_text']}"
+            )
+
+    text_parts = []
+    page_map = []
+    offset = 0
+    for page_num, text in document["pages"]:
+        segment = f"\n[Страница {page_num + 1}]\n{text}\n" if text else ""
+        if page_num in ocr_by_page:
+            segment += (
+                "\n[Текст со скриншотов из PDF]:\n" + "\n".join(ocr_by_page[page_num]) + f"\n{OCR_BLOCK_END}\n"
+            )
+        if not segment:
+            continue
+        page_map.append((offset, page_num))
+        text_parts.append(segment)
+        offset += len(segment)
+
+    return "".join(text_parts), document["images"], page_map or [(0, 0)]
+
+
+def extract_document(filepath):
+    """
+    Извлекает текст и изображения (с OCR) из PDF/DOCX
+    :return: (полный текст, список метаданных изображений,
+              карта страниц — список (смещение в тексте, номер страницы) по возрастанию смещения)
+    """
+    document = parse_document(filepath)
+    ocr_documents([document])
+    return assemble_document(document)
+
+
+def _docx_text_and_image_offsets(doc) -> tuple[str, dict]:
+    """
+    Текст DOCX (непустые абзацы через перевод строки) и смещения изображений в нём
+    :return: (текст, {rId изображения: смещение начала абзаца, к которому оно относится})
+             в порядке появления. Скриншот обычно стоит в отдельном пустом абзаце сразу после
+             описания шага, поэтому относится к последнему непустому абзацу перед ним
+             (или к своему, если в нём есть текст); изображения из таблиц — к абзацу перед таблицей
+    """
+    text_parts = []
+    image_offsets = {}
+    offset = 0
+    paragraph_start = 0  # начало последнего непустого абзаца
+    for element in doc.element.body.iterchildren(etree.Element):
+        text = Paragraph(element, doc).text if element.tag == qn("w:p") else ""
+        if text.strip():
+            paragraph_start = offset
+        for r_id in _IMAGE_REFS(element):
+            image_offsets.setdefault(r_id, paragraph_start)
+        if text.strip():
+            text_parts.append(text)
+            offset += len(text) + 1
+    return "\n".join(text_parts), image_offsets
+
+
+def page_range(start: int, length: int, page_map) -> tuple[int, int]:
+    """Определяет первую и последнюю страницу, которые покрывает фрагмент текста"""
+    offsets = [offset for offset, _ in page_map]
+    first = max(bisect_right(offsets, start) - 1, 0)
+    last = max(bisect_right(offsets, start + max(length - 1, 0)) - 1, 0)
+    return page_map[first][1], page_map[last][1]
+
+
+def _remove_media(paths):
+    for img_path in paths:
+        try:
+            if os.path.exists(img_path):
+                os.remove(img_path)
+        except OSError as e:
+            print(f"⚠️ Не удалось удалить {img_path}: {e}")
+
+
+def index_file(filepath, old_entry=None, content_hash=None, index_dir=None, document=None):
+    """
+    Индексирует один файл и удаляет устаревшие чанки и медиа его прошлой версии
+    :param document: Уже разобранный документ с OCR (parse_document + ocr_documents)
+    :return: Новая запись манифеста
+    """
+    filename = os.path.basename(filepath)
+    stat = os.stat(filepath)
+    if document is None:
+        with timed("index_extract"):
+            full_text, images_metadata, page_map = extract_document(filepath)
+    else:
+        full_text, images_metadata, page_map = assemble_document(document)
+
+    chunk_ids = []
+    # Обрабатываем документ, если есть текст
+    if full_text.strip():
+        with timed("index_split"):
+            split_docs = text_splitter.create_documents([full_text])
+        chunks = [d.page_content for d in split_docs]
+        chunk_ids = [f"{filename}_chunk_{i}" for i in range(len(chunks))]
+        # Изображения документа лежат в image_index; чанк хранит только
+        # источник и диапазон страниц, по которым ищутся его скриншоты
+        metadatas = []
+        for d in split_docs:
+            page_start, page_end = page_range(d.metadata.get("start_index", 0), len(d.page_content), page_map)
+            metadatas.append({
+                "source": filename,
+                "source_path": filepath,
+                "page_start": page_start,
+                "page_end": page_end,
+            })
+
+        started = time.perf_counter()
+        with timed("index_embed_store"):
+            add_documents(chunk_ids, chunks, metadatas, index_dir=index_dir)
+        with timed("index_bm25"):
+            bm25.add_chunks(chunk_ids, chunks, index_dir)
+        CHUNKS_INDEXED.inc(len(chunks))
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        size_mb = sum(len(c.encode("utf-8")) for c in chunks) / (1024 * 1024)
+        print(
+            f"⚡ {filename}: {len(chunks)} чанков за {elapsed:.2f} с "
+            f"({len(chunks) / elapsed:.1f} чанков/с, {size_mb / elapsed:.2f} МБ/с)"
+        )
+
+    with timed("index_images"):
+        replace_document_images(filename, images_metadata, index_dir)
+    media = [img["img_path"] for img in images_metadata if img.get("img_path")]
+
+    if old_entry:
+        # Документ стал короче — удаляем «хвостовые» чанки и пропавшие скриншоты
+        stale_ids = sorted(set(old_entry.get("chunk_ids", [])) - set(chunk_ids))
+        delete_documents(stale_ids, index_dir)
+        bm25.remove_chunks(stale_ids, index_dir)
+        _remove_media(set(old_entry.get("media", [])) - set(media))
+
+    DOCUMENTS_INDEXED.inc()
+    return {
+        "format": INDEX_FORMAT_VERSION,
+        "hash": content_hash or file_hash(filepath),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "chunk_ids": chunk_ids,
+        "media": media,
+    }
+
+
+def remove_file(filename, manifest, index_dir=None):
+    """Удаляет из индекса чанки и медиа файла, которого больше нет в папке"""
+    entry = manifest.pop(filename, None)
+    if not entry:
+        return False
+    delete_documents(entry.get("chunk_ids", []), index_dir)
+    bm25.remove_chunks(entry.get("chunk_ids", []), index_dir)
+    remove_document_images(filename, index_dir)
+    _remove_media(entry.get("media", []))
+    DOCUMENTS_REMOVED.inc()
+    print(f"🗑️ Удалён из индекса: {filename}")
+    return True
+
+
+def is_supported_document(filepath) -> bool:
+    """PDF/DOCX, кроме временных файлов редакторов (~$file.docx, .file.pdf)"""
+    filename = os.path.basename(filepath)
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS) and not filename.startswith(("~$", "."))
+
+
+def _index_batch(batch, manifest, index_dir) -> int:
+    """
+    Распознаёт изображения пачки разобранных документов одним вызовом OCR и индексирует их
+    :param batch: Список (путь, запись манифеста, хэш содержимого, документ из parse_document)
+    :return: Сколько файлов проиндексировано
+    """
+    if not batch:
+        return 0
+    try:
+        with timed("index_extract"):
+            ocr_documents([document for *_, document in batch])
+    except Exception as e:
+        print(f"❌ Ошибка OCR ({', '.join(os.path.basename(item[0]) for item in batch)}): {e}")
+        return 0
+
+    indexed = 0
+    for filepath, entry, content_hash, document in batch:
+        filename = os.path.basename(filepath)
+        try:
+            manifest[filename] = index_file(filepath, entry, content_hash, index_dir, document)
+        except Exception as e:
+            print(f"❌ Ошибка индексации {filename}: {e}")
+            continue
+        print(f"📄 Проиндексирован: {filename}")
+        # Сохраняем после каждого файла, чтобы не потерять прогресс при сбое
+        save_manifest(manifest, index_dir)
+        indexed += 1
+    return indexed
+
+
+def _sync_files(filepaths, manifest, index_dir) -> int:
+    """
+    Переиндексирует изменившиеся файлы. Документы разбираются по очереди, а их изображения
+    копятся и распознаются пачками по OCR_BATCH_IMAGES: в инструкции обычно пара скриншотов,
+    и OCR по одному документу не загрузил бы все ядра
+    :return: Сколько файлов проиндексировано
+    """
+    indexed = 0
+    batch = []
+    pending_images = 0
+    for filepath in filepaths:
+        filename = os.path.basename(filepath)
+        entry = manifest.get(filename)
+        changed, content_hash = needs_reindex(filepath, entry)
+        if not changed:
+            continue
+
+        try:
+            with timed("index_extract"):
+                document = parse_document(filepath)
+        except Exception as e:
+            print(f"❌ Ошибка индексации {filename}: {e}")
+            continue
+
+        if not document["images"]:
+            # Распознавать нечего — не держим документ в памяти до конца пачки
+            indexed += _index_batch([(filepath, entry, content_hash, document)], manifest, index_dir)
+            continue
+        batch.append((filepath, entry, content_hash, document))
+        pending_images += len(document["images"])
+        if pending_images >= OCR_BATCH_IMAGES:
+            indexed += _index_batch(batch, manifest, index_dir)
+            batch = []
+            pending_images = 0
+
+    return indexed + _index_batch(batch, manifest, index_dir)
+
+
+def _cache_counts() -> dict:
+    """Показания счётчиков кэшей: статистика прогона индексации — их прирост за прогон"""
+    return {
+        "🖼️ OCR-кэш": (OCR_IMAGES.value(cache="hit"), OCR_IMAGES.value(cache="miss")),
+        "🧠 Кэш эмбеддингов": (
+            EMBEDDING_CACHE.value(kind="chunk", result="hit"),
+            EMBEDDING_CACHE.value(kind="chunk", result="miss"),
+        ),
+    }
+
+
+def _finish_sync(manifest, indexed, removed, index_dir, counts_before):
+    save_manifest(manifest, index_dir)
+    if (indexed or removed) and index_dir == get_active_index_dir():
+        # Индекс изменился — ранее закэшированные ответы больше не актуальны
+        answer_cache.bump_index_version()
+
+    for label, (hits, misses) in _cache_counts().items():
+        hits -= counts_before[label][0]
+        misses -= counts_before[label][1]
+        if hits or misses:
+            print(f"{label}: попаданий {hits}, промахов {misses} ({hits / (hits + misses):.0%})")
+    print(f"✅ Документы синхронизированы: обновлено {indexed}, удалено {removed}, всего в индексе {len(manifest)}.")
+
+
+def sync_files(filepaths):
+    """
+    Синхронизирует с индексом только указанные файлы (для событий watcher'а):
+    существующие переиндексируются при изменении, пропавшие удаляются
+    """
+    # Версию индекса фиксируем на весь проход, даже если её переключат по ходу
+    index_dir = get_active_index_dir()
+    manifest = load_manifest(index_dir)
+    existing = []
+    removed = 0
+    counts_before = _cache_counts()
+
+    for filepath in sorted(set(filepaths)):
+        if not is_supported_document(filepath):
+            continue
+        if os.path.isfile(filepath):
+            existing.append(filepath)
+        else:
+            removed += remove_file(os.path.basename(filepath), manifest, index_dir)
+    indexed = _sync_files(existing, manifest, index_dir)
+
+    _finish_sync(manifest, indexed, removed, index_dir, counts_before)
+
+
+def load_documents_from_folder(folder_path=DOCUMENTS_DIR, index_dir=None):
+    """
+    Синхронизирует индекс с папкой документов.
+    Обрабатываются только новые и изменённые файлы (по манифесту),
+    данные удалённых файлов вычищаются из индекса.
+    :param index_dir: Каталог версии индекса (по умолчанию — активная)
+    """
+    index_dir = index_dir or get_active_index_dir()
+    manifest = load_manifest(index_dir)
+    filepaths = []
+    counts_before = _cache_counts()
+
+    with timed("index_sync_folder"):
+        for filename in sorted(os.listdir(folder_path)):
+            filepath = os.path.join(folder_path, filename)
+            if os.path.isfile(filepath) and is_supported_document(filepath):
+                filepaths.append(filepath)
+        present = {os.path.basename(filepath) for filepath in filepaths}
+        indexed = _sync_files(filepaths, manifest, index_dir)
+
+        removed = 0
+        for filename in sorted(set(manifest) - present):
+            removed += remove_file(filename, manifest, index_dir)
+
+    _finish_sync(manifest, indexed, removed, index_dir, counts_before)
+
+
+def rebuild_required() -> bool:
+    """Формат индекса устарел — обновлять его нужно полной перестройкой, а не на месте"""
+    manifest = load_manifest()
+    if not manifest:
+        # Индекс, построенный до появления манифеста: при обновлении на месте
+        # его лишние чанки ({файл}_chunk_{i} сверх нового числа) остались бы навсегда
+        return count_documents() > 0
+    return any(entry.get("format") != INDEX_FORMAT_VERSION for entry in manifest.values())
+
+
+def rebuild_index(folder_path=DOCUMENTS_DIR):
+    """
+    Полная перестройка индекса без простоя: новая версия строится в отдельном
+    каталоге, пока запросы обслуживает текущая, затем атомарно становится активной.
+    Старая версия удаляется с задержкой (см. INDEX_GC_DELAY).
+    """
+    old_manifest = load_manifest()
+    new_dir = new_index_dir()
+    print(f"🏗️ Перестройка индекса в {new_dir}...")
+    try:
+        load_documents_from_folder(folder_path, index_dir=new_dir)
+    except Exception:
+        shutil.rmtree(new_dir, ignore_errors=True)
+        raise
+
+    activate_index_dir(new_dir)
+    answer_cache.bump_index_version()
 
-        if filename.lower().endswith(".pdf"):
-            reader = PdfReader(filepath)
-            for page_num, page in enumerate(reader.pages):
-                text = page.extract_text()
-                if text:
-                    full_text += f"\n[Страница {page_num + 1}]\n{text}\n"
-
-            # Извлечение изображений из PDF
-            image_data, ocr_texts_combined = extract_images_from_pdf(filepath)
-            if ocr_texts_combined.strip():
-                full_text += f"\n[Текст со скриншотов из PDF]:\n{ocr_texts_combined}\n"
-            
-            images_metadata = image_data
-
-        elif filename.lower().endswith(".docx"):
-            doc = Document(filepath)
-            full_text = "\n".join([p.text for p in doc.paragraphs if p.text.strip()])
-            images_metadata = []
-
-            for i, rel in enumerate(doc.part.rels.values()):
-                if "image" in rel.target_ref:
-                    try:
-                        image = rel._target
-                        img_data = image.blob
-                        safe_filename = Path(filename).stem
-                        img_path = f"{MEDIA_DIR}/{safe_filename}_img_{i}.jpg"
-                        with open(img_path, "wb") as f:
-                            f.write(img_data)
-
-                        # OCR для изображений DOCX
-                        from PIL import Image
-                        import pytesseract
-                        
-                        pil_img = Image.open(BytesIO(img_data))
-                        ocr_text = pytesseract.image_to_string(pil_img, lang='eng+rus').strip()
-                        
-                        images_metadata.append({
-                            "page_num": 0,
-                            "order": i,
-                            "img_path": img_path,
-                            "caption": f"Изображение {i + 1} из {filename}",
-                            "ocr_text": ocr_text
-                        })
-                    except Exception as e:
-                        print(f"DOCX image error for {filename} image {i}: {e}")
-
-        # Обрабатываем документ, если есть текст
-        if full_text.strip():
-            chunks = text_splitter.split_text(full_text)
-            for i, chunk in enumerate(chunks):
-                # Преобразуем список метаданных изображений в JSON строку для хранения в Chroma
-                metadata = {
-                    "source": filename,
-                    "source_path": filepath,
-                    "images": json.dumps(images_metadata)
-                }
-                add_document(f"{filename}_chunk_{i}", chunk, metadata)
-
-    print("✅ Документы загружены с сохранением изображений (пути и базовые метаданные).")
\ No newline at end of file
+    # Скриншоты, которые остались только в старой версии
+    new_media = {path for entry in load_manifest(new_dir).values() for path in entry.get("media", [])}
+    old_media = {path for entry in old_manifest.values() for path in entry.get("media", [])}
+    _remove_media(old_media - new_media)
@@ -0,0 +1,117 @@
+# rag/embedding_cache.py
+import os
+import array
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from metrics import timed, counter
+from rag.sqlite_utils import select_in, touch_and_prune
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Эмбеддинги чанков переживают перестройку индекса: неизменённый текст повторно не кодируется
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+# Через сколько дней без обращений вектор удаляется из кэша (0 — хранить бессрочно)
+EMBEDDING_CACHE_MAX_AGE_DAYS = float(os.getenv("EMBEDDING_CACHE_MAX_AGE_DAYS", 90))
+# Сколько последних вопросов держать в памяти (0 — не кэшировать)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 1024))
+
+EMBEDDING_CACHE = counter("rag_embedding_cache_total", "Обращения к кэшу эмбеддингов по типу текста и результату")
+
+
+class CachedEmbeddings:
+    """
+    Обёртка над моделью эмбеддингов (интерфейс LangChain Embeddings).
+    embed_documents берёт векторы из SQLite-кэша по (модель, хэш текста) — векторы,
+    не нужные дольше max_age_days, из него удаляются; вопросы кэшируются в памяти (LRU).
+    """
+
+    def __init__(self, embeddings, model_name: str, path: str = EMBEDDING_CACHE_PATH,
+                 query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE,
+                 max_age_days: float = EMBEDDING_CACHE_MAX_AGE_DAYS):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.path = path
+        self.query_cache_size = query_cache_size
+        self.max_age_days = max_age_days
+        self._queries = OrderedDict()
+        self._queries_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL DEFAULT (julianday('now')))"
+        )
+        return conn
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+
+        keys = [self._key(text) for text in texts]
+        conn = self._connect()
+        try:
+            rows = select_in(conn, "SELECT key, vector FROM embeddings WHERE key IN ({marks})", set(keys))
+            cached = {key: array.array("f", blob).tolist() for key, blob in rows}
+            hits = list(cached)
+
+            # Одинаковые тексты внутри пачки кодируем один раз
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in cached:
+                    missing.setdefault(key, text)
+            if missing:
+                with timed("embed_chunks"):
+                    vectors = self.embeddings.embed_documents(list(missing.values()))
+                new = dict(zip(missing, vectors))
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                        [(key, array.array("f", vector).tobytes()) for key, vector in new.items()],
+                    )
+                cached.update(new)
+            touch_and_prune(conn, "embeddings", hits, self.max_age_days)
+        finally:
+            conn.close()
+
+        EMBEDDING_CACHE.inc(len(texts) - len(missing), kind="chunk", result="hit")
+        EMBEDDING_CACHE.inc(len(missing), kind="chunk", result="miss")
+        return [cached[key] for key in keys]
+
+    def cached_query(self, text: str):
+        """Вектор вопроса из памяти или None"""
+        with self._queries_lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+            return vector
+
+    def _remember_query(self, text: str, vector):
+        if self.query_cache_size <= 0:
+            return
+        with self._queries_lock:
+            self._queries[text] = vector
+            self._queries.move_to_end(text)
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Эмбеддинги пачки вопросов: повторные берутся из LRU, остальные кодируются одним вызовом"""
+        vectors = [self.cached_query(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            with timed("embed_query"):
+                computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+                self._remember_query(texts[i], vector)
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_queries([text])[0]
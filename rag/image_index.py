@@ -0,0 +1,102 @@
+# rag/image_index.py
+import os
+import sqlite3
+from dotenv import load_dotenv
+from rag.index_versions import get_active_index_dir, connect_readonly
+
+load_dotenv()
+
+# Метаданные изображений хранятся один раз на документ, а не в каждом чанке,
+# в каталоге своей версии индекса
+IMAGE_INDEX_FILENAME = "images.sqlite3"
+
+
+def _connect(index_dir: str = None) -> sqlite3.Connection:
+    path = os.path.join(index_dir or get_active_index_dir(), IMAGE_INDEX_FILENAME)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS images ("
+        "source TEXT NOT NULL, page_num INTEGER NOT NULL, ord INTEGER NOT NULL, "
+        "img_path TEXT NOT NULL, caption TEXT, ocr_text TEXT, "
+        "PRIMARY KEY (source, img_path))"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS images_by_page ON images (source, page_num)")
+    return conn
+
+
+def replace_document_images(source: str, images: list[dict], index_dir: str = None):
+    """Заменяет список изображений документа"""
+    conn = _connect(index_dir)
+    try:
+        with conn:
+            conn.execute("DELETE FROM images WHERE source = ?", (source,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO images (source, page_num, ord, img_path, caption, ocr_text) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (source, img.get("page_num", 0), img.get("order", 0), img["img_path"],
+                     img.get("caption", ""), img.get("ocr_text", ""))
+                    for img in images if img.get("img_path")
+                ],
+            )
+    finally:
+        conn.close()
+
+
+def remove_document_images(source: str, index_dir: str = None):
+    conn = _connect(index_dir)
+    try:
+        with conn:
+            conn.execute("DELETE FROM images WHERE source = ?", (source,))
+    finally:
+        conn.close()
+
+
+def get_chunk_images(chunk_refs, index_dir: str = None) -> list[dict]:
+    """
+    Изображения со страниц, которые покрывают найденные чанки
+    :param chunk_refs: Список (source, page_start, page_end); если диапазон
+                       страниц неизвестен (None), берутся все изображения документа
+    :return: Уникальные по пути изображения в порядке ранга чанка (первый — самый
+             релевантный), внутри чанка — по странице и порядку на странице
+    """
+    conditions = []
+    params = []
+    refs = []
+    for source, page_start, page_end in chunk_refs:
+        if not source:
+            continue
+        refs.append((source, page_start, page_end))
+        if page_start is None or page_end is None:
+            conditions.append("source = ?")
+            params.append(source)
+        else:
+            conditions.append("(source = ? AND page_num BETWEEN ? AND ?)")
+            params.extend([source, page_start, page_end])
+    if not conditions:
+        return []
+
+    conn = connect_readonly(index_dir, IMAGE_INDEX_FILENAME)
+    if conn is None:
+        return []
+    try:
+        rows = conn.execute(
+            "SELECT DISTINCT source, page_num, ord, img_path, caption FROM images "
+            f"WHERE {' OR '.join(conditions)}",
+            params,
+        ).fetchall()
+    finally:
+        conn.close()
+
+    def rank(row):
+        source, page_num, order = row[:3]
+        for i, (ref_source, page_start, page_end) in enumerate(refs):
+            if source == ref_source and (page_start is None or page_end is None or page_start <= page_num <= page_end):
+                return i, page_num, order
+        return len(refs), page_num, order
+
+    return [
+        {"source": source, "page_num": page_num, "order": order, "img_path": img_path, "caption": caption}
+        for source, page_num, order, img_path, caption in sorted(rows, key=rank)
+    ]
@@ -0,0 +1,159 @@
+# rag/index_versions.py
+import os
+import re
+import time
+import shutil
+import sqlite3
+import itertools
+import threading
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Корень индексов. Полные перестройки пишутся в CHROMA_DIR/index-<время>,
+# а файл CURRENT указывает на активную версию. Без CURRENT активен сам CHROMA_DIR
+# (раскладка до появления версий). HISTORY — версии в порядке активации.
+CHROMA_DIR = os.getenv("CHROMA_DIR", "chroma_db")
+CURRENT_FILE = os.path.join(CHROMA_DIR, "CURRENT")
+HISTORY_FILE = os.path.join(CHROMA_DIR, "HISTORY")
+HISTORY_SIZE = 20
+VERSION_PREFIX = "index-"
+# Через сколько секунд после переключения удалять старые версии
+# (даём дозавершиться запросам, которые ещё читают старый индекс)
+INDEX_GC_DELAY = float(os.getenv("INDEX_GC_DELAY", 60))
+# Файлы индекса в корне CHROMA_DIR (раскладка до версий) и каталоги сегментов Chroma
+LEGACY_FILES = ("chroma.sqlite3", "bm25.sqlite3", "images.sqlite3", "manifest.json")
+_SEGMENT_DIR = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+_lock = threading.Lock()
+_cached = (None, CHROMA_DIR)  # ((mtime, inode) файла CURRENT, активный каталог)
+_sequence = itertools.count()
+
+
+def get_active_index_dir() -> str:
+    """
+    Каталог активной версии индекса.
+    CURRENT перечитывается только при изменении mtime или inode (файл заменяется целиком),
+    поэтому переключение, сделанное другим процессом (watcher.py), тоже подхватывается.
+    """
+    global _cached
+    try:
+        stat = os.stat(CURRENT_FILE)
+    except FileNotFoundError:
+        return CHROMA_DIR
+
+    key = (stat.st_mtime_ns, stat.st_ino)
+    cached_key, cached_dir = _cached
+    if key == cached_key:
+        return cached_dir
+
+    with _lock:
+        with open(CURRENT_FILE, "r", encoding="utf-8") as f:
+            name = f.read().strip()
+        active = os.path.join(CHROMA_DIR, name) if name else CHROMA_DIR
+        _cached = (key, active)
+    return active
+
+
+def connect_readonly(index_dir: str | None, filename: str) -> sqlite3.Connection | None:
+    """
+    Соединение для поиска по базе версии индекса: не создаёт ни каталог, ни пустую базу —
+    версия может быть ещё не построена или уже удалена сборщиком старых версий
+    :param index_dir: Каталог версии (по умолчанию — активная)
+    :return: None, если базы нет
+    """
+    path = os.path.join(index_dir or get_active_index_dir(), filename)
+    try:
+        return sqlite3.connect(f"{Path(os.path.abspath(path)).as_uri()}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        return None
+
+
+def new_index_dir() -> str:
+    """
+    Создаёт пустой каталог для новой версии индекса.
+    Имя — время создания в наносекундах, pid и счётчик процесса: уникально
+    и задаёт порядок создания (см. _creation_key)
+    """
+    path = os.path.join(CHROMA_DIR, f"{VERSION_PREFIX}{time.time_ns()}-{os.getpid()}-{next(_sequence)}")
+    os.makedirs(path)
+    return path
+
+
+def _creation_key(name: str) -> tuple | None:
+    """
+    Порядок создания версии по числам в её имени. Имена старого формата
+    (index-ГГГГММДД-ЧЧММСС-pid) упорядочены между собой и старше новых
+    :return: None для чужих каталогов с тем же префиксом (их сборщик не трогает)
+    """
+    try:
+        return tuple(int(part) for part in name[len(VERSION_PREFIX):].split("-"))
+    except ValueError:
+        return None
+
+
+def _read_history() -> list[str]:
+    try:
+        with open(HISTORY_FILE, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def _previous_version(active: str) -> str | None:
+    """Версия, которая была активна перед active (по HISTORY)"""
+    history = _read_history()
+    if active not in history:
+        return None
+    position = len(history) - 1 - history[::-1].index(active)
+    return history[position - 1] if position > 0 else None
+
+
+def activate_index_dir(index_dir: str):
+    """Атомарно делает версию активной, записывает её в HISTORY и планирует удаление старых"""
+    name = os.path.basename(index_dir)
+    with _lock:
+        history = (_read_history() + [name])[-HISTORY_SIZE:]
+        for path, content in ((HISTORY_FILE, "".join(f"{line}\n" for line in history)), (CURRENT_FILE, name)):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+    print(f"🔀 Активная версия индекса: {index_dir}")
+
+    timer = threading.Timer(INDEX_GC_DELAY, gc_index_dirs)
+    timer.daemon = True
+    timer.start()
+
+
+def gc_index_dirs():
+    """
+    Удаляет версии индекса, созданные раньше активной, включая индекс в корне CHROMA_DIR
+    (раскладка до версий). Предыдущую активную версию оставляет: если версии переключились
+    дважды подряд, её ещё могут читать запросы, начатые до последнего переключения, —
+    она удалится при следующем. Более новые не трогаем: это может быть перестройка, которая ещё идёт.
+    """
+    active = os.path.basename(os.path.abspath(get_active_index_dir()))
+    if not active.startswith(VERSION_PREFIX):
+        return
+    keep = {active, _previous_version(active)}
+    active_key = _creation_key(active)
+    legacy = False
+    for name in os.listdir(CHROMA_DIR):
+        path = os.path.join(CHROMA_DIR, name)
+        if name in LEGACY_FILES or name.startswith(f"{LEGACY_FILES[0]}-"):  # chroma.sqlite3-wal и т. п.
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            legacy = True
+        elif _SEGMENT_DIR.match(name) and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            legacy = True
+        elif (name.startswith(VERSION_PREFIX) and os.path.isdir(path) and name not in keep
+              and (_creation_key(name) or active_key) < active_key):
+            shutil.rmtree(path, ignore_errors=True)
+            print(f"🧹 Удалена старая версия индекса: {path}")
+    if legacy:
+        print(f"🧹 Удалён индекс в корне {CHROMA_DIR} (раскладка до версий)")
@@ -0,0 +1,139 @@
+# rag/indexer.py
+import os
+import time
+import threading
+from watchdog.events import FileSystemEventHandler
+from dotenv import load_dotenv
+from rag.document_loader import (
+    DOCUMENTS_DIR,
+    load_documents_from_folder,
+    rebuild_index,
+    rebuild_required,
+    sync_files,
+    is_supported_document,
+)
+
+load_dotenv()
+
+# Сколько секунд «тишины» ждать после последнего события, прежде чем индексировать
+INDEX_DEBOUNCE_SECONDS = float(os.getenv("INDEX_DEBOUNCE_SECONDS", 2.0))
+
+
+class IndexWorker:
+    """
+    Единственный фоновый поток индексации.
+    События файловой системы складываются в множество путей (повторы схлопываются),
+    после паузы INDEX_DEBOUNCE_SECONDS вся пачка индексируется за один проход.
+    Поиск тем временем продолжает работать по текущему индексу.
+    """
+
+    def __init__(self, folder_path=DOCUMENTS_DIR, debounce=INDEX_DEBOUNCE_SECONDS):
+        self.folder_path = folder_path
+        self.debounce = debounce
+        self._pending = set()
+        self._full_sync = False
+        self._rebuild = False
+        self._last_event = 0.0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="index-worker", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def submit(self, path):
+        """Ставит изменённый/удалённый файл в очередь на индексацию"""
+        with self._cond:
+            self._pending.add(os.path.abspath(path))
+            self._last_event = time.monotonic()
+            self._cond.notify()
+
+    def request_full_sync(self):
+        """Полная сверка папки с индексом (например, при старте)"""
+        with self._cond:
+            self._full_sync = True
+            self._last_event = time.monotonic()
+            self._cond.notify()
+
+    def request_rebuild(self):
+        """Полная перестройка индекса в новой версии с атомарным переключением"""
+        with self._cond:
+            self._rebuild = True
+            self._cond.notify()
+
+    def _take_batch(self):
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None, None
+                if self._rebuild:
+                    # Перестройка заново читает всю папку — накопленные события ей не нужны
+                    self._rebuild, self._full_sync, self._pending = False, False, set()
+                    return set(), "rebuild"
+                if not self._pending and not self._full_sync:
+                    self._cond.wait()
+                    continue
+                # Ждём, пока поток событий утихнет (файл дописан, копирование закончено)
+                remaining = self._last_event + self.debounce - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                batch, mode = self._pending, "full" if self._full_sync else "files"
+                self._pending, self._full_sync = set(), False
+                return batch, mode
+
+    def _run(self):
+        while True:
+            batch, mode = self._take_batch()
+            if batch is None:
+                return
+            try:
+                if mode == "rebuild" or (mode == "full" and rebuild_required()):
+                    rebuild_index(self.folder_path)
+                elif mode == "full":
+                    load_documents_from_folder(self.folder_path)
+                else:
+                    print(f"🔄 Переиндексация файлов: {len(batch)}")
+                    sync_files(batch)
+            except Exception as e:
+                print(f"❌ Ошибка индексации: {e}")
+
+
+class DocumentEventHandler(FileSystemEventHandler):
+    """Передаёт события watchdog (создание, изменение, удаление, перемещение) в IndexWorker"""
+
+    def __init__(self, worker: IndexWorker):
+        super().__init__()
+        self.worker = worker
+
+    def _submit(self, path):
+        if not path or not is_supported_document(path):
+            return
+        # Перемещение за пределы папки документов равносильно удалению — такой путь не индексируем
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.worker.folder_path):
+            return
+        self.worker.submit(path)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._submit(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._submit(event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self._submit(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._submit(event.src_path)
+            self._submit(getattr(event, "dest_path", None))
@@ -0,0 +1,232 @@
+# rag/llm_pool.py
+import os
+import json
+import time
+import random
+import bisect
+import threading
+import requests
+import metrics
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Несколько серверов Ollama через запятую: http://llm1:11434,http://llm2:11434
+OLLAMA_HOSTS = os.getenv("OLLAMA_HOSTS", os.getenv("OLLAMA_HOST", "http://localhost:11434"))
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3:8b-instruct-q4_K_M")
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 5))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", 180))  # на всю генерацию, секунды
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", 15))
+
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "llm_request_duration_seconds", "Длительность генерации по серверам LLM", LATENCY_BUCKETS
+)
+LLM_OUTSTANDING = metrics.gauge("llm_outstanding_requests", "Активные запросы на сервере LLM")
+LLM_HEALTHY = metrics.gauge("llm_backend_healthy", "Доступность сервера LLM (1 — доступен)")
+
+
+class LLMUnavailableError(RuntimeError):
+    """Ни один сервер LLM не смог выполнить запрос"""
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными границами корзин (секунды)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # последняя — «больше максимума»
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.total += seconds
+            self.count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f"le_{b}" for b in self.buckets] + ["le_inf"]
+            return {
+                "buckets": dict(zip(labels, self.counts)),
+                "count": self.count,
+                "sum": round(self.total, 3),
+                "avg": round(self.total / self.count, 3) if self.count else 0.0,
+            }
+
+
+class OllamaBackend:
+    """Один сервер Ollama: HTTP API /api/generate, счётчик активных запросов, здоровье"""
+
+    def __init__(self, base_url: str, model: str = OLLAMA_MODEL):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.latency = LatencyHistogram()
+        self._session = requests.Session()
+
+    def check_health(self) -> bool:
+        try:
+            resp = self._session.get(f"{self.base_url}/api/tags", timeout=OLLAMA_CONNECT_TIMEOUT)
+            self.healthy = resp.ok
+        except requests.RequestException:
+            self.healthy = False
+        return self.healthy
+
+    def stream(self, prompt: str):
+        """Генерирует фрагменты ответа по мере их поступления от сервера"""
+        deadline = time.monotonic() + OLLAMA_TIMEOUT
+        with self._session.post(
+            f"{self.base_url}/api/generate",
+            json={"model": self.model, "prompt": prompt, "stream": True},
+            stream=True,
+            timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_TIMEOUT),
+        ) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{self.base_url}: генерация дольше {OLLAMA_TIMEOUT} с")
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(f"{self.base_url}: {data['error']}")
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    return
+
+    def __repr__(self):
+        return f"OllamaBackend({self.base_url})"
+
+
+class LLMPool:
+    """
+    Пул серверов LLM с балансировкой по наименьшему числу активных запросов,
+    фоновыми проверками здоровья и повтором на другом сервере при сбое.
+    Интерфейс совместим с OllamaLLM: invoke(prompt) и stream(prompt).
+    """
+
+    def __init__(self, hosts, model: str = OLLAMA_MODEL, health_interval: float = OLLAMA_HEALTH_INTERVAL):
+        self.backends = [OllamaBackend(host, model) for host in hosts]
+        if not self.backends:
+            raise ValueError("Не задан ни один сервер LLM (OLLAMA_HOSTS)")
+        self._lock = threading.Lock()
+        self._health_interval = health_interval
+        if health_interval > 0:
+            threading.Thread(target=self._health_loop, name="llm-health", daemon=True).start()
+        metrics.register_collector(self._collect_metrics)
+
+    @classmethod
+    def from_env(cls):
+        return cls([host.strip() for host in OLLAMA_HOSTS.split(",") if host.strip()])
+
+    def _health_loop(self):
+        while True:
+            time.sleep(self._health_interval)
+            for backend in self.backends:
+                was_healthy = backend.healthy
+                if backend.check_health() != was_healthy:
+                    state = "доступен" if backend.healthy else "недоступен"
+                    print(f"🩺 LLM {backend.base_url}: {state}")
+
+    def _acquire(self, exclude):
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude and b.healthy]
+            if not candidates:
+                # Все помечены нездоровыми — всё равно пробуем, проверка могла устареть
+                candidates = [b for b in self.backends if b not in exclude]
+            if not candidates:
+                return None
+            least = min(b.outstanding for b in candidates)
+            backend = random.choice([b for b in candidates if b.outstanding == least])
+            backend.outstanding += 1
+            return backend
+
+    def _release(self, backend, started, ok: bool):
+        with self._lock:
+            backend.outstanding -= 1
+            if ok:
+                backend.failures = 0
+            else:
+                backend.failures += 1
+                backend.healthy = False
+        elapsed = time.monotonic() - started
+        backend.latency.observe(elapsed)
+        LLM_REQUEST_SECONDS.observe(elapsed, backend=backend.base_url, outcome="ok" if ok else "error")
+
+    def _collect_metrics(self):
+        for backend in self.backends:
+            LLM_OUTSTANDING.set(backend.outstanding, backend=backend.base_url)
+            LLM_HEALTHY.set(int(backend.healthy), backend=backend.base_url)
+
+    def stream(self, prompt: str):
+        """
+        Потоковая генерация. Если сервер упал до первого фрагмента,
+        запрос повторяется на другом; после начала ответа повтор невозможен.
+        """
+        tried = set()
+        last_error = None
+        while True:
+            backend = self._acquire(tried)
+            if backend is None:
+                raise LLMUnavailableError(f"Все серверы LLM недоступны: {last_error}")
+            tried.add(backend)
+            started = time.monotonic()
+            produced = False
+            try:
+                for token in backend.stream(prompt):
+                    produced = True
+                    yield token
+            except GeneratorExit:
+                self._release(backend, started, ok=True)
+                raise
+            except Exception as e:
+                self._release(backend, started, ok=False)
+                print(f"⚠️ LLM {backend.base_url}: {e}")
+                if produced:
+                    raise
+                last_error = e
+                continue
+            self._release(backend, started, ok=True)
+            return
+
+    def invoke(self, prompt: str) -> str:
+        """
+        Генерация целиком. Ответ ещё никому не показан, поэтому при сбое сервера
+        даже посреди генерации частичный текст отбрасывается и запрос повторяется на другом
+        """
+        tried = set()
+        last_error = None
+        while True:
+            backend = self._acquire(tried)
+            if backend is None:
+                raise LLMUnavailableError(f"Все серверы LLM недоступны: {last_error}")
+            tried.add(backend)
+            started = time.monotonic()
+            try:
+                answer = "".join(backend.stream(prompt))
+            except Exception as e:
+                self._release(backend, started, ok=False)
+                print(f"⚠️ LLM {backend.base_url}: {e}")
+                last_error = e
+                continue
+            self._release(backend, started, ok=True)
+            return answer
+
+    def stats(self) -> dict:
+        """Состояние и гистограммы задержек по каждому серверу"""
+        return {
+            backend.base_url: {
+                "healthy": backend.healthy,
+                "outstanding": backend.outstanding,
+                "failures": backend.failures,
+                "latency_seconds": backend.latency.snapshot(),
+            }
+            for backend in self.backends
+        }
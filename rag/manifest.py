@@ -0,0 +1,74 @@
+# rag/manifest.py
+import os
+import json
+import hashlib
+from dotenv import load_dotenv
+from rag.index_versions import get_active_index_dir
+
+load_dotenv()
+
+MANIFEST_FILENAME = "manifest.json"
+# Версия формата чанков/метаданных: при её смене все файлы переиндексируются
+INDEX_FORMAT_VERSION = 8
+
+
+def file_hash(filepath: str) -> str:
+    """Считает sha256 содержимого файла блоками, не читая его целиком в память"""
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def manifest_path(index_dir: str = None) -> str:
+    """Манифест лежит внутри каталога своей версии индекса"""
+    return os.path.join(index_dir or get_active_index_dir(), MANIFEST_FILENAME)
+
+
+def load_manifest(index_dir: str = None) -> dict:
+    """
+    Загружает манифест индекса.
+    Формат: {имя_файла: {"format", "hash", "mtime", "size", "chunk_ids", "media"}}
+    """
+    path = manifest_path(index_dir)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️ Манифест повреждён, будет выполнена полная индексация: {e}")
+        return {}
+
+
+def save_manifest(manifest: dict, index_dir: str = None):
+    """Атомарно сохраняет манифест (через временный файл и os.replace)"""
+    path = manifest_path(index_dir)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def needs_reindex(filepath: str, entry: dict | None) -> tuple[bool, str | None]:
+    """
+    Проверяет, изменился ли файл с момента последней индексации.
+    Сначала сравниваются размер и mtime, хэш считается только при их расхождении.
+    :return: (нужна ли переиндексация, хэш содержимого или None, если не считался)
+    """
+    if not entry or entry.get("format") != INDEX_FORMAT_VERSION:
+        return True, None
+
+    stat = os.stat(filepath)
+    if stat.st_size == entry.get("size") and stat.st_mtime == entry.get("mtime"):
+        return False, None
+
+    content_hash = file_hash(filepath)
+    if content_hash == entry.get("hash"):
+        # Файл «тронут», но содержимое то же — обновляем только mtime
+        entry["mtime"] = stat.st_mtime
+        entry["size"] = stat.st_size
+        return False, content_hash
+    return True, content_hash
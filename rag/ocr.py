@@ -0,0 +1,130 @@
+# rag/ocr.py
+import os
+import shlex
+import hashlib
+import sqlite3
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import pytesseract
+from metrics import timed, counter
+from rag.sqlite_utils import select_in, touch_and_prune
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OCR_LANG = os.getenv("OCR_LANG", "eng+rus")
+OCR_CONFIG = os.getenv("OCR_CONFIG", "")  # дополнительные параметры tesseract
+# Кэш результатов OCR живёт отдельно от индекса, чтобы переживать его перестройку
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", "ocr_cache.sqlite3")
+# Через сколько дней без обращений запись кэша OCR удаляется (0 — хранить бессрочно)
+OCR_CACHE_MAX_AGE_DAYS = float(os.getenv("OCR_CACHE_MAX_AGE_DAYS", 90))
+# Сколько процессов tesseract запускать параллельно (1 — последовательно)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+# Потоки OpenMP внутри каждого tesseract: при параллельном OCR по одному на процесс,
+# иначе OCR_WORKERS процессов с собственными пулами потоков перегружают ядра
+OCR_THREADS = os.getenv("OCR_THREADS", "1" if OCR_WORKERS > 1 else "")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+OCR_IMAGES = counter("rag_ocr_images_total", "Изображения, прошедшие через OCR, по результату кэша")
+
+
+def _tesseract_env() -> dict:
+    env = dict(os.environ)
+    if OCR_THREADS:
+        env["OMP_THREAD_LIMIT"] = OCR_THREADS
+    return env
+
+
+def ocr_image_file(img_path: str) -> str | None:
+    """
+    Распознаёт текст на одном изображении отдельным процессом tesseract.
+    Файл передаётся tesseract напрямую, без перекодирования через PIL.
+    :return: Текст или None при ошибке (такие результаты не кэшируются)
+    """
+    command = [pytesseract.pytesseract.tesseract_cmd, img_path, "stdout", "-l", OCR_LANG, *shlex.split(OCR_CONFIG)]
+    try:
+        result = subprocess.run(command, capture_output=True, env=_tesseract_env())
+    except OSError as e:
+        print(f"OCR ошибка ({img_path}): {e}")
+        return None
+    if result.returncode != 0:
+        print(f"OCR ошибка ({img_path}): {result.stderr.decode('utf-8', 'replace').strip()}")
+        return None
+    return result.stdout.decode("utf-8", "replace").strip()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Работа идёт в процессах tesseract, поэтому хватает потоков:
+    # fork процесса с работающими uvicorn, ботом и torch мог бы зависнуть
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+    return _executor
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(OCR_CACHE_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS ocr_cache ("
+        "key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL DEFAULT (julianday('now')))"
+    )
+    return conn
+
+
+def _cache_key(img_path: str) -> str | None:
+    """Ключ кэша: хэш байтов изображения + язык и параметры OCR"""
+    try:
+        with open(img_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+    return f"{digest}:{OCR_LANG}:{OCR_CONFIG}"
+
+
+def _run_ocr(img_paths: list[str]) -> list[str]:
+    if OCR_WORKERS <= 1 or len(img_paths) == 1:
+        return [ocr_image_file(path) for path in img_paths]
+
+    return list(_get_executor().map(ocr_image_file, img_paths))
+
+
+def ocr_images(img_paths: list[str]) -> list[str]:
+    """
+    Распознаёт пачку изображений: уже прочитанные берутся из кэша,
+    остальные распознаются параллельно (до OCR_WORKERS процессов tesseract)
+    :return: Тексты в том же порядке, что и img_paths
+    """
+    if not img_paths:
+        return []
+
+    keys = [_cache_key(path) for path in img_paths]
+    conn = _connect()
+    try:
+        cached = dict(select_in(
+            conn, "SELECT key, text FROM ocr_cache WHERE key IN ({marks})", {key for key in keys if key}
+        ))
+
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        with timed("ocr"):
+            texts = _run_ocr([img_paths[i] for i in missing])
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ocr_cache (key, text) VALUES (?, ?)",
+                [(keys[i], text) for i, text in zip(missing, texts) if keys[i] and text is not None],
+            )
+        touch_and_prune(conn, "ocr_cache", cached, OCR_CACHE_MAX_AGE_DAYS)
+    finally:
+        conn.close()
+
+    results = [cached.get(key, "") for key in keys]
+    for i, text in zip(missing, texts):
+        results[i] = text or ""
+
+    OCR_IMAGES.inc(len(img_paths) - len(missing), cache="hit")
+    OCR_IMAGES.inc(len(missing), cache="miss")
+    return results
@@ -0,0 +1,261 @@
+# rag/pool.py
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+# Сколько запросов к RAG выполняется одновременно и сколько может ждать в очереди
+RAG_MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", 4))
+RAG_MAX_QUEUE = int(os.getenv("RAG_MAX_QUEUE", 32))
+# Лимит запросов к LLM на пользователя (token bucket): сколько подряд и сколько в минуту в среднем; 0 — без лимита
+RAG_USER_BURST = int(os.getenv("RAG_USER_BURST", 5))
+RAG_USER_RATE_PER_MINUTE = float(os.getenv("RAG_USER_RATE_PER_MINUTE", 6))
+
+SCHEDULED = metrics.counter("rag_scheduler_requests_total", "Запросы к пулу RAG по исходу постановки в очередь")
+QUEUE_DEPTH = metrics.gauge("rag_queue_depth", "Запросы к RAG, ожидающие свободного воркера")
+QUEUE_USERS = metrics.gauge("rag_queue_users", "Пользователи с запросами в очереди RAG")
+RUNNING = metrics.gauge("rag_running_requests", "Запросы к RAG, выполняющиеся сейчас")
+
+
+class RagOverloadedError(RuntimeError):
+    """Очередь запросов к RAG переполнена"""
+
+
+class RagRateLimitedError(RagOverloadedError):
+    """Пользователь исчерпал свой лимит запросов"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RagSupersededError(RuntimeError):
+    """Запрос снят из очереди: тот же пользователь задал новый вопрос"""
+
+
+class TokenBucket:
+    """
+    Лимит запросов к LLM на пользователя: до burst запросов подряд,
+    дальше — rate_per_minute в среднем. Токен проверяется при постановке в очередь,
+    а списывается, только когда запрос действительно дошёл до LLM (не из кэша
+    и не быстрым путём). Вёдра полностью пополнившихся пользователей удаляются,
+    поэтому память не растёт с числом пользователей.
+    """
+
+    def __init__(self, burst: int = RAG_USER_BURST, rate_per_minute: float = RAG_USER_RATE_PER_MINUTE):
+        self.burst = burst
+        self.rate = rate_per_minute / 60
+        self._buckets = {}  # user -> (токены, время обновления)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.burst > 0 and self.rate > 0
+
+    def _refill(self, user, now) -> float:
+        tokens, updated = self._buckets.get(user, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, user) -> float:
+        """:return: 0, если у пользователя есть токен, иначе через сколько секунд он появится"""
+        if not self.enabled or user is None:
+            return 0.0
+        with self._lock:
+            tokens = self._refill(user, time.monotonic())
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, user):
+        """Списывает токен; у параллельных запросов, прошедших проверку, баланс может уйти в минус"""
+        if not self.enabled or user is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._buckets[user] = (self._refill(user, now) - 1, now)
+            if len(self._buckets) > 1000:
+                self._buckets = {
+                    key: value for key, value in self._buckets.items() if self._refill(key, now) < self.burst
+                }
+
+
+class _Job:
+    __slots__ = ("user", "call", "future", "supersede", "queued_at")
+
+    def __init__(self, user, call, supersede: bool):
+        self.user = user
+        self.call = call
+        self.future = Future()
+        self.supersede = supersede
+        self.queued_at = time.perf_counter()
+
+
+class RagWorkerPool:
+    """
+    Ограниченный пул потоков для блокирующих вызовов RAG (эмбеддинг, Chroma, LLM).
+    Ожидающие запросы раздаются воркерам по кругу между пользователями,
+    поэтому серия вопросов одного пользователя не задерживает остальных.
+    Общий для Telegram-бота и FastAPI, поэтому очередь защищена threading.Lock,
+    а не asyncio-примитивами (у бота и uvicorn разные event loop).
+    """
+
+    def __init__(self, max_workers: int = RAG_MAX_CONCURRENCY, max_queue: int = RAG_MAX_QUEUE,
+                 limiter: TokenBucket = None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.limiter = limiter if limiter is not None else TokenBucket()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag")
+        self._lock = threading.Lock()
+        self._queues = {}  # user -> deque[_Job], только ожидающие
+        self._rotation = deque()  # пользователи с ожидающими запросами в порядке обслуживания
+        self._queued = 0
+        self._running = 0
+        metrics.register_collector(self._collect_metrics)
+
+    @property
+    def pending(self) -> int:
+        """Число запросов в работе и в очереди"""
+        return self._queued + self._running
+
+    def _collect_metrics(self):
+        QUEUE_DEPTH.set(self._queued)
+        QUEUE_USERS.set(len(self._rotation))
+        RUNNING.set(self._running)
+
+    def _remove_queued(self, job: _Job):
+        """Убирает ожидающий запрос из очереди пользователя; вызывать под self._lock"""
+        queue = self._queues[job.user]
+        queue.remove(job)
+        self._queued -= 1
+        if not queue:
+            del self._queues[job.user]
+            self._rotation.remove(job.user)
+
+    def _next_job(self):
+        """Следующий запрос по кругу между пользователями; вызывать под self._lock"""
+        while self._rotation:
+            user = self._rotation.popleft()
+            queue = self._queues[user]
+            job = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._rotation.append(user)
+            else:
+                del self._queues[user]
+            # Отменённые ожидающим (таймаут API, ушедший клиент) пропускаем
+            if job.future.set_running_or_notify_cancel():
+                return job
+        return None
+
+    def _dispatch(self):
+        jobs = []
+        with self._lock:
+            while self._running < self.max_workers:
+                job = self._next_job()
+                if job is None:
+                    break
+                self._running += 1
+                jobs.append(job)
+        for job in jobs:
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - job.queued_at, stage="queue_wait")
+            self._executor.submit(self._run, job)
+
+    def _run(self, job: _Job):
+        try:
+            job.future.set_result(job.call())
+        except BaseException as e:
+            job.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._dispatch()
+
+    def submit(self, func, *args, user=None, limited: bool = False, supersede: bool = False, **kwargs):
+        """
+        Ставит вызов в очередь пользователя
+        :param user: ключ пользователя для справедливой очереди (None — общая очередь)
+        :param limited: проверить лимит пользователя (токен списывает сам вызов через self.limiter.consume)
+        :param supersede: снять ещё не начатые запросы этого пользователя с тем же флагом
+        :return: concurrent.futures.Future; снятые запросы завершаются RagSupersededError
+        :raises RagRateLimitedError: если пользователь превысил лимит
+        :raises RagOverloadedError: если очередь заполнена
+        """
+        job = _Job(user, partial(func, *args, **kwargs), supersede)
+        superseded = []
+        with self._lock:
+            retry_after = self.limiter.retry_after(user) if limited else 0.0
+            if not retry_after and supersede:
+                superseded = [queued for queued in self._queues.get(user, ()) if queued.supersede]
+                for queued in superseded:
+                    self._remove_queued(queued)
+            if retry_after:
+                outcome = "rate_limited"
+            elif self._queued + self._running >= self.max_workers + self.max_queue:
+                outcome = "overloaded"
+            else:
+                outcome = "accepted"
+                if user not in self._queues:
+                    self._queues[user] = deque()
+                    self._rotation.append(user)
+                self._queues[user].append(job)
+                self._queued += 1
+
+        for queued in superseded:
+            if queued.future.set_running_or_notify_cancel():
+                queued.future.set_exception(RagSupersededError("Запрос заменён новым вопросом"))
+        if superseded:
+            SCHEDULED.inc(len(superseded), outcome="superseded")
+        SCHEDULED.inc(outcome=outcome)
+
+        if outcome == "rate_limited":
+            raise RagRateLimitedError("Слишком много вопросов подряд, попробуйте позже", retry_after)
+        if outcome == "overloaded":
+            raise RagOverloadedError("Слишком много запросов, попробуйте позже")
+        self._dispatch()
+        return job.future
+
+    def queue_position(self, future) -> int:
+        """
+        Сколько запросов будет обслужено раньше этого (1 — следующий), 0 — уже выполняется или завершён.
+        Оценка по текущей очереди: круговой обход отдаёт каждому пользователю по одному запросу за круг.
+        """
+        with self._lock:
+            for user, queue in self._queues.items():
+                for index, job in enumerate(queue):
+                    if job.future is future:
+                        break
+                else:
+                    continue
+                # Пользователи раньше в круге получат на один запрос больше, чем успеют позже
+                order = list(self._rotation)
+                mine = order.index(user)
+                ahead = index
+                for i, other in enumerate(order):
+                    if other != user:
+                        ahead += min(len(self._queues[other]), index + 1 if i < mine else index)
+                return ahead + 1
+        return 0
+
+    async def run(self, func, *args, user=None, limited: bool = False, supersede: bool = False, **kwargs):
+        """Выполняет блокирующую функцию в пуле, не блокируя event loop"""
+        return await asyncio.wrap_future(
+            self.submit(func, *args, user=user, limited=limited, supersede=supersede, **kwargs)
+        )
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> RagWorkerPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = RagWorkerPool()
+    return _pool
@@ -1,32 +1,164 @@
 # rag/rag_engine.py
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_ollama import OllamaLLM
 from dotenv import load_dotenv
+from rag.pool import get_pool
+from rag.llm_pool import LLMPool
+from rag.batching import QueryEmbeddingBatcher
+from rag.embedding_cache import CachedEmbeddings, EMBEDDING_CACHE
+from rag.context import build_context, clean_chunk, count_tokens
+from rag import answer_cache, image_index, bm25
+from rag.index_versions import get_active_index_dir, INDEX_GC_DELAY
+from rag.startup import startup_phase
+from metrics import timed, counter, STAGE_SECONDS
 import os
-import json
 import re
+import asyncio
+import threading
+import time
+from functools import partial
 
 load_dotenv()
 
-CHROMA_DIR = os.getenv("CHROMA_DIR", "chroma_db")
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Сколько чанков кодируется за один вызов sentence-transformers
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 128))
+# vector — только векторный поиск, hybrid — векторный + BM25 с reciprocal rank fusion
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))  # кандидатов из каждого списка
+RRF_K = int(os.getenv("RRF_K", 60))
+# Если расстояние (в метрике Chroma, меньше — ближе) от вопроса до лучшего чанка
+# не больше порога, чанк возвращается как ответ без обращения к LLM (0 — выключено)
+FAST_PATH_MAX_DISTANCE = float(os.getenv("FAST_PATH_MAX_DISTANCE", 0))
 
-# Инициализация
-embedding = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-llm = OllamaLLM(model="llama3:8b-instruct-q4_K_M")
+# Прогреть модель и индекс в фоне сразу после запуска, не дожидаясь первого вопроса
+RAG_WARMUP = os.getenv("RAG_WARMUP", "true").lower() in ("1", "true", "yes")
+# Как часто сообщать ожидающему потоковому запросу его место в очереди, секунды
+QUEUE_POSITION_INTERVAL = float(os.getenv("QUEUE_POSITION_INTERVAL", 2))
 
-vectorstore = None
+QUERIES = counter("rag_queries_total", "Запросы к RAG по типу и способу получения ответа")
 
+# Тяжёлые объекты создаются при первом обращении, а не при импорте модуля
+_embedding = None
+_llm = None
+_query_batcher = None
+_init_lock = threading.RLock()
 
-def get_vectorstore():
-    global vectorstore
-    if vectorstore is None:
-        vectorstore = Chroma(
-            persist_directory=CHROMA_DIR,
-            embedding_function=embedding
-        )
-    return vectorstore
+# Хранилище активной версии: (каталог, Chroma), подменяется целиком одним присваиванием
+_active_store = None
+_vectorstore_lock = threading.Lock()
+# Хранилище перестраиваемой (ещё не активной) версии: (каталог, Chroma)
+_build_vectorstore = None
+
+
+def get_embedding() -> CachedEmbeddings:
+    """Модель эмбеддингов с кэшем (загружается при первом вызове)"""
+    global _embedding
+    if _embedding is None:
+        with _init_lock:
+            if _embedding is None:
+                with startup_phase("Модель эмбеддингов"):
+                    from langchain_huggingface import HuggingFaceEmbeddings
+
+                    _embedding = CachedEmbeddings(
+                        HuggingFaceEmbeddings(
+                            model_name=EMBEDDING_MODEL,
+                            encode_kwargs={"batch_size": EMBED_BATCH_SIZE}
+                        ),
+                        EMBEDDING_MODEL,
+                    )
+    return _embedding
+
+
+def get_llm() -> LLMPool:
+    """Пул серверов Ollama (OLLAMA_HOSTS) с балансировкой и переключением при сбое"""
+    global _llm
+    if _llm is None:
+        with _init_lock:
+            if _llm is None:
+                _llm = LLMPool.from_env()
+    return _llm
+
+
+def _get_query_batcher() -> QueryEmbeddingBatcher:
+    global _query_batcher
+    if _query_batcher is None:
+        with _init_lock:
+            if _query_batcher is None:
+                _query_batcher = QueryEmbeddingBatcher(get_embedding().embed_queries)
+    return _query_batcher
+
+
+def _open_vectorstore(index_dir: str):
+    """Хранилище версии индекса на собственном клиенте chromadb, чтобы его можно было закрыть"""
+    import chromadb
+    from langchain_chroma import Chroma
+
+    client = chromadb.PersistentClient(path=index_dir)
+    return Chroma(client=client, embedding_function=get_embedding())
+
+
+def _close_vectorstore(store):
+    """
+    Закрывает клиент chromadb хранилища, иначе он держит открытыми
+    SQLite и сегменты HNSW уже ненужной версии
+    """
+    try:
+        store._client.close()
+    except Exception as e:
+        print(f"⚠️ Не удалось закрыть векторное хранилище: {e}")
+
+
+def _close_later(store):
+    # Запросы, начатые до переключения, ещё могут читать старое хранилище
+    timer = threading.Timer(INDEX_GC_DELAY, _close_vectorstore, args=(store,))
+    timer.daemon = True
+    timer.start()
+
+
+def get_active_vectorstore():
+    """
+    Активная версия индекса и её векторное хранилище — согласованной парой.
+    После переключения версии следующий вызов атомарно подменяет хранилище;
+    запросы, взявшие пару раньше, дорабатывают со старым, затем оно закрывается.
+    :return: (каталог версии, Chroma)
+    """
+    global _active_store, _build_vectorstore
+    active = get_active_index_dir()
+    current = _active_store
+    if current is not None and current[0] == active:
+        return current
+    with _vectorstore_lock:
+        if _active_store is None or _active_store[0] != active:
+            previous = _active_store
+            if _build_vectorstore is not None and _build_vectorstore[0] == active:
+                # Перестроенная версия стала активной — её хранилище уже открыто
+                _active_store, _build_vectorstore = _build_vectorstore, None
+            else:
+                with startup_phase(f"Векторное хранилище {active}"):
+                    _active_store = (active, _open_vectorstore(active))
+            if previous is not None:
+                _close_later(previous[1])
+        return _active_store
+
+
+def get_vectorstore(index_dir: str = None):
+    """
+    Векторное хранилище активной версии индекса
+    (или указанного каталога — для перестройки индекса «в сторонке»)
+    """
+    global _build_vectorstore
+    if index_dir is None or index_dir == get_active_index_dir():
+        return get_active_vectorstore()[1]
+
+    with _vectorstore_lock:
+        current = _active_store
+        if current is not None and current[0] == index_dir:
+            # Только что сменённая версия: её хранилище ещё открыто и закроется по таймеру
+            return current[1]
+        if _build_vectorstore is None or _build_vectorstore[0] != index_dir:
+            if _build_vectorstore is not None:
+                _close_vectorstore(_build_vectorstore[1])
+            _build_vectorstore = (index_dir, _open_vectorstore(index_dir))
+        return _build_vectorstore[1]
 
 
 def add_document(doc_id: str, text: str, metadata: dict):
@@ -36,8 +168,55 @@ def add_document(doc_id: str, text: str, metadata: dict):
     :param text: Текст документа
     :param metadata: Метаданные (источник, изображения и т.д.)
     """
-    vs = get_vectorstore()
-    vs.add_texts([text], metadatas=[metadata], ids=[doc_id])
+    add_documents([doc_id], [text], [metadata])
+
+
+def add_documents(doc_ids: list[str], texts: list[str], metadatas: list[dict],
+                  batch_size=EMBED_BATCH_SIZE, index_dir: str = None):
+    """
+    Массово добавляет чанки: эмбеддинги считаются батчами,
+    запись в Chroma — upsert'ами максимального размера, который принимает клиент
+    :param doc_ids: Уникальные ID чанков
+    :param texts: Тексты чанков
+    :param metadatas: Метаданные чанков
+    :param batch_size: Размер батча для модели эмбеддингов
+    :param index_dir: Каталог версии индекса (по умолчанию — активная)
+    """
+    if not doc_ids:
+        return
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(get_embedding().embed_documents(texts[start:start + batch_size]))
+
+    vs = get_vectorstore(index_dir)
+    # Chroma отклоняет upsert больше max_batch_size (ограничение SQLite на число параметров)
+    max_batch = vs._client.get_max_batch_size()
+    for start in range(0, len(doc_ids), max_batch):
+        end = start + max_batch
+        vs._collection.upsert(
+            ids=doc_ids[start:end], embeddings=vectors[start:end],
+            metadatas=metadatas[start:end], documents=texts[start:end],
+        )
+
+
+def count_documents(index_dir: str = None) -> int:
+    """Число чанков в версии индекса (по умолчанию — активной); несозданный индекс не открывается"""
+    index_dir = index_dir or get_active_index_dir()
+    if not os.path.exists(os.path.join(index_dir, "chroma.sqlite3")):
+        return 0
+    return get_vectorstore(index_dir)._collection.count()
+
+
+def delete_documents(doc_ids: list[str], index_dir: str = None):
+    """
+    Удаляет чанки из векторного хранилища
+    :param doc_ids: Список ID чанков
+    :param index_dir: Каталог версии индекса (по умолчанию — активная)
+    """
+    if not doc_ids:
+        return
+    vs = get_vectorstore(index_dir)
+    vs.delete(ids=list(doc_ids))
 
 
 def extract_link_from_text(text):
@@ -48,111 +227,437 @@ def extract_link_from_text(text):
     return urls[-1] if urls else ""
 
 
-def query_rag(question: str, top_k=3):
+FALLBACK_ANSWER = "Извините, не удалось сформировать ответ. Попробуйте переформулировать вопрос."
+INTERRUPTED_NOTICE = "⚠️ Ответ прерван из-за сбоя генерации, он может быть неполным. Повторите вопрос."
+
+
+def embed_question(question: str):
     """
-    Выполняет RAG-поиск и возвращает ответ с изображениями
+    Эмбеддинг вопроса: повторный вопрос берётся из памяти,
+    одновременные новые кодируются одним батчем
+    """
+    cached = get_embedding().cached_query(question)
+    EMBEDDING_CACHE.inc(kind="query", result="miss" if cached is None else "hit")
+    if cached is not None:
+        return cached
+    with timed("embed_question"):
+        return _get_query_batcher().embed(question)
+
+
+def _vector_search(question_vector, k, vs):
+    with timed("vector_search"):
+        res = vs._collection.query(
+            query_embeddings=[question_vector],
+            n_results=k,
+            include=["documents", "metadatas", "distances"],
+        )
+    return [
+        {"id": chunk_id, "text": text, "metadata": metadata or {}, "distance": distance}
+        for chunk_id, text, metadata, distance in zip(
+            res["ids"][0], res["documents"][0], res["metadatas"][0], res["distances"][0]
+        )
+    ]
+
+
+def search_chunks(question: str, top_k=3, question_vector=None, index_dir: str = None, vs=None):
+    """
+    Поиск чанков: векторный или гибридный (векторный + BM25, объединение через RRF)
+    :param vs: Хранилище версии index_dir, взятое запросом заранее (get_active_vectorstore)
+    :return: Список словарей id, text, metadata, distance (None — найден только BM25)
     """
-    vs = get_vectorstore()
-    results = vs.similarity_search_with_score(question, k=top_k)
+    if question_vector is None:
+        question_vector = embed_question(question)
+    if vs is None:
+        vs = get_vectorstore(index_dir)
 
-    context_parts = []
-    all_images = []
-    source_files = set()
+    if RETRIEVAL_MODE != "hybrid":
+        return _vector_search(question_vector, top_k, vs)
+
+    vector_hits = _vector_search(question_vector, max(top_k, HYBRID_CANDIDATES), vs)
+    with timed("bm25_search"):
+        keyword_hits = bm25.search(question, max(top_k, HYBRID_CANDIDATES), index_dir)
+
+    # Reciprocal rank fusion: score = Σ 1 / (RRF_K + ранг) по обоим спискам
+    fused = {}
+    for rank, hit in enumerate(vector_hits):
+        fused[hit["id"]] = fused.get(hit["id"], 0.0) + 1.0 / (RRF_K + rank + 1)
+    for rank, (chunk_id, _) in enumerate(keyword_hits):
+        fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    best_ids = sorted(fused, key=fused.get, reverse=True)[:top_k]
+
+    by_id = {hit["id"]: hit for hit in vector_hits}
+    missing = [chunk_id for chunk_id in best_ids if chunk_id not in by_id]
+    if missing:
+        res = vs._collection.get(ids=missing, include=["documents", "metadatas"])
+        for chunk_id, text, metadata in zip(res["ids"], res["documents"], res["metadatas"]):
+            by_id[chunk_id] = {"id": chunk_id, "text": text, "metadata": metadata or {}, "distance": None}
+    return [by_id[chunk_id] for chunk_id in best_ids if chunk_id in by_id]
+
+
+def retrieve_context(question: str, top_k=3, question_vector=None):
+    """
+    Поиск релевантных фрагментов инструкций
+    :param question_vector: Готовый эмбеддинг вопроса, если уже посчитан
+    :return: Словарь с текстом контекста, изображениями, источником и ссылкой
+    """
+    # Каталог и хранилище берутся одной парой: переключение версии посреди запроса его не затронет
+    index_dir, vs = get_active_vectorstore()
+    hits = search_chunks(question, top_k, question_vector, index_dir, vs)
+
+    chunk_refs = []
     links = []
-    best_result = None
-    best_score = float('inf')
-
-    for res, score in results:
-        context_parts.append(res.page_content)
-        if res.metadata.get("images"):
-            try:
-                imgs = json.loads(res.metadata["images"])
-                all_images.extend(imgs)
-            except Exception as e:
-                print(f"Ошибка парсинга images: {e}")
-                
-        # Сохраняем источник документа
-        source = res.metadata.get("source")
-        if source:
-            source_files.add(source)
-            
+
+    for hit in hits:
+        # Изображения хранятся в отдельной таблице; берём только те,
+        # что находятся на страницах найденного фрагмента
+        chunk_refs.append((
+            hit["metadata"].get("source"),
+            hit["metadata"].get("page_start"),
+            hit["metadata"].get("page_end"),
+        ))
+
         # Извлекаем ссылки из текста
-        link = extract_link_from_text(res.page_content)
+        link = extract_link_from_text(hit["text"])
         if link:
             links.append(link)
-            
-        # Находим наиболее релевантный результат
-        if score < best_score:
-            best_score = score
-            best_result = res
-
-    # Уникальные изображения
-    seen = set()
-    unique_images = []
-    for img in all_images:
-        path = img.get("img_path")
-        if path and path not in seen:
-            seen.add(path)
-            unique_images.append(img)
-
-    # Сортировка по странице и порядку
-    sorted_images = sorted(unique_images, key=lambda x: (x.get("page_num", 999), x.get("order", 0)))
-
-    # Формируем промпт с более подробной инструкцией
-    context_text = "\n\n---\n\n".join(context_parts)
-    
-    prompt = f"""
-Ты — помощник по корпоративной документации. Твоя задача — дать полный и понятный ответ на вопрос сотрудника, 
-основываясь на предоставленных инструкциях.
-
-Вопрос сотрудника: {question}
+
+    # Наиболее релевантный результат — первый после ранжирования
+    best_result = hits[0] if hits else None
+
+    # Изображения уникальны по пути и упорядочены по рангу фрагмента, затем по странице
+    with timed("image_lookup"):
+        sorted_images = image_index.get_chunk_images(chunk_refs, index_dir)
+
+    # Контекст без перекрытий и OCR-мусора, в пределах бюджета токенов
+    with timed("context_build"):
+        context_text, context_tokens, used_chunks = build_context(
+            [hit["text"] for hit in hits],
+            [hit["metadata"].get("source") for hit in hits],
+        )
+
+    return {
+        "hits": hits,
+        "index_dir": index_dir,
+        "context_text": context_text,
+        "context_tokens": context_tokens,
+        "used_chunks": used_chunks,
+        "images": sorted_images[:3],
+        "source": best_result["metadata"].get("source", "") if best_result else "",
+        "link_to_document": links[0] if links else "",
+    }
+
+
+def build_prompt(question: str, context: dict) -> str:
+    """
+    Компактный промпт с ответом в виде обычного текста: его можно показывать
+    пользователю по мере генерации. Источник, ссылку и скриншоты добавляет код, а не модель.
+    На CPU время разбора промпта сопоставимо с генерацией, поэтому инструкция короткая.
+    """
+    prompt = f"""Ты — помощник по корпоративной документации. Ответь на вопрос сотрудника по инструкциям ниже.
+Объясни по шагам (нумерованным списком, если шагов несколько). Пиши только текст ответа:
+без JSON, источников, ссылок и путей к скриншотам. Если ответа в инструкциях нет, так и скажи.
 
 Инструкции:
-{context_text}
-
-Требования к ответу:
-1. Дай развернутый ответ, объясни по шагам, что нужно сделать
-2. Если в инструкции есть список шагов, перечисли их
-3. Если есть изображения, укажи: "Вот скриншоты из инструкции:"
-4. Всегда указывай источник документа
-5. Если в конце документа есть ссылка на полную инструкцию, добавь её в ответ как "Подробнее: [ссылка]"
-6. Формат ответа: JSON с полями "answer", "images", "source", "link_to_document"
-
-Пример:
-{{
-  "answer": "Для решения проблемы выполните следующие шаги:\\n1. Откройте приложение...\\n2. Перейдите в настройки...\\n3. Отключите энергосберегающий режим",
-  "images": [
-    {{"img_path": "media/manual_page5_0.jpg", "caption": "Настройки приложения"}}
-  ],
-  "source": "Установка Ростелеком ВАТС.docx",
-  "link_to_document": "https://fotonmotor.bitrix24.ru/~Qo10p"
-}}
-"""
+{context["context_text"]}
+
+Вопрос: {question}
+Ответ:"""
+    print(
+        f"🧮 Промпт: {count_tokens(prompt)} токенов "
+        f"(контекст {context['context_tokens']}, фрагментов {context['used_chunks']} из {len(context['hits'])})"
+    )
+    return prompt
+
+
+def _make_result(answer: str, context: dict) -> dict:
+    return {
+        "answer": answer,
+        "images": context["images"],
+        "source": context["source"],
+        "link_to_document": context["link_to_document"],
+    }
+
+
+def chunk_display_text(text: str) -> str:
+    """
+    Текст чанка для показа пользователю: без служебных меток страниц и OCR-блоков.
+    Чанк целиком из текста скриншотов показывается очищенным OCR, а не пустым ответом.
+    """
+    return clean_chunk(text, keep_ocr=False) or clean_chunk(text)
+
+
+def hit_to_result(hit: dict, index_dir: str = None) -> dict:
+    """Ответ из одного найденного чанка без генерации: текст, источник, ссылка и его скриншоты"""
+    metadata = hit["metadata"]
+    images = image_index.get_chunk_images(
+        [(metadata.get("source"), metadata.get("page_start"), metadata.get("page_end"))], index_dir
+    )
+    return {
+        "answer": chunk_display_text(hit["text"]),
+        "images": images[:3],
+        "source": metadata.get("source", ""),
+        "link_to_document": extract_link_from_text(hit["text"]),
+        "distance": hit["distance"],
+    }
+
+
+def _fast_path_hit(context: dict):
+    """Чанк, достаточно близкий к вопросу, чтобы ответить им без LLM"""
+    if FAST_PATH_MAX_DISTANCE <= 0:
+        return None
+    scored = [hit for hit in context["hits"] if hit["distance"] is not None]
+    if not scored:
+        return None
+    best = min(scored, key=lambda hit: hit["distance"])
+    return best if best["distance"] <= FAST_PATH_MAX_DISTANCE else None
+
+
+def search_rag(question: str, top_k=3):
+    """
+    Поиск без генерации: найденные фрагменты инструкций со скриншотами
+    :return: Список результатов в формате query_rag (answer — текст фрагмента) + distance
+    """
+    QUERIES.inc(kind="search", outcome="retrieval")
+    index_dir, vs = get_active_vectorstore()
+    with timed("search_total"):
+        return [hit_to_result(hit, index_dir) for hit in search_chunks(question, top_k, index_dir=index_dir, vs=vs)]
+
+
+def _cache_vector(question: str):
+    """Эмбеддинг вопроса нужен кэшу только в семантическом режиме"""
+    if answer_cache.ANSWER_CACHE_ENABLED and answer_cache.ANSWER_CACHE_SIMILARITY > 0:
+        return embed_question(question)
+    return None
+
+
+def lookup_answer(question: str, kind: str = "query"):
+    """
+    Готовый ответ из кэша. Асинхронные обёртки вызывают поиск до постановки
+    запроса в пул воркеров: попадание не ждёт генераций и не списывает лимит
+    :return: (ответ или None, версия индекса для answer_cache.put, эмбеддинг вопроса или None)
+    """
+    question_vector = _cache_vector(question)
+    with timed("answer_cache_get"):
+        cached, cache_version = answer_cache.get(question, question_vector)
+    if cached is not None:
+        QUERIES.inc(kind=kind, outcome="cache")
+    return cached, cache_version, question_vector
+
+
+def _generation_outcome(answer: str, failed: bool) -> str:
+    if failed:
+        return "error"
+    return "llm" if answer != FALLBACK_ANSWER else "fallback"
+
+
+def query_rag(question: str, top_k=3, before_llm=None, lookup=None):
+    """
+    Выполняет RAG-поиск и возвращает ответ с изображениями
+    :param before_llm: вызывается перед обращением к LLM (списание лимита пользователя)
+    :param lookup: результат lookup_answer, если кэш уже проверен (промах)
+    """
+    with timed("query_total"):
+        cached, cache_version, question_vector = lookup or lookup_answer(question)
+        if cached is not None:
+            return cached
+
+        context = retrieve_context(question, top_k, question_vector)
+        fast_hit = _fast_path_hit(context)
+        if fast_hit is not None:
+            QUERIES.inc(kind="query", outcome="fast_path")
+            result = hit_to_result(fast_hit, context["index_dir"])
+            result.pop("distance")
+            return result
+
+        with timed("prompt_build"):
+            prompt = build_prompt(question, context)
+
+        if before_llm is not None:
+            before_llm()
+        failed = False
+        try:
+            with timed("llm_generate"):
+                answer = get_llm().invoke(prompt).strip() or FALLBACK_ANSWER
+        except Exception as e:
+            print(f"Ошибка генерации: {e}")
+            answer = FALLBACK_ANSWER
+            failed = True
 
+        QUERIES.inc(kind="query", outcome=_generation_outcome(answer, failed))
+        result = _make_result(answer, context)
+        if answer != FALLBACK_ANSWER:
+            with timed("answer_cache_put"):
+                answer_cache.put(question, result, cache_version, question_vector)
+        return result
+
+
+def stream_rag(question: str, top_k=3, cancel_event=None, before_llm=None, lookup=None):
+    """
+    Потоковый вариант query_rag.
+    Генерирует события ("token", str) по мере ответа модели
+    и в конце ("result", dict) в формате query_rag.
+    :param cancel_event: threading.Event для досрочной остановки генерации
+    :param before_llm: вызывается перед обращением к LLM (списание лимита пользователя)
+    :param lookup: результат lookup_answer, если кэш уже проверен (промах)
+    """
+    cached, cache_version, question_vector = lookup or lookup_answer(question, "stream")
+    if cached is not None:
+        yield "token", cached.get("answer", "")
+        yield "result", cached
+        return
+
+    context = retrieve_context(question, top_k, question_vector)
+    fast_hit = _fast_path_hit(context)
+    if fast_hit is not None:
+        QUERIES.inc(kind="stream", outcome="fast_path")
+        result = hit_to_result(fast_hit, context["index_dir"])
+        result.pop("distance")
+        yield "token", result["answer"]
+        yield "result", result
+        return
+
+    with timed("prompt_build"):
+        prompt = build_prompt(question, context)
+
+    if before_llm is not None:
+        before_llm()
+    parts = []
+    failed = False
+    started = time.perf_counter()
     try:
-        response = llm.invoke(prompt)
-        match = re.search(r'\{.*\}', response, re.DOTALL)
-        if match:
-            data = json.loads(match.group())
-            # Ограничиваем количество изображений до 3
-            data["images"] = data.get("images", [])[:3]
-            # Если в ответе нет ссылки, используем найденную в документе
-            if not data.get("link_to_document") and links:
-                data["link_to_document"] = links[0]
-            return data
-        else:
-            # Если не удалось распарсить JSON, возвращаем текст как есть
-            return {
-                "answer": response[:1000], 
-                "images": sorted_images[:3] if sorted_images else [], 
-                "source": best_result.metadata.get("source", "") if best_result else "",
-                "link_to_document": links[0] if links else ""
-            }
+        for token in get_llm().stream(prompt):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if not parts:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm_first_token")
+            parts.append(token)
+            yield "token", token
     except Exception as e:
+        # Сервер LLM упал посреди ответа: показанный текст уже не отозвать, повтор невозможен
         print(f"Ошибка генерации: {e}")
-        return {
-            "answer": "Извините, не удалось сформировать ответ. Попробуйте переформулировать вопрос.", 
-            "images": sorted_images[:3] if sorted_images else [], 
-            "source": best_result.metadata.get("source", "") if best_result else "",
-            "link_to_document": links[0] if links else ""
-        }
\ No newline at end of file
+        failed = True
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm_stream")
+
+    answer = "".join(parts).strip()
+    if failed and answer:
+        answer += f"\n\n{INTERRUPTED_NOTICE}"
+    answer = answer or FALLBACK_ANSWER
+    QUERIES.inc(kind="stream", outcome=_generation_outcome(answer, failed))
+    result = _make_result(answer, context)
+    # Оборванную (отменой или сбоем) генерацию не кэшируем
+    cancelled = cancel_event is not None and cancel_event.is_set()
+    if answer != FALLBACK_ANSWER and not failed and not cancelled:
+        answer_cache.put(question, result, cache_version, question_vector)
+    yield "result", result
+
+
+def _llm_charge(pool, user, limited: bool):
+    """Списание лимита пользователя — только для запросов, которые дойдут до LLM"""
+    return partial(pool.limiter.consume, user) if limited else None
+
+
+async def aquery_rag(question: str, top_k=3, user=None, limited=False):
+    """
+    Асинхронная обёртка над query_rag: выполняет запрос в общем пуле воркеров,
+    не блокируя event loop бота или FastAPI. Ответ из кэша возвращается без очереди и лимита.
+    :param user: ключ пользователя для справедливой очереди пула
+    :param limited: применять лимит запросов к LLM на пользователя
+    :raises RagOverloadedError: если очередь запросов переполнена или превышен лимит пользователя
+    """
+    lookup = await asyncio.to_thread(lookup_answer, question)
+    if lookup[0] is not None:
+        return lookup[0]
+    pool = get_pool()
+    return await pool.run(
+        query_rag, question, top_k, _llm_charge(pool, user, limited), lookup, user=user, limited=limited
+    )
+
+
+async def asearch_rag(question: str, top_k=3, user=None):
+    """Асинхронная обёртка над search_rag (общий пул воркеров)"""
+    return await get_pool().run(search_rag, question, top_k, user=user)
+
+
+async def astream_rag(question: str, top_k=3, user=None, limited=False, supersede=False):
+    """
+    Асинхронный вариант stream_rag: генерация идёт в пуле воркеров,
+    события передаются в event loop через asyncio.Queue. Ответ из кэша отдаётся без очереди и лимита.
+    Пока запрос ждёт воркера, генерируются события ("queue", позиция в очереди).
+    :param limited: применять лимит запросов к LLM на пользователя
+    :param supersede: снять из очереди прежний, ещё не начатый вопрос этого пользователя
+    :raises RagOverloadedError: если очередь запросов переполнена или превышен лимит пользователя
+    :raises RagSupersededError: если пользователь задал новый вопрос раньше, чем начался этот
+    """
+    lookup = await asyncio.to_thread(lookup_answer, question, "stream")
+    if lookup[0] is not None:
+        yield "token", lookup[0].get("answer", "")
+        yield "result", lookup[0]
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancel_event = threading.Event()
+    pool = get_pool()
+    before_llm = _llm_charge(pool, user, limited)
+
+    def produce():
+        try:
+            for event in stream_rag(question, top_k, cancel_event, before_llm, lookup):
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    def on_done(future):
+        # produce не запустился: запрос снят из очереди или отменён
+        if not future.cancelled() and future.exception() is not None:
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", future.exception()))
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    future = pool.submit(produce, user=user, limited=limited, supersede=supersede)
+    future.add_done_callback(on_done)
+    try:
+        position = None
+        while True:
+            if position != 0 and queue.empty():
+                current = pool.queue_position(future)
+                if current and current != position:
+                    yield "queue", current
+                position = current
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=QUEUE_POSITION_INTERVAL)
+                except asyncio.TimeoutError:
+                    continue
+            else:
+                event = await queue.get()
+            if event is None:
+                break
+            if event[0] == "error":
+                raise event[1]
+            yield event
+    finally:
+        # Потребитель ушёл (отмена/ошибка) — снимаем из очереди или останавливаем генерацию
+        future.cancel()
+        cancel_event.set()
+
+
+def warm_up():
+    """
+    Загружает модель эмбеддингов, открывает индекс и проверяет серверы LLM,
+    чтобы первый вопрос не ждал инициализации
+    """
+    try:
+        with startup_phase("Прогрев RAG"):
+            get_embedding().embed_query("прогрев")
+            get_vectorstore()
+            for backend in get_llm().backends:
+                backend.check_health()
+    except Exception as e:
+        print(f"⚠️ Прогрев RAG не удался: {e}")
+
+
+def start_warm_up():
+    """Запускает warm_up в фоновом потоке, если он включён (RAG_WARMUP)"""
+    if RAG_WARMUP:
+        threading.Thread(target=warm_up, name="rag-warmup", daemon=True).start()
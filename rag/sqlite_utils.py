@@ -0,0 +1,35 @@
+# rag/sqlite_utils.py
+import sqlite3
+
+# SQLite ограничивает число параметров запроса (999 в старых сборках) — списки для IN (...) делим на порции
+MAX_PARAMS = 500
+
+
+def in_batches(values: list, size: int = MAX_PARAMS):
+    """Порции значений для условия IN (...): пары (порция, строка плейсхолдеров "?,?,…")"""
+    for start in range(0, len(values), size):
+        part = values[start:start + size]
+        yield part, ",".join("?" * len(part))
+
+
+def select_in(conn: sqlite3.Connection, query: str, values) -> list:
+    """
+    SELECT с условием IN по любому числу значений
+    :param query: Запрос с {marks} на месте списка плейсхолдеров
+    """
+    rows = []
+    for part, marks in in_batches(list(values)):
+        rows.extend(conn.execute(query.format(marks=marks), part).fetchall())
+    return rows
+
+
+def touch_and_prune(conn: sqlite3.Connection, table: str, used_keys, max_age_days: float):
+    """
+    Обслуживание кэша в SQLite (key, …, created): записям, по которым было попадание,
+    обновляет created, записи, которыми не пользовались дольше max_age_days, удаляет (0 — не удалять)
+    """
+    with conn:
+        for part, marks in in_batches(list(used_keys)):
+            conn.execute(f"UPDATE {table} SET created = julianday('now') WHERE key IN ({marks})", part)
+        if max_age_days > 0:
+            conn.execute(f"DELETE FROM {table} WHERE created < julianday('now') - ?", (max_age_days,))
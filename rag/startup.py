@@ -0,0 +1,36 @@
+# rag/startup.py
+import time
+import threading
+from contextlib import contextmanager
+
+# Время процесса на момент первого импорта — от него считается «холодный старт»
+PROCESS_STARTED = time.perf_counter()
+
+_lock = threading.Lock()
+_timings = {}
+
+
+@contextmanager
+def startup_phase(name: str):
+    """Замеряет этап запуска (загрузка модели, открытие индекса и т. п.) и пишет его в лог"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            _timings[name] = round(elapsed, 3)
+        print(f"⏱️ {name}: {elapsed:.2f} с")
+
+
+def mark_ready(name: str):
+    """Отмечает, через сколько секунд после старта процесса сервис готов к работе"""
+    elapsed = time.perf_counter() - PROCESS_STARTED
+    with _lock:
+        _timings[f"{name} (с начала запуска)"] = round(elapsed, 3)
+    print(f"🚀 {name}: готов через {elapsed:.2f} с после запуска")
+
+
+def get_startup_timings() -> dict:
+    with _lock:
+        return dict(_timings)
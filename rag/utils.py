@@ -1,8 +1,6 @@
 # rag/utils.py
 from PyPDF2 import PdfReader
 from PIL import Image
-import io
-import pytesseract
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -11,60 +9,57 @@ load_dotenv()
 MEDIA_DIR = Path(os.getenv("MEDIA_DIR", "media"))
 MEDIA_DIR.mkdir(exist_ok=True)
 
-def extract_text_from_image(image):
-    try:
-        return pytesseract.image_to_string(image, lang='eng+rus').strip()
-    except Exception as e:
-        print(f"OCR ошибка: {e}")
-        return ""
-
-def extract_images_from_pdf(pdf_path):
+def _save_page_images(page, page_num, pdf_name):
+    """Сохраняет изображения одной страницы в MEDIA_DIR (без OCR)"""
     images_data = []
-    ocr_texts_combined = ""  # Добавляем переменную для сбора всего OCR текста
-    reader = PdfReader(pdf_path)
-    pdf_name = Path(pdf_path).stem
+    if "/XObject" not in page["/Resources"]:
+        return images_data
 
-    for page_num, page in enumerate(reader.pages):
-        if "/XObject" not in page["/Resources"]:
+    xobj = page["/Resources"]["/XObject"].get_object()
+    image_counter = 0
+
+    for obj_name, obj in xobj.items():
+        obj = obj.get_object()
+        if obj["/Subtype"] != "/Image":
             continue
 
-        xobj = page["/Resources"]["/XObject"].get_object()
-        image_counter = 0
+        size = (obj["/Width"], obj["/Height"])
+        img_key = f"{pdf_name}_page{page_num}_{image_counter}"
+        img_path = str(MEDIA_DIR / f"{img_key}.jpg")
 
-        for obj_name, obj in xobj.items():
-            obj = obj.get_object()
-            if obj["/Subtype"] != "/Image":
+        try:
+            if obj.get("/Filter") == "/FlateDecode":
+                image = Image.frombytes("RGB", size, obj.get_data())
+                image.save(img_path, "JPEG")
+            elif obj.get("/Filter") == "/DCTDecode":
+                with open(img_path, "wb") as f:
+                    f.write(obj.get_data())
+            else:
                 continue
 
-            size = (obj["/Width"], obj["/Height"])
-            data = obj.get_data()
-            img_key = f"{pdf_name}_page{page_num}_{image_counter}"
-            img_path = str(MEDIA_DIR / f"{img_key}.jpg")
+            images_data.append({
+                "page_num": page_num,
+                "order": image_counter,
+                "img_path": img_path,
+                "caption": f"Скриншот со стр. {page_num + 1}",
+            })
+            image_counter += 1
 
-            try:
-                if obj.get("/Filter") == "/FlateDecode":
-                    image = Image.frombytes("RGB", size, data)
-                    image.save(img_path, "JPEG")
-                elif obj.get("/Filter") == "/DCTDecode":
-                    with open(img_path, "wb") as f:
-                        f.write(data)
-                else:
-                    continue
+        except Exception as e:
+            print(f"Ошибка при обработке изображения: {e}")
 
-                ocr_text = extract_text_from_image(Image.open(img_path))
-                ocr_texts_combined += f"\n[OCR изображение {img_key}]: {ocr_text}\n"  # Добавляем OCR текст в общий текст
-                
-                images_data.append({
-                    "page_num": page_num,
-                    "order": image_counter,
-                    "img_path": img_path,
-                    "caption": f"Скриншот со стр. {page_num + 1}",
-                    "ocr_text": ocr_text
-                })
-                image_counter += 1
+    return images_data
 
-            except Exception as e:
-                print(f"Ошибка при обработке изображения: {e}")
 
-    # Возвращаем кортеж: список изображений и общий OCR текст
-    return images_data, ocr_texts_combined
\ No newline at end of file
+def iter_pdf_pages(pdf_path):
+    """
+    Однопроходный разбор PDF: для каждой страницы отдаёт
+    (номер страницы, текст, список сохранённых изображений без OCR).
+    Картинки сразу пишутся на диск, в памяти остаются только их метаданные.
+    """
+    reader = PdfReader(pdf_path)
+    pdf_name = Path(pdf_path).stem
+
+    for page_num, page in enumerate(reader.pages):
+        yield page_num, page.extract_text() or "", _save_page_images(page, page_num, pdf_name)
+
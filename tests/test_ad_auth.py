@@ -0,0 +1,155 @@
+import re
+import sys
+import types
+import importlib
+
+import pytest
+
+SERVICE_DN = "CN=svc-bot,OU=Service,DC=test,DC=local"
+SERVICE_PASSWORD = "service-secret"
+
+
+class FakeDirectory:
+    """Каталог LDAP в памяти: учётные записи, ФИО и все открытые к нему соединения"""
+
+    def __init__(self):
+        self.passwords = {SERVICE_DN: SERVICE_PASSWORD, "ivanov@test.local": "secret"}
+        self.names = {"ivanov": "Иванов Иван"}
+        self.connections = []
+        self.searches = 0
+
+
+def _fake_ldap(directory: FakeDirectory) -> types.ModuleType:
+    """Модуль с интерфейсом python-ldap, который auth.ad_auth использует, поверх FakeDirectory"""
+    ldap = types.ModuleType("ldap")
+    ldap.VERSION3 = 3
+    ldap.OPT_REFERRALS = "referrals"
+    ldap.OPT_NETWORK_TIMEOUT = "network_timeout"
+    ldap.OPT_TIMEOUT = "timeout"
+    ldap.SCOPE_SUBTREE = 2
+    ldap.LDAPError = type("LDAPError", (Exception,), {})
+    for name in ("INVALID_CREDENTIALS", "INSUFFICIENT_ACCESS", "UNWILLING_TO_PERFORM", "SERVER_DOWN", "TIMEOUT"):
+        setattr(ldap, name, type(name, (ldap.LDAPError,), {}))
+
+    class Connection:
+        def __init__(self):
+            self.bound_dn = None
+            self.dropped = False  # сервер разорвал соединение, пока оно простаивало в пуле
+            self.closed = False
+            self.protocol_version = None
+
+        def set_option(self, option, value):
+            pass
+
+        def _check(self):
+            if self.dropped or self.closed:
+                raise ldap.SERVER_DOWN({"desc": "Can't contact LDAP server"})
+
+        def simple_bind_s(self, dn, password):
+            self._check()
+            self.bound_dn = None
+            if directory.passwords.get(dn) != password:
+                raise ldap.INVALID_CREDENTIALS({"desc": "Invalid credentials"})
+            self.bound_dn = dn
+
+        def search_st(self, base, scope, filterstr, attrlist, timeout):
+            self._check()
+            directory.searches += 1
+            username = re.fullmatch(r"\(sAMAccountName=(.+)\)", filterstr).group(1)
+            name = directory.names.get(username)
+            return [(f"CN={username},{base}", {"displayName": [name.encode("utf-8")]})] if name else []
+
+        def unbind_s(self):
+            self.closed = True
+
+    def initialize(uri):
+        conn = Connection()
+        directory.connections.append(conn)
+        return conn
+
+    ldap.initialize = initialize
+    ldap.filter = types.ModuleType("ldap.filter")
+    ldap.filter.escape_filter_chars = lambda value: value
+    return ldap
+
+
+@pytest.fixture
+def directory(monkeypatch):
+    """auth.ad_auth, заново импортированный поверх фейкового python-ldap, с пулом на сервисной учётной записи"""
+    directory = FakeDirectory()
+    ldap = _fake_ldap(directory)
+    monkeypatch.setitem(sys.modules, "ldap", ldap)
+    monkeypatch.setitem(sys.modules, "ldap.filter", ldap.filter)
+    monkeypatch.delitem(sys.modules, "auth.ad_auth", raising=False)
+    ad_auth = importlib.import_module("auth.ad_auth")
+
+    monkeypatch.setattr(ad_auth, "AD_SERVER", "ldap://stand-in")
+    monkeypatch.setattr(ad_auth, "AD_DOMAIN", "test.local")
+    monkeypatch.setattr(ad_auth, "AD_BASE_DN", "DC=test,DC=local")
+    monkeypatch.setattr(ad_auth, "AD_USER_DN_TEMPLATE", "{username}@{domain}")
+    monkeypatch.setattr(ad_auth, "AD_USER_FILTER", "(sAMAccountName={username})")
+    monkeypatch.setattr(ad_auth, "AD_BIND_DN", SERVICE_DN)
+    monkeypatch.setattr(ad_auth, "AD_BIND_PASSWORD", SERVICE_PASSWORD)
+    monkeypatch.setattr(ad_auth, "AD_NAME_CACHE_TTL", 3600)
+    monkeypatch.setattr(ad_auth, "_pool", ad_auth._ConnectionPool(2))
+    directory.ad_auth = ad_auth
+    yield directory
+    # Модуль на фейковом ldap не должен достаться следующим тестам
+    sys.modules.pop("auth.ad_auth", None)
+
+
+def _idle(ad_auth) -> list:
+    return list(ad_auth._pool._idle.queue)
+
+
+def test_wrong_password_returns_connection_service_bound(directory):
+    ad_auth = directory.ad_auth
+    before = ad_auth.LOGINS.value(result="invalid_credentials")
+
+    assert ad_auth.authenticate_user("ivanov", "wrong") == (False, "Неверный логин или пароль")
+
+    # Неверный пароль — обычная неудача входа, а соединение не потеряно и снова сервисное
+    assert ad_auth.LOGINS.value(result="invalid_credentials") == before + 1
+    (conn,) = _idle(ad_auth)
+    assert conn.bound_dn == SERVICE_DN and not conn.closed
+    assert directory.searches == 0
+
+
+def test_stale_pooled_connection_is_retried_on_a_new_one(directory):
+    ad_auth = directory.ad_auth
+    assert ad_auth.authenticate_user("ivanov", "secret") == (True, "Иванов Иван")
+    (stale,) = _idle(ad_auth)
+    stale.dropped = True
+
+    assert ad_auth.authenticate_user("ivanov", "secret") == (True, "Иванов Иван")
+
+    # Разорванное соединение закрыто и выброшено, в пуле — новое, привязанное к сервисной записи
+    assert stale.closed
+    (fresh,) = _idle(ad_auth)
+    assert fresh is not stale and fresh.bound_dn == SERVICE_DN
+    assert len(directory.connections) == 2
+
+
+def test_rejected_service_bind_raises_unavailable(directory):
+    ad_auth = directory.ad_auth
+    directory.passwords[SERVICE_DN] = "rotated"
+    before = ad_auth.LOGINS.value(result="invalid_credentials")
+
+    with pytest.raises(ad_auth.ADUnavailableError):
+        ad_auth.authenticate_user("ivanov", "secret")
+
+    # Отказ сервисной записи не засчитывается пользователю как неверный пароль
+    assert ad_auth.LOGINS.value(result="invalid_credentials") == before
+    assert _idle(ad_auth) == []
+    assert all(conn.closed for conn in directory.connections)
+
+
+def test_repeat_login_uses_name_cache(directory):
+    ad_auth = directory.ad_auth
+    hits = ad_auth.NAME_CACHE.value(result="hit")
+
+    assert ad_auth.authenticate_user("ivanov", "secret") == (True, "Иванов Иван")
+    assert ad_auth.authenticate_user("ivanov", "secret") == (True, "Иванов Иван")
+
+    assert directory.searches == 1
+    assert ad_auth.NAME_CACHE.value(result="hit") == hits + 1
@@ -0,0 +1,77 @@
+import types
+import itertools
+
+import pytest
+
+from auth import session
+from rag import answer_cache
+
+RESULT = {"answer": "Откройте приложение и нажмите «Войти».", "images": [], "source": "vats.docx", "link_to_document": ""}
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    """Redis в памяти процесса, кэш включён, время LRU идёт по шагам — порядок использования однозначен"""
+    monkeypatch.setattr(session, "REDIS_URL", "fakeredis://")
+    monkeypatch.setattr(session, "_fake_server", None)
+    monkeypatch.setattr(session, "_redis", None)
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_SIMILARITY", 0)
+    clock = itertools.count(1000)
+    monkeypatch.setattr(answer_cache, "time", types.SimpleNamespace(time=lambda: float(next(clock))))
+
+
+def _put(question, vector=None, result=RESULT):
+    _, version = answer_cache.get(question, vector)
+    answer_cache.put(question, result, version, vector)
+
+
+def test_normalized_question_hit_and_miss():
+    _put("Как подключиться к ВАТС?")
+
+    assert answer_cache.get("  как ПОДКЛЮЧИТЬСЯ к ватс ") == (RESULT, 0)
+    assert answer_cache.get("Как подключиться к VPN?") == (None, 0)
+    assert answer_cache.stats()["hits"] == 1
+
+
+def test_semantic_match(monkeypatch):
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_SIMILARITY", 0.9)
+    _put("Как подключиться к ВАТС?", [1.0, 0.0, 0.0])
+
+    assert answer_cache.get("Подключение ВАТС", [0.99, 0.1, 0.0])[0] == RESULT
+    assert answer_cache.get("Пароль от Wi-Fi", [0.0, 1.0, 0.0])[0] is None
+    # Без эмбеддинга вопроса семантический поиск не выполняется
+    assert answer_cache.get("Подключение ВАТС")[0] is None
+
+
+def test_lru_and_ttl_eviction(monkeypatch):
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_MAX_ENTRIES", 2)
+    _put("первый")
+    _put("второй")
+    assert answer_cache.get("первый")[0] == RESULT  # «второй» теперь самый давно использованный
+    _put("третий")
+
+    assert answer_cache.get("второй")[0] is None
+    assert answer_cache.get("первый")[0] == RESULT
+    assert answer_cache.get("третий")[0] == RESULT
+    assert answer_cache.stats()["entries"] == 2
+
+    key = f"{answer_cache.PREFIX}:0:{answer_cache._question_hash('третий')}"
+    assert 0 < session.get_redis().ttl(key) <= answer_cache.ANSWER_CACHE_TTL
+
+
+def test_bump_index_version_invalidates():
+    _put("Как подключиться к ВАТС?")
+    answer_cache.bump_index_version()
+
+    assert answer_cache.get("Как подключиться к ВАТС?") == (None, 1)
+    assert answer_cache.stats()["entries"] == 0
+
+
+def test_put_under_stale_version_is_ignored():
+    # Индекс обновился, пока шла генерация: ответ по старому индексу не должен попасть в кэш
+    _, version = answer_cache.get("Как подключиться к ВАТС?")
+    answer_cache.bump_index_version()
+    answer_cache.put("Как подключиться к ВАТС?", RESULT, version)
+
+    assert answer_cache.get("Как подключиться к ВАТС?") == (None, 1)
@@ -0,0 +1,79 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from rag.batching import QueryEmbeddingBatcher
+from rag.embedding_cache import CachedEmbeddings
+
+N = 8
+
+
+class FakeModel:
+    """Модель эмбеддингов: вектор текста — его длина и номер вызова, вызовы записываются"""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls.append(list(texts))
+        if self.error is not None:
+            raise self.error
+        return [[float(len(text)), float(len(self.calls))] for text in texts]
+
+
+def _embed_concurrently(batcher, texts):
+    """Все вызовы embed стартуют одновременно; возвращает результат или исключение каждого"""
+    start = threading.Barrier(len(texts))
+
+    def call(text):
+        start.wait()
+        try:
+            return batcher.embed(text)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(len(texts)) as executor:
+        return list(executor.map(call, texts))
+
+
+def test_concurrent_queries_share_one_model_call(tmp_path):
+    model = FakeModel()
+    embeddings = CachedEmbeddings(model, "fake", path=str(tmp_path / "cache.sqlite3"))
+    # Окно заведомо длиннее старта потоков: батч закрывается по заполнению
+    batcher = QueryEmbeddingBatcher(embeddings.embed_queries, window_ms=5000, max_batch=N)
+    texts = ["?" * (i + 1) for i in range(N)]
+
+    vectors = _embed_concurrently(batcher, texts)
+
+    assert len(model.calls) == 1 and sorted(model.calls[0]) == sorted(texts)
+    assert vectors == [[float(len(text)), 1.0] for text in texts]
+    assert all(embeddings.cached_query(text) == vector for text, vector in zip(texts, vectors))
+
+
+def test_model_error_reaches_every_waiter():
+    model = FakeModel(error=RuntimeError("CUDA out of memory"))
+    batcher = QueryEmbeddingBatcher(model.embed_documents, window_ms=5000, max_batch=N)
+
+    results = _embed_concurrently(batcher, [f"вопрос {i}" for i in range(N)])
+
+    assert len(model.calls) == 1
+    assert all(result is model.error for result in results)
+
+
+def test_next_batch_starts_after_a_full_one():
+    model = FakeModel()
+    batcher = QueryEmbeddingBatcher(model.embed_documents, window_ms=5000, max_batch=2)
+
+    vectors = _embed_concurrently(batcher, ["a" * i for i in range(1, 5)])
+
+    assert sorted(len(call) for call in model.calls) == [2, 2]
+    assert sorted(vector[0] for vector in vectors) == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_lone_query_is_not_held_past_the_window():
+    model = FakeModel()
+    batcher = QueryEmbeddingBatcher(model.embed_documents, window_ms=1, max_batch=N)
+    assert batcher.embed("один") == [4.0, 1.0]
+    assert model.calls == [["один"]]
@@ -0,0 +1,78 @@
+import sqlite3
+import os
+
+import pytest
+
+from rag import bm25, rag_engine
+
+CHUNKS = {
+    "vats:0": "Для подключения к ВАТС Ростелеком установите приложение и войдите по номеру.",
+    "crm:0": "Интеграция Bitrix24 с телефонией: звонки попадают в карточку клиента.",
+    "mail:0": "Настройка почты: откройте параметры учётной записи и сохраните изменения.",
+    "vpn:0": "Подключиться к VPN можно из меню «Сеть»; подключение занимает минуту.",
+}
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    index_dir = str(tmp_path)
+    bm25.add_chunks(list(CHUNKS), list(CHUNKS.values()), index_dir)
+    return index_dir
+
+
+def test_tokenize_stems_russian_word_forms():
+    assert bm25.tokenize("Подключение") == bm25.tokenize("подключиться") == bm25.tokenize("ПОДКЛЮЧЕНИЯ")
+    assert bm25.tokenize("учётной") == bm25.tokenize("учетная")
+    # Аббревиатуры, латиница и числа не стеммируются, однобуквенные токены отбрасываются
+    assert bm25.tokenize("ВАТС Bitrix24 в 2 настройках") == ["ватс", "bitrix24", "настройк"]
+
+
+@pytest.mark.parametrize("query, expected", [("ВАТС", "vats:0"), ("bitrix24", "crm:0"), ("как подключиться", "vpn:0")])
+def test_exact_terms_are_found(index_dir, query, expected):
+    hits = bm25.search(query, 10, index_dir)
+    assert hits[0][0] == expected
+
+
+def test_remove_chunks_leaves_no_postings(index_dir):
+    bm25.remove_chunks(["vats:0", "crm:0"], index_dir)
+
+    assert bm25.search("ВАТС Bitrix24", 10, index_dir) == []
+    conn = sqlite3.connect(os.path.join(index_dir, bm25.BM25_FILENAME))
+    try:
+        ids = {chunk_id for (chunk_id,) in conn.execute("SELECT chunk_id FROM postings UNION SELECT chunk_id FROM chunks")}
+    finally:
+        conn.close()
+    assert ids == {"mail:0", "vpn:0"}
+
+
+class FakeCollection:
+    """Коллекция Chroma с заранее заданным результатом векторного поиска"""
+
+    def __init__(self, ranked_ids):
+        self.ranked_ids = ranked_ids
+
+    def query(self, query_embeddings, n_results, include):
+        ids = self.ranked_ids[:n_results]
+        return {
+            "ids": [ids],
+            "documents": [[CHUNKS[i] for i in ids]],
+            "metadatas": [[{"source": i.split(":")[0]} for i in ids]],
+            "distances": [[0.1 * (rank + 1) for rank in range(len(ids))]],
+        }
+
+    def get(self, ids, include):
+        return {"ids": ids, "documents": [CHUNKS[i] for i in ids], "metadatas": [{"source": i.split(":")[0]} for i in ids]}
+
+
+def test_hybrid_search_fuses_ranks(index_dir, monkeypatch):
+    monkeypatch.setattr(rag_engine, "RETRIEVAL_MODE", "hybrid")
+    monkeypatch.setattr(rag_engine, "RRF_K", 60)
+    # Векторный поиск не нашёл чанк про ВАТС; BM25 ставит его первым, vpn:0 — вторым
+    vs = type("Store", (), {"_collection": FakeCollection(["vpn:0", "mail:0", "crm:0"])})()
+
+    hits = rag_engine.search_chunks("подключение к ВАТС", top_k=3, question_vector=[0.0], index_dir=index_dir, vs=vs)
+
+    # vpn:0 — в обоих списках; vats:0 есть только у BM25, но первым — выше mail:0, второго у векторного
+    assert [hit["id"] for hit in hits] == ["vpn:0", "vats:0", "mail:0"]
+    assert hits[1]["distance"] is None and hits[1]["text"] == CHUNKS["vats:0"]
+    assert hits[1]["metadata"] == {"source": "vats"}
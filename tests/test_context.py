@@ -0,0 +1,60 @@
+import pytest
+
+from rag import context
+from rag.context import build_context, clean_chunk, count_tokens
+
+PAGE = (
+    "\n[Страница 3]\nОткройте раздел «Телефония» и нажмите «Добавить номер».\n"
+    "\n[Текст со скриншотов из PDF]:\n"
+    "[OCR изображение page3_img1]: Телефония\nДобавить номер\n|| ~~ ##\n"
+    f"{context.OCR_BLOCK_END}\n"
+    "\n[Страница 4]\nВведите номер и сохраните настройки.\n"
+)
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    """Подсчёт токенов — приближённой оценкой, без HF-токенизатора"""
+    monkeypatch.setattr(context, "_tokenizer", None)
+    monkeypatch.setattr(context, "_tokenizer_loaded", True)
+
+
+def test_clean_chunk_keeps_ocr_text_without_labels_and_noise():
+    assert clean_chunk(PAGE) == (
+        "[Страница 3]\nОткройте раздел «Телефония» и нажмите «Добавить номер».\n\n"
+        "[Текст со скриншотов]:\nТелефония\nДобавить номер\n\n"
+        "[Страница 4]\nВведите номер и сохраните настройки."
+    )
+
+
+def test_clean_chunk_without_ocr_leaves_only_instruction_text():
+    assert clean_chunk(PAGE, keep_ocr=False) == (
+        "Откройте раздел «Телефония» и нажмите «Добавить номер».\n\nВведите номер и сохраните настройки."
+    )
+
+
+@pytest.mark.parametrize("start", ["Добавить номер\n", "|| ~~ ##\n"])
+def test_chunk_starting_on_ocr_continuation_line(start):
+    # Чанк начался на строке-продолжении OCR последнего изображения страницы
+    chunk = PAGE[PAGE.index(start):]
+    assert clean_chunk(chunk, keep_ocr=False) == "Введите номер и сохраните настройки."
+    assert "~~" not in clean_chunk(chunk)
+
+
+def test_build_context_removes_overlap_between_chunks_of_one_document():
+    first = "Шаг 1. Установите приложение «Телефон» из магазина RuStore на рабочий смартфон."
+    second = "из магазина RuStore на рабочий смартфон. Шаг 2. Войдите по номеру и паролю."
+    text, used, count = build_context([first, second, second], ["vats.pdf", "vats.pdf", "other.pdf"])
+
+    assert text.split(context.SEPARATOR) == [first, "Шаг 2. Войдите по номеру и паролю.", second]
+    assert count == 3 and used == count_tokens(text)
+
+
+def test_build_context_stays_within_budget():
+    chunks = [" ".join(f"слово{i}" for i in range(n, n + 80)) for n in range(0, 400, 80)]
+    budget = 300
+    text, used, count = build_context(chunks, [f"doc{i}.pdf" for i in range(len(chunks))], budget=budget)
+
+    assert used == count_tokens(text) <= budget
+    assert text.endswith(context.TRUNCATION_MARK)
+    assert 1 < count < len(chunks)
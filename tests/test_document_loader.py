@@ -0,0 +1,163 @@
+import io
+import os
+import sqlite3
+
+import pytest
+from docx import Document
+
+from benchmarks.corpus import screenshot
+from rag import bm25, document_loader, image_index
+from rag.manifest import load_manifest
+
+TEXT = "Откройте меню, выберите раздел «Параметры» и сохраните изменения подключения к ВАТС. "
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    """
+    Папка документов, медиа и каталог версии индекса во временной папке.
+    Chroma и OCR заменены заглушками: Chroma — словарём id → текст
+    """
+    folder, media, index_dir = tmp_path / "documents", tmp_path / "media", tmp_path / "index"
+    folder.mkdir()
+    media.mkdir()
+    monkeypatch.setattr(document_loader, "MEDIA_DIR", str(media))
+    monkeypatch.setattr(document_loader, "ocr_images", lambda paths: [""] * len(paths))
+
+    state = {"chroma": {}, "embedded": []}
+
+    def add_documents(doc_ids, texts, metadatas, index_dir=None):
+        state["embedded"].extend(doc_ids)
+        state["chroma"].update(zip(doc_ids, texts))
+
+    def delete_documents(doc_ids, index_dir=None):
+        for doc_id in doc_ids:
+            state["chroma"].pop(doc_id, None)
+
+    monkeypatch.setattr(document_loader, "add_documents", add_documents)
+    monkeypatch.setattr(document_loader, "delete_documents", delete_documents)
+
+    def sync():
+        state["embedded"].clear()
+        document_loader.load_documents_from_folder(str(folder), index_dir=str(index_dir))
+        return load_manifest(str(index_dir))
+
+    state.update(folder=folder, media=media, index_dir=str(index_dir), sync=sync)
+    return state
+
+
+def write_docx(path, steps):
+    """DOCX из шагов (абзац, число скриншотов после него); скриншоты стоят в отдельных абзацах"""
+    document = Document()
+    for number, (text, images) in enumerate(steps):
+        document.add_paragraph(text)
+        for i in range(images):
+            document.add_picture(io.BytesIO(screenshot(f"Шаг {number + 1}", [f"Окно {i}"])))
+    document.save(path)
+
+
+def _postings(index_dir) -> set:
+    conn = sqlite3.connect(os.path.join(index_dir, bm25.BM25_FILENAME))
+    try:
+        return {chunk_id for (chunk_id,) in conn.execute("SELECT DISTINCT chunk_id FROM postings")}
+    finally:
+        conn.close()
+
+
+def _image_rows(index_dir, source) -> list:
+    return image_index.get_chunk_images([(source, None, None)], index_dir)
+
+
+def test_unchanged_file_is_skipped(index):
+    write_docx(index["folder"] / "vats.docx", [(TEXT * 3, 1)])
+    first = index["sync"]()
+    assert index["embedded"] == first["vats.docx"]["chunk_ids"]
+
+    assert index["sync"]() == first
+    assert index["embedded"] == []
+
+
+def test_touched_file_with_same_hash_is_not_reembedded(index):
+    path = index["folder"] / "vats.docx"
+    write_docx(path, [(TEXT * 3, 1)])
+    first = index["sync"]()["vats.docx"]
+
+    os.utime(path, (first["mtime"] + 100, first["mtime"] + 100))
+    second = index["sync"]()["vats.docx"]
+
+    assert index["embedded"] == []
+    assert second["mtime"] == first["mtime"] + 100
+    assert second["hash"] == first["hash"] and second["chunk_ids"] == first["chunk_ids"]
+
+
+def test_shrunk_document_drops_tail_chunks_images_and_media(index):
+    path = index["folder"] / "vats.docx"
+    write_docx(path, [(TEXT * 8, 1), (TEXT * 8, 1), (TEXT * 8, 1)])
+    long = index["sync"]()["vats.docx"]
+    assert len(long["media"]) == 3
+
+    write_docx(path, [(TEXT * 3, 1)])
+    short = index["sync"]()["vats.docx"]
+
+    tail = set(long["chunk_ids"]) - set(short["chunk_ids"])
+    assert tail and len(short["chunk_ids"]) < len(long["chunk_ids"])
+    assert set(index["chroma"]) == set(short["chunk_ids"])
+    assert _postings(index["index_dir"]) == set(short["chunk_ids"])
+    assert [img["img_path"] for img in _image_rows(index["index_dir"], "vats.docx")] == short["media"]
+    assert sorted(os.listdir(index["media"])) == [os.path.basename(p) for p in short["media"]]
+
+
+def test_deleted_file_is_purged(index):
+    write_docx(index["folder"] / "vats.docx", [(TEXT * 3, 1)])
+    write_docx(index["folder"] / "guest.docx", [(TEXT, 0)])
+    index["sync"]()
+
+    os.remove(index["folder"] / "vats.docx")
+    manifest = index["sync"]()
+
+    assert list(manifest) == ["guest.docx"]
+    assert set(index["chroma"]) == set(manifest["guest.docx"]["chunk_ids"])
+    assert _postings(index["index_dir"]) == set(manifest["guest.docx"]["chunk_ids"])
+    assert _image_rows(index["index_dir"], "vats.docx") == []
+    assert os.listdir(index["media"]) == []
+
+
+VATS_DOCX = os.path.join(os.path.dirname(__file__), os.pardir, "documents", "1) Установка Ростелеком ВАТС.docx")
+
+
+def test_docx_screenshots_belong_to_the_step_they_illustrate(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_loader, "MEDIA_DIR", str(tmp_path))
+    document = document_loader.parse_document(VATS_DOCX)
+
+    # VML-копии картинок (rId10, rId12) не попадают второй раз на «страницу» 0
+    assert [img["page_num"] for img in document["images"]] == [1, 2]
+    assert len(os.listdir(tmp_path)) == 2
+    starts = {page: offset for offset, page in document["page_map"]}
+    assert document["text"][starts[1]:].startswith("RuStore: Наведите камеру")
+    assert document["text"][starts[2]:].startswith("Откройте приложение и нажмите")
+
+
+def test_page_range_of_docx_steps(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_loader, "MEDIA_DIR", str(tmp_path))
+    steps = ["Шаг 1: установите приложение.", "Шаг 2: нажмите «Войти».", "Шаг 3: введите пароль."]
+    write_docx(tmp_path / "steps.docx", [(steps[0], 1), (steps[1], 1), (steps[2], 0)])
+    document = document_loader.parse_document(str(tmp_path / "steps.docx"))
+    text, page_map = document["text"], document["page_map"]
+
+    def pages(fragment):
+        return document_loader.page_range(text.index(fragment), len(fragment), page_map)
+
+    # Скриншот шага — на «странице», которая начинается с описания шага
+    assert [img["page_num"] for img in document["images"]] == [0, 1]
+    assert pages(steps[0]) == (0, 0)
+    assert pages(steps[1]) == (1, 1)
+    assert pages(steps[2]) == (1, 1)
+    assert pages(text) == (0, 1)
+
+
+def test_page_range_boundaries():
+    page_map = [(0, 0), (10, 1), (20, 2)]
+    assert document_loader.page_range(0, 10, page_map) == (0, 0)
+    assert document_loader.page_range(9, 2, page_map) == (0, 1)
+    assert document_loader.page_range(25, 5, page_map) == (2, 2)
+    assert document_loader.page_range(5, 0, page_map) == (0, 0)
@@ -0,0 +1,90 @@
+import array
+import sqlite3
+
+import pytest
+
+from rag.embedding_cache import CachedEmbeddings, EMBEDDING_CACHE
+
+
+class FakeModel:
+    """Модель эмбеддингов с записью вызовов; вектор не представим точно во float32"""
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[len(text) + 0.1, -1 / 3] for text in texts]
+
+
+@pytest.fixture
+def model():
+    return FakeModel()
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "embeddings.sqlite3")
+
+
+def _float32(vector):
+    return array.array("f", vector).tolist()
+
+
+def test_cached_chunks_skip_the_model_and_round_trip_through_float32(model, cache_path):
+    embeddings = CachedEmbeddings(model, "fake", path=cache_path)
+    fresh = embeddings.embed_documents(["шаг 1", "шаг 22", "шаг 1"])
+    # Одинаковый текст в пачке кодируется один раз
+    assert model.calls == [["шаг 1", "шаг 22"]]
+    assert fresh[0] == fresh[2] == [5.1, -1 / 3]
+
+    hits = EMBEDDING_CACHE.value(kind="chunk", result="hit")
+    # Кэш переживает пересоздание обёртки (перезапуск бота)
+    again = CachedEmbeddings(model, "fake", path=cache_path).embed_documents(["шаг 22", "шаг 1", "шаг 333"])
+
+    assert model.calls[1:] == [["шаг 333"]]
+    assert again == [_float32([6.1, -1 / 3]), _float32([5.1, -1 / 3]), [7.1, -1 / 3]]
+    assert EMBEDDING_CACHE.value(kind="chunk", result="hit") == hits + 2
+
+
+def test_cache_is_per_model(model, cache_path):
+    CachedEmbeddings(model, "model-a", path=cache_path).embed_documents(["текст"])
+    CachedEmbeddings(model, "model-b", path=cache_path).embed_documents(["текст"])
+    assert model.calls == [["текст"], ["текст"]]
+
+
+def test_unused_vectors_expire_and_hits_are_kept(model, cache_path):
+    embeddings = CachedEmbeddings(model, "fake", path=cache_path, max_age_days=30)
+    embeddings.embed_documents(["старый", "нужный"])
+    conn = sqlite3.connect(cache_path)
+    with conn:
+        conn.execute("UPDATE embeddings SET created = julianday('now') - 60")
+
+    embeddings.embed_documents(["нужный"])
+
+    keys = {key for (key,) in conn.execute("SELECT key FROM embeddings")}
+    conn.close()
+    assert keys == {embeddings._key("нужный")}
+    assert len(model.calls) == 1
+
+
+def test_query_lru(model, cache_path):
+    embeddings = CachedEmbeddings(model, "fake", path=cache_path, query_cache_size=2)
+    embeddings.embed_query("а?")
+    embeddings.embed_query("бб?")
+    assert embeddings.embed_query("а?") == [2.1, -1 / 3]  # попадание делает «а?» самым свежим
+    embeddings.embed_query("ввв?")
+
+    assert model.calls == [["а?"], ["бб?"], ["ввв?"]]
+    assert embeddings.cached_query("бб?") is None
+    assert embeddings.cached_query("а?") == [2.1, -1 / 3]
+
+    assert embeddings.embed_queries(["а?", "гггг?", "ввв?"]) == [[2.1, -1 / 3], [5.1, -1 / 3], [4.1, -1 / 3]]
+    assert model.calls[-1] == ["гггг?"]
+
+
+def test_query_cache_can_be_disabled(model, cache_path):
+    embeddings = CachedEmbeddings(model, "fake", path=cache_path, query_cache_size=0)
+    embeddings.embed_query("вопрос")
+    embeddings.embed_query("вопрос")
+    assert len(model.calls) == 2 and embeddings.cached_query("вопрос") is None
@@ -0,0 +1,63 @@
+import os
+import types
+
+import pytest
+
+from rag import index_versions
+
+
+@pytest.fixture(autouse=True)
+def chroma_dir(tmp_path, monkeypatch):
+    """Корень индексов во временной папке; удаление по таймеру не запускается — gc вызывается явно"""
+    monkeypatch.setattr(index_versions, "CHROMA_DIR", str(tmp_path))
+    monkeypatch.setattr(index_versions, "CURRENT_FILE", str(tmp_path / "CURRENT"))
+    monkeypatch.setattr(index_versions, "HISTORY_FILE", str(tmp_path / "HISTORY"))
+    monkeypatch.setattr(index_versions, "_cached", (None, str(tmp_path)))
+    monkeypatch.setattr(index_versions, "threading", types.SimpleNamespace(Timer=_NoTimer))
+    return tmp_path
+
+
+class _NoTimer:
+    def __init__(self, *args, **kwargs):
+        self.daemon = False
+
+    def start(self):
+        pass
+
+
+def _versions(root) -> list:
+    return sorted(name for name in os.listdir(root) if name.startswith(index_versions.VERSION_PREFIX))
+
+
+def test_new_index_dirs_are_unique_within_a_second():
+    paths = [index_versions.new_index_dir() for _ in range(3)]
+    assert len(set(paths)) == 3
+    names = [os.path.basename(path) for path in paths]
+    assert sorted(names, key=index_versions._creation_key) == names
+
+
+def test_activate_switches_current_and_gc_keeps_active_and_previous(chroma_dir):
+    # Индекс в корне (раскладка до версий) активен, пока нет CURRENT
+    (chroma_dir / "chroma.sqlite3").write_bytes(b"")
+    assert index_versions.get_active_index_dir() == str(chroma_dir)
+
+    first = index_versions.new_index_dir()
+    index_versions.activate_index_dir(first)
+    assert index_versions.get_active_index_dir() == first
+
+    abandoned = index_versions.new_index_dir()  # перестройка, которую так и не активировали
+    second = index_versions.new_index_dir()
+    index_versions.activate_index_dir(second)
+    assert index_versions.get_active_index_dir() == second
+    building = index_versions.new_index_dir()  # перестройка, которая ещё идёт
+
+    index_versions.gc_index_dirs()
+    # Предыдущая версия ещё может обслуживать запросы, начатые до переключения
+    assert _versions(chroma_dir) == sorted(os.path.basename(p) for p in (first, second, building))
+    assert not (chroma_dir / "chroma.sqlite3").exists()
+    assert not os.path.exists(abandoned)
+
+    index_versions.activate_index_dir(building)
+    index_versions.gc_index_dirs()
+    assert _versions(chroma_dir) == sorted(os.path.basename(p) for p in (second, building))
+    assert index_versions._read_history() == [os.path.basename(p) for p in (first, second, building)]
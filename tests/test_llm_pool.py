@@ -0,0 +1,88 @@
+# tests/test_llm_pool.py
+import random
+import threading
+
+import pytest
+
+from benchmarks.stub_llm import StubLLMServer
+from rag.llm_pool import LLMPool, LLMUnavailableError
+
+ANSWER = "".join(f"слово{i} " for i in range(5))
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(**kwargs):
+        options = {"tokens": 5, "first_token_delay": 0, "token_delay": 0}
+        options.update(kwargs)
+        server = StubLLMServer(**options).start()
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.stop()
+
+
+@pytest.fixture
+def first_candidate(monkeypatch):
+    """Из равнозагруженных серверов выбирается первый в списке — порядок попыток предсказуем"""
+    monkeypatch.setattr(random, "choice", lambda candidates: candidates[0])
+
+
+def _pool(*servers):
+    return LLMPool([server.url for server in servers], model="stub", health_interval=0)
+
+
+def test_requests_go_to_least_outstanding_backend(servers):
+    first, second = servers(first_token_delay=0.3), servers(first_token_delay=0.3)
+    pool = _pool(first, second)
+
+    answers = []
+    threads = [threading.Thread(target=lambda: answers.append(pool.invoke("вопрос"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert answers == [ANSWER] * 4
+    assert (first.requests, second.requests) == (2, 2)
+    assert [backend.outstanding for backend in pool.backends] == [0, 0]
+
+
+def test_invoke_retries_on_another_backend_after_partial_output(servers, first_candidate):
+    failing, healthy = servers(fail_after_tokens=2), servers()
+    pool = _pool(failing, healthy)
+
+    assert pool.invoke("вопрос") == ANSWER
+    assert (failing.requests, healthy.requests) == (1, 1)
+    assert not pool.backends[0].healthy
+
+
+def test_stream_retries_only_before_first_token(servers, first_candidate):
+    down, healthy = servers(), servers()
+    down.stop()
+    pool = _pool(down, healthy)
+    assert "".join(pool.stream("вопрос")) == ANSWER
+    assert healthy.requests == 1
+
+    failing, spare = servers(fail_after_tokens=2), servers()
+    pool = _pool(failing, spare)
+    tokens = []
+    with pytest.raises(Exception) as error:
+        for token in pool.stream("вопрос"):
+            tokens.append(token)
+    # Начатый ответ уже показан: повтор на другом сервере склеил бы два разных ответа
+    assert not isinstance(error.value, LLMUnavailableError)
+    assert tokens == ["слово0 ", "слово1 "]
+    assert spare.requests == 0
+
+
+def test_all_backends_down(servers):
+    first, second = servers(), servers()
+    first.stop()
+    second.stop()
+    with pytest.raises(LLMUnavailableError):
+        _pool(first, second).invoke("вопрос")
@@ -0,0 +1,74 @@
+# tests/test_pool.py
+import threading
+import time
+
+import pytest
+
+from rag.pool import RagWorkerPool, TokenBucket, RagRateLimitedError, RagSupersededError
+
+
+def _blocked_pool(max_queue=50, limiter=None):
+    """Пул с одним воркером, занятым до gate.set(): остальные запросы копятся в очереди"""
+    gate = threading.Event()
+    order = []
+
+    def work(tag):
+        gate.wait(5)
+        order.append(tag)
+        return tag
+
+    pool = RagWorkerPool(max_workers=1, max_queue=max_queue, limiter=limiter or TokenBucket(0, 0))
+    running = pool.submit(work, "running", user="A")
+    deadline = time.monotonic() + 5
+    while pool.queue_position(running) != 0 or pool.pending != 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return pool, gate, order, work
+
+
+def test_round_robin_order_matches_queue_positions():
+    pool, gate, order, work = _blocked_pool()
+    futures = {}
+    for tag, user in [("A1", "A"), ("A2", "A"), ("A3", "A"), ("B1", "B"), ("B2", "B"), ("C1", "C")]:
+        futures[tag] = pool.submit(work, tag, user=user)
+
+    positions = {tag: pool.queue_position(future) for tag, future in futures.items()}
+    gate.set()
+    for future in futures.values():
+        future.result(5)
+
+    expected = ["A1", "B1", "C1", "A2", "B2", "A3"]
+    assert order == ["running"] + expected
+    assert positions == {tag: i for i, tag in enumerate(expected, 1)}
+    assert pool.queue_position(futures["A1"]) == 0
+
+
+def test_supersede_drops_only_queued_requests_of_same_user():
+    pool, gate, order, work = _blocked_pool()
+    old = pool.submit(work, "old", user="A", supersede=True)
+    other = pool.submit(work, "other", user="B", supersede=True)
+    new = pool.submit(work, "new", user="A", supersede=True)
+
+    with pytest.raises(RagSupersededError):
+        old.result(1)
+    gate.set()
+    assert new.result(5) == "new"
+    assert other.result(5) == "other"
+    assert order == ["running", "other", "new"]
+
+
+def test_rate_limit_checks_on_submit_and_charges_on_consume():
+    limiter = TokenBucket(burst=1, rate_per_minute=6)
+    pool, gate, _, work = _blocked_pool(limiter=limiter)
+
+    # Без обращения к LLM (кэш, поиск) токен не списывается
+    pool.submit(work, "cached", user="A", limited=True)
+    pool.submit(work, "llm", user="A", limited=True)
+    limiter.consume("A")
+    with pytest.raises(RagRateLimitedError) as error:
+        pool.submit(work, "over", user="A", limited=True)
+    assert 0 < error.value.retry_after <= 10
+
+    # Без limited лимит не применяется
+    pool.submit(work, "search", user="A")
+    gate.set()
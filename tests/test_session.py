@@ -0,0 +1,66 @@
+# tests/test_session.py
+import asyncio
+import weakref
+
+import pytest
+
+from auth import session
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    """Redis в памяти процесса (REDIS_URL=fakeredis://) и пустые локальные кэши на каждый тест"""
+    monkeypatch.setattr(session, "REDIS_URL", "fakeredis://")
+    monkeypatch.setattr(session, "_fake_server", None)
+    monkeypatch.setattr(session, "_redis", None)
+    monkeypatch.setattr(session, "_async_clients", weakref.WeakKeyDictionary())
+    monkeypatch.setattr(session, "_sessions", session._LocalCache(30))
+    monkeypatch.setattr(session, "_locks", session._LocalCache(30))
+
+
+def _forget_local():
+    """Как будто запрос пришёл в другой процесс: в памяти ничего нет, всё читается из Redis"""
+    session._sessions = session._LocalCache(30)
+    session._locks = session._LocalCache(30)
+
+
+def test_lockout_after_max_attempts_and_reset_on_login():
+    async def scenario():
+        for attempt in range(1, session.MAX_LOGIN_ATTEMPTS + 1):
+            assert await session.aincrement_login_attempts(42) == attempt
+            assert (await session.acheck_user(42))[0] == (attempt >= session.MAX_LOGIN_ATTEMPTS)
+
+        ttl = await session.get_async_redis().ttl(session._attempts_key(42))
+        _forget_local()
+        locked_in_redis = (await session.acheck_user(42))[0]
+
+        session_id = await session.acreate_session(42, "ivanov", "Иванов И.")
+        _forget_local()
+        return ttl, locked_in_redis, await session.acheck_user(42, session_id)
+
+    ttl, locked_in_redis, after_login = asyncio.run(scenario())
+    # Счётчик живёт LOCKOUT_MINUTES с первой неудачи и не продлевается следующими
+    assert 0 < ttl <= session.LOCKOUT_MINUTES * 60
+    assert locked_in_redis
+    assert after_login == (False, {"user_id": 42, "username": "ivanov", "full_name": "Иванов И."})
+
+
+def test_session_is_cached_in_memory():
+    async def scenario():
+        session_id = await session.acreate_session(7, "petrov", "Петров П.")
+        _forget_local()
+        from_redis = await session.acheck_user(7, session_id)
+
+        # Запись удалена из Redis, но в пределах SESSION_CACHE_TTL ответ берётся из памяти
+        await session.get_async_redis().delete(session_id)
+        from_memory = await session.acheck_user(7, session_id)
+        _forget_local()
+        expired = await session.acheck_user(7, session_id)
+        unknown = await session.acheck_user(7, "нет-такой-сессии")
+        return from_redis, from_memory, expired, unknown
+
+    from_redis, from_memory, expired, unknown = asyncio.run(scenario())
+    assert from_redis == (False, {"user_id": 7, "username": "petrov", "full_name": "Петров П."})
+    assert from_memory == from_redis
+    assert expired == (False, None)
+    assert unknown == (False, None)